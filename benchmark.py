@@ -0,0 +1,466 @@
+import argparse
+import glob
+import os
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import types
+from typing import List
+
+import numpy as np
+
+from src.database import DbActor
+from src.model import Element
+from src.graph import LinkGraph, load_link_graph_from, spill_links
+from src.pagerank import (
+    build_pages,
+    build_transition,
+    loop_page_rank,
+    out_of_core_page_rank,
+    parallel_page_rank,
+    sparse_page_rank,
+)
+from src.parser import Parser
+from src.rankerer import PageRankerer
+from src.settings import DATABASE_FILENAME, SEGMENTS_DIRECTORY
+
+
+def benchmark_parser(files_pattern: str):
+    file_names = glob.glob(files_pattern, recursive=True)
+    if not file_names:
+        print(f"No html files found by {files_pattern}")
+        exit(1)
+
+    texts = []
+    for name in file_names:
+        with open(name, errors="replace") as f:
+            texts.append(f.read())
+
+    timings = {}
+    results = {}
+    for engine in Parser.ENGINES:
+        parser = Parser(engine)
+        start = time.perf_counter()
+        results[engine] = [parser.parse_text_elements(text) for text in texts]
+        timings[engine] = time.perf_counter() - start
+
+    mismatched = [
+        name
+        for name, soup_elements, stream_elements in zip(
+            file_names, results["soup"], results["stream"]
+        )
+        if soup_elements != stream_elements
+    ]
+
+    total_size = sum(len(text) for text in texts) / 1024 / 1024
+    print(f"Pages: {len(texts)} ({total_size:.2f} MB)")
+    for engine, elapsed in timings.items():
+        print(f"{engine:>8}: {elapsed:.3f} s, {len(texts) / elapsed:.1f} pages/s")
+    print(f"Speedup: {timings['soup'] / timings['stream']:.2f}x")
+    print(f"Pages with different elements: {len(mismatched)} {mismatched[:3]}")
+
+
+def _generate_pages(pages_count: int, words_per_page: int) -> List[List[Element]]:
+    random.seed(0)
+    vocabulary = [f"слово{i}" for i in range(5000)]
+    pages = []
+    for page in range(pages_count):
+        elements = []
+        for location in range(words_per_page):
+            href = ""
+            if location % 10 < 3:
+                # no quotes, the baseline DbActor does not escape urls
+                href = f"https://example.com/{page}/{location // 10}?q={location}"
+            elements.append(
+                Element(word=random.choice(vocabulary), location=location, href=href)
+            )
+        pages.append(elements)
+    return pages
+
+
+# DbActor before the inserts were moved to prepared statements, the
+# baseline of the bulk_insert benchmark
+BASELINE_COMMIT = "e458c06"
+
+
+def _load_baseline_db_actor():
+    source = subprocess.run(
+        ["git", "show", f"{BASELINE_COMMIT}:src/database.py"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    module = types.ModuleType("baseline_database")
+    exec(compile(source, f"{BASELINE_COMMIT}:src/database.py", "exec"), module.__dict__)
+    return module.DbActor
+
+
+def _time_inserts(db, pages: List[List[Element]]) -> float:
+    """Pages written the way the crawler wrote them, a commit per page, the
+    baseline DbActor commits in every insert method instead."""
+    start = time.perf_counter()
+    for page, elements in enumerate(pages):
+        url_id = db.insert_url(f"https://example.com/{page}")
+        db.insert_links_from_elements(elements)
+        db.insert_words_from_elements(elements)
+        db.insert_links_between_by_elements(elements, url_id)
+        db.fill_words_locations_by_elements(elements, url_id)
+        db.fill_link_words_by_elements(elements)
+        if isinstance(db, DbActor):
+            db.commit()
+    return time.perf_counter() - start
+
+
+def benchmark_bulk_insert(pages_count: int, words_per_page: int):
+    baseline_db_actor = _load_baseline_db_actor()
+    elapsed = dict()
+    # both in memory, the baseline DbActor keeps a new db in memory
+    for name, create_db in (
+        (f"baseline {BASELINE_COMMIT}", baseline_db_actor),
+        ("executemany", lambda: DbActor(storage="memory")),
+    ):
+        # elements get their ids assigned, every run gets its own pages
+        pages = _generate_pages(pages_count, words_per_page)
+        with tempfile.TemporaryDirectory() as directory:
+            current_directory = os.getcwd()
+            os.chdir(directory)
+            try:
+                db = create_db()
+                elapsed[name] = _time_inserts(db, pages)
+                db.close()
+            finally:
+                os.chdir(current_directory)
+
+    rows_count = pages_count * words_per_page
+    print(f"Pages: {pages_count}, word locations: {rows_count}")
+    for name, seconds in elapsed.items():
+        print(f"{name:>20}: {seconds:.3f} s, {rows_count / seconds:.0f} rows/s")
+    baseline_elapsed, executemany_elapsed = elapsed.values()
+    print(f"Speedup: {baseline_elapsed / executemany_elapsed:.2f}x")
+
+
+def benchmark_crawl_inserts(pages_count: int, words_per_page: int, chunks_count: int = 5):
+    """Pages written like a fresh crawl, into a db on disk without indexes
+    until the end, every page is a url found as a link on an earlier page.
+    Every chunk of pages should take about as long as the first one."""
+    pages = _generate_pages(pages_count, words_per_page)
+    chunk_size = max(pages_count // chunks_count, 1)
+    elapsed = []
+    with tempfile.TemporaryDirectory() as directory:
+        current_directory = os.getcwd()
+        os.chdir(directory)
+        try:
+            db = DbActor(deferred_indexes=True)
+            for start in range(0, pages_count, chunk_size):
+                chunk_start = time.perf_counter()
+                for page in range(start, min(start + chunk_size, pages_count)):
+                    elements = pages[page]
+                    url = pages[page - 1][0].href if page else "https://example.com"
+                    url_id = db.insert_url(url)
+                    db.insert_links_from_elements(elements)
+                    db.insert_words_from_elements(elements)
+                    db.insert_links_between_by_elements(elements, url_id)
+                    db.fill_words_locations_by_elements(elements, url_id)
+                    db.fill_link_words_by_elements(elements)
+                    db.commit()
+                elapsed.append(time.perf_counter() - chunk_start)
+            db.close()
+        finally:
+            os.chdir(current_directory)
+
+    print(f"Pages: {pages_count}, words per page: {words_per_page}")
+    for chunk, seconds in enumerate(elapsed):
+        print(f"{f'chunk {chunk}':>10}: {seconds:.3f} s")
+    print(f"Last chunk / first chunk: {elapsed[-1] / elapsed[0]:.2f}x")
+
+
+def benchmark_postings(pages_count: int, words_per_page: int):
+    pages = _generate_pages(pages_count, words_per_page)
+    query_words = ["слово1", "слово2"]
+
+    print(f"Pages: {pages_count}, word locations: {pages_count * words_per_page}")
+    for layout in DbActor.INDEX_LAYOUTS:
+        with tempfile.TemporaryDirectory() as directory:
+            current_directory = os.getcwd()
+            os.chdir(directory)
+            try:
+                db = DbActor(storage="disk", index_layout=layout)
+                for page, elements in enumerate(pages):
+                    url_id = db.insert_url(f"https://example.com/{page}")
+                    db.insert_words_from_elements(elements)
+                    db.fill_words_locations_by_elements(elements, url_id)
+                    db.commit()
+                if layout == "segments":
+                    while db.segment_store.merge_once():
+                        pass
+                start = time.perf_counter()
+                combinations = db.get_words_location_combinations(query_words)
+                search_elapsed = time.perf_counter() - start
+                db.close()
+                db_size = os.path.getsize(DATABASE_FILENAME)
+                for name in glob.glob(os.path.join(SEGMENTS_DIRECTORY, "*")):
+                    db_size += os.path.getsize(name)
+                db_size /= 1024 * 1024
+            finally:
+                os.chdir(current_directory)
+        print(
+            f"{layout:>9}: {db_size:.2f} MB, search {search_elapsed * 1000:.1f} ms, "
+            f"{len(combinations)} combinations"
+        )
+
+
+def _generate_graph(nodes_count: int, links_per_node: int):
+    """Links with power law in degrees, the last tenth of the nodes has no
+    outgoing links."""
+    generator = np.random.default_rng(0)
+    links_count = nodes_count * links_per_node
+    from_indexes = generator.integers(0, max(nodes_count * 9 // 10, 1), links_count)
+    # zipf ranks shuffled so popular pages are spread over all ids
+    popularity = generator.permutation(nodes_count)
+    to_indexes = popularity[(generator.zipf(1.5, links_count) - 1) % nodes_count]
+    return from_indexes, to_indexes
+
+
+def benchmark_pagerank(nodes_count: int, links_per_node: int):
+    from_indexes, to_indexes = _generate_graph(nodes_count, links_per_node)
+    damping = 0.85
+    iterations = 25
+
+    graph = LinkGraph.from_links(np.arange(nodes_count), from_indexes, to_indexes)
+
+    start = time.perf_counter()
+    pages = build_pages(graph)
+    loop_page_rank(pages, iterations, damping)
+    loop_elapsed = time.perf_counter() - start
+    loop_ranks = np.array([pages[node].rank for node in range(nodes_count)])
+
+    start = time.perf_counter()
+    parity = sparse_page_rank(
+        build_transition(graph), graph.out_degrees, damping, tolerance=0.0,
+        max_iterations=iterations, redistribute_dangling=False,
+    )
+    sparse_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    converged = sparse_page_rank(
+        build_transition(graph), graph.out_degrees, damping, tolerance=1e-6,
+        max_iterations=100,
+    )
+    converged_elapsed = time.perf_counter() - start
+
+    difference = np.abs(parity.ranks - loop_ranks).max() / loop_ranks.max()
+    print(f"Nodes: {nodes_count}, links: {len(from_indexes)}")
+    print(f"{'loop':>16}: {loop_elapsed:.3f} s, {iterations} iterations")
+    print(f"{'sparse parity':>16}: {sparse_elapsed:.3f} s, {iterations} iterations")
+    print(
+        f"{'sparse':>16}: {converged_elapsed:.3f} s, {converged.iterations} iterations, "
+        f"residual {converged.residual:.2e}"
+    )
+    print(f"Speedup: {loop_elapsed / sparse_elapsed:.2f}x")
+    print(f"Max relative difference to loop: {difference:.2e}")
+
+
+def _write_links(db: DbActor, from_id: int, to_ids: np.ndarray) -> None:
+    elements = [
+        Element(word="", href=f"http://{to_id}.com", link_id=to_id)
+        for to_id in to_ids.tolist()
+    ]
+    db.insert_links_between_by_elements(elements, from_id)
+
+
+def _timed_ranks(rankerer: PageRankerer, calculate) -> tuple:
+    start = time.perf_counter()
+    calculate()
+    elapsed = time.perf_counter() - start
+    ranks = dict(rankerer.db.iter_page_ranks())
+    rankerer.close()
+    return elapsed, ranks
+
+
+def benchmark_pagerank_update(nodes_count: int, links_per_node: int, new_nodes_count: int):
+    """update_ranks against calculate_ranks on a db, both read the links from
+    the db and write the ranks back."""
+    from_indexes, to_indexes = _generate_graph(nodes_count, links_per_node)
+    # url ids start at 1
+    from_ids, to_ids = from_indexes + 1, to_indexes + 1
+    order = np.argsort(from_ids, kind="stable")
+    from_ids, to_ids = from_ids[order], to_ids[order]
+    bounds = np.searchsorted(from_ids, np.arange(1, nodes_count + 2))
+
+    with tempfile.TemporaryDirectory() as directory:
+        current_directory = os.getcwd()
+        os.chdir(directory)
+        try:
+            db = DbActor()
+            db.insert_url_rows(
+                (url_id, f"http://{url_id}.com") for url_id in range(1, nodes_count + 1)
+            )
+            for url_id in range(1, nodes_count + 1):
+                _write_links(db, url_id, to_ids[bounds[url_id - 1] : bounds[url_id]])
+            db.commit()
+            rankerer = PageRankerer(use_snapshot=False, engine="sparse")
+            rankerer.calculate_ranks()
+            rankerer.close()
+
+            # new pages linking to random old pages, every one found on a
+            # recrawled old page
+            generator = np.random.default_rng(1)
+            for _ in range(new_nodes_count):
+                url_id = db.insert_url(f"http://{db.last_url_id + 1}.com")
+                _write_links(db, url_id, generator.integers(1, nodes_count + 1, links_per_node))
+                linking_id = int(generator.integers(1, nodes_count + 1))
+                old_targets = to_ids[bounds[linking_id - 1] : bounds[linking_id]]
+                db.delete_url_index(linking_id)
+                _write_links(db, linking_id, np.append(old_targets, url_id))
+            db.commit()
+            changes_count = len(db.get_page_rank_changes())
+            links_count = db.get_links_count()
+            db.close()
+
+            rankerer = PageRankerer(use_snapshot=False, engine="sparse")
+            update_elapsed, updated = _timed_ranks(rankerer, rankerer.update_ranks)
+            rankerer = PageRankerer(use_snapshot=False, engine="sparse")
+            full_elapsed, full = _timed_ranks(rankerer, rankerer.calculate_ranks)
+        finally:
+            os.chdir(current_directory)
+
+    url_ids = sorted(full)
+    updated_ranks = np.array([updated[url_id] for url_id in url_ids])
+    full_ranks = np.array([full[url_id] for url_id in url_ids])
+    # update keeps the scale of the stored ranks, only ratios matter
+    difference = np.abs(
+        updated_ranks / updated_ranks.sum() - full_ranks / full_ranks.sum()
+    ).max() / (full_ranks.max() / full_ranks.sum())
+    print(f"Urls: {nodes_count} + {new_nodes_count}, links: {links_count}")
+    print(f"Changed urls logged: {changes_count}")
+    print(f"{'full':>8}: {full_elapsed:.3f} s")
+    print(f"{'update':>8}: {update_elapsed:.3f} s")
+    print(f"Speedup: {full_elapsed / update_elapsed:.2f}x")
+    print(f"Max difference to full, relative to the top rank: {difference:.2e}")
+
+
+def _iter_links(from_indexes: np.ndarray, to_indexes: np.ndarray):
+    for start in range(0, len(from_indexes), 1 << 16):
+        end = start + (1 << 16)
+        yield from zip(from_indexes[start:end].tolist(), to_indexes[start:end].tolist())
+
+
+def benchmark_pagerank_out_of_core(nodes_count: int, links_per_node: int, block_size: int):
+    from_indexes, to_indexes = _generate_graph(nodes_count, links_per_node)
+    damping = 0.85
+
+    # numpy allocations are traced, the generated links are not counted
+    tracemalloc.start()
+    base_memory = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    graph = load_link_graph_from(np.arange(nodes_count), _iter_links(from_indexes, to_indexes))
+    in_memory = sparse_page_rank(
+        build_transition(graph), graph.out_degrees, damping, tolerance=1e-6,
+        max_iterations=100,
+    )
+    in_memory_elapsed = time.perf_counter() - start
+    in_memory_peak = tracemalloc.get_traced_memory()[1] - base_memory
+    del graph
+
+    tracemalloc.reset_peak()
+    base_memory = tracemalloc.get_traced_memory()[0]
+    with tempfile.TemporaryDirectory(dir=os.getcwd()) as directory:
+        start = time.perf_counter()
+        edge_file = spill_links(
+            range(nodes_count), _iter_links(from_indexes, to_indexes),
+            os.path.join(directory, "links.bin"), block_size,
+        )
+        out_of_core = out_of_core_page_rank(
+            edge_file, damping, tolerance=1e-6, max_iterations=100, block_size=block_size
+        )
+        out_of_core_elapsed = time.perf_counter() - start
+        out_of_core_peak = tracemalloc.get_traced_memory()[1] - base_memory
+        del edge_file
+    tracemalloc.stop()
+
+    difference = np.abs(out_of_core.ranks - in_memory.ranks).max() / in_memory.ranks.max()
+    print(f"Nodes: {nodes_count}, links: {len(from_indexes)}, block: {block_size} links")
+    for name, elapsed, peak, result in (
+        ("sparse", in_memory_elapsed, in_memory_peak, in_memory),
+        ("out of core", out_of_core_elapsed, out_of_core_peak, out_of_core),
+    ):
+        print(
+            f"{name:>12}: {elapsed:.3f} s, peak {peak / 1024 / 1024:.1f} MB, "
+            f"{result.iterations} iterations"
+        )
+    print(f"Max relative difference: {difference:.2e}")
+
+
+def benchmark_pagerank_parallel(nodes_count: int, links_per_node: int):
+    from_indexes, to_indexes = _generate_graph(nodes_count, links_per_node)
+    damping = 0.85
+    graph = LinkGraph.from_links(np.arange(nodes_count), from_indexes, to_indexes)
+
+    start = time.perf_counter()
+    single = sparse_page_rank(
+        build_transition(graph), graph.out_degrees, damping, tolerance=1e-6,
+        max_iterations=100,
+    )
+    single_elapsed = time.perf_counter() - start
+
+    print(f"Nodes: {nodes_count}, links: {graph.links_count}, cores: {os.cpu_count()}")
+    print(f"{'sparse':>12}: {single_elapsed:.3f} s, {single.iterations} iterations")
+    processes = 1
+    while processes <= os.cpu_count():
+        start = time.perf_counter()
+        parallel = parallel_page_rank(
+            graph, damping, tolerance=1e-6, max_iterations=100, processes=processes
+        )
+        elapsed = time.perf_counter() - start
+        print(
+            f"{f'{processes} processes':>12}: {elapsed:.3f} s, "
+            f"speedup {single_elapsed / elapsed:.2f}x, "
+            f"same ranks: {np.array_equal(parallel.ranks, single.ranks)}"
+        )
+        processes *= 2
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("command", metavar="<command [parser, bulk_insert, crawl_inserts, postings, pagerank, pagerank_update, pagerank_out_of_core, pagerank_parallel]>", type=str,
+                        help="Available benchmarks: parser, bulk_insert, crawl_inserts, postings, pagerank, pagerank_update, pagerank_out_of_core, pagerank_parallel", )
+    parser.add_argument("--files", type=str, default="search_results/*.html",
+                        help="Glob of html pages for the parser benchmark", )
+    parser.add_argument("--pages", type=int, default=200,
+                        help="Pages count for the bulk_insert, crawl_inserts and postings benchmarks", )
+    parser.add_argument("--words", type=int, default=2000,
+                        help="Words per page for the bulk_insert, crawl_inserts and postings benchmarks", )
+    parser.add_argument("--nodes", type=int, default=20000,
+                        help="Nodes count of the pagerank benchmark graph", )
+    parser.add_argument("--links", type=int, default=10,
+                        help="Links per node of the pagerank benchmark graph", )
+    parser.add_argument("--new-nodes", type=int, default=20,
+                        help="Nodes added to the graph in the pagerank_update benchmark", )
+    parser.add_argument("--block", type=int, default=1 << 18,
+                        help="Links per block of the pagerank_out_of_core benchmark", )
+
+    args = parser.parse_args()
+
+    if args.command == "parser":
+        benchmark_parser(args.files)
+    elif args.command == "bulk_insert":
+        benchmark_bulk_insert(args.pages, args.words)
+    elif args.command == "crawl_inserts":
+        benchmark_crawl_inserts(args.pages, args.words)
+    elif args.command == "postings":
+        benchmark_postings(args.pages, args.words)
+    elif args.command == "pagerank":
+        benchmark_pagerank(args.nodes, args.links)
+    elif args.command == "pagerank_update":
+        benchmark_pagerank_update(args.nodes, args.links, args.new_nodes)
+    elif args.command == "pagerank_out_of_core":
+        benchmark_pagerank_out_of_core(args.nodes, args.links, args.block)
+    elif args.command == "pagerank_parallel":
+        benchmark_pagerank_parallel(args.nodes, args.links)
+    else:
+        print(f"Available benchmarks: parser, bulk_insert, crawl_inserts, postings, pagerank, pagerank_update, pagerank_out_of_core, pagerank_parallel.\nGot: {args.command}")
+        exit(1)
@@ -1,29 +1,38 @@
-from src.crawler import start_crawler
-from src.rankerer import calculate_ranks
+from src.crawler import start_crawler, update_crawler
+from src.database import migrate_db
+from src.rankerer import calculate_ranks, update_ranks
+from src.snapshot import export_snapshot, import_snapshot
 from src.flask import run_flask 
 
 import argparse
 
 import argparse
 
-parser = argparse.ArgumentParser()
+# worker processes of the parse stage and the ranker import this module again
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
 
-parser.add_argument("command", metavar="<command [start_crawler, calculate_ranks, run_flask]>", type=str,
-                    help="Available commands: start_crawler, calculate_ranks, run_flask", )
+    parser.add_argument("command", metavar="<command [start_crawler, update_crawler, calculate_ranks, update_ranks, run_flask, migrate, export, import]>", type=str,
+                        help="Available commands: start_crawler, update_crawler, calculate_ranks, update_ranks, run_flask, migrate, export, import", )
 
-args = parser.parse_args()
+    args = parser.parse_args()
 
-COMMANDS_MAPPING = {
-    "start_crawler": start_crawler,
-    "run_flask": run_flask,
-    "calculate_ranks": calculate_ranks,
-}
+    COMMANDS_MAPPING = {
+        "start_crawler": start_crawler,
+        "update_crawler": update_crawler,
+        "run_flask": run_flask,
+        "calculate_ranks": calculate_ranks,
+        "update_ranks": update_ranks,
+        "migrate": migrate_db,
+        "export": export_snapshot,
+        "import": import_snapshot,
+    }
 
-command = COMMANDS_MAPPING.get(args.command)
+    command = COMMANDS_MAPPING.get(args.command)
 
-if not command:
-    print(
-        f"Available commands: start_crawler, calculate_ranks, run_flask.\nGot: {args.command}")
-    exit(1)
+    if not command:
+        print(
+            f"Available commands: start_crawler, update_crawler, calculate_ranks, update_ranks, run_flask, migrate, export, import.\nGot: {args.command}")
+        exit(1)
 
-command()
+    command()
@@ -2,89 +2,132 @@ import asyncio
 import contextlib
 import csv
 import datetime
+import glob
 import os
-import re
+import queue
+import shutil
 import threading
 import time
-from typing import List
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Deque, List, Optional, Tuple
 
-import aiohttp
-import bs4
-from bs4 import BeautifulSoup, Comment
 from loguru import logger
-from sqlalchemy.exc import SQLAlchemyError
 
 from src.database import DbActor
-from src.model import Element, FetchedUrl, LinkToGo
-from src.settings import STATISTICS_FILENAME, DATABASE_FILENAME
+from src.dedup import FingerprintIndex
+from src.fetcher import Fetcher, FetchWindow
+from src.frontier import Frontier
+from src.indexer import IndexWriter
+from src.model import Element, FetchedUrl, LinkToGo, ParsedPage
+from src.parser import Parser, parse_compact, parse_page
+from src.politeness import HostScheduler, RobotsCache
+from src.segments import SegmentMerger
+from src.settings import (
+    DATABASE_FILENAME,
+    SEGMENTS_DIRECTORY,
+    SHARD_FILENAME_TEMPLATE,
+    PARSE_WORKERS_COUNT,
+    STATISTICS_FILENAME,
+)
 
 
 def start_crawler():
+    database_filenames = [DATABASE_FILENAME] + glob.glob(
+        SHARD_FILENAME_TEMPLATE.format(shard="*")
+    )
+    for database_filename in database_filenames:
+        for file_name in (
+            database_filename,
+            f"{database_filename}-wal",
+            f"{database_filename}-shm",
+        ):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(file_name)
     with contextlib.suppress(FileNotFoundError):
-        os.remove(DATABASE_FILENAME)
         os.remove(STATISTICS_FILENAME)
+    shutil.rmtree(SEGMENTS_DIRECTORY, ignore_errors=True)
 
-    Crawler().start_crawl()
+    # a fresh db is bulk loaded, indexes are built once at the end
+    Crawler(deferred_indexes=True).start_crawl()
+
+
+def update_crawler():
+    Crawler(incremental=True).start_crawl()
 
 
 class Crawler:
     START_URL_LIST = [LinkToGo("https://ngs.ru/"), LinkToGo("https://lenta.ru/")]
     MAX_DEPTH = 2
-    FETCH_EXCEPTION_SLEEP_INTERVAL = 0.25
-    FETCH_MAX_RETRIES_COUNT = 3
-    FETCH_BATCH_SIZE = 30
-    FETCH_TOTAL_TIMEOUT = 10
-    FETCH_CONNECT_TIMEOUT = 2
-    IDLE_WORK_SLEEP_INTERVAL = 5
-    IDLE_COUNT_BEFORE_EXIT = 3
-    STAT_INTERVAL = 2
-
-    def __init__(self, url_list=START_URL_LIST, depth=MAX_DEPTH) -> None:
+    FETCH_WINDOW_SIZE = 30
+    FETCH_STAT_INTERVAL = 5
+    HOST_RATE = 2.0
+    HOST_BURST = 2
+    FETCHED_QUEUE_SIZE = 60
+    PARSED_QUEUE_SIZE = 60
+    FRONTIER_WAIT_TIMEOUT = 1
+    PARSE_TASKS_PER_WORKER = 4
+
+    def __init__(
+        self,
+        url_list=START_URL_LIST,
+        depth=MAX_DEPTH,
+        parse_workers=PARSE_WORKERS_COUNT,
+        incremental=False,
+        deferred_indexes=False,
+    ) -> None:
         for url in url_list:
             url.link = url.link.strip("/")
         self.start_url_list = url_list[:]
-        self.urls_to_crawl = url_list[:]
-        self.crawled_urls = []
+        self.frontier = Frontier(url_list)
         self.depth = depth
-        self.db = DbActor()
+        self.db = DbActor(deferred_indexes)
+        self.deferred_indexes = deferred_indexes
         self.crawl_count = 0
         self.start_time = datetime.datetime.now(datetime.timezone.utc)
         self.error_processed_urls = []
-        self.pages_to_process: List[FetchedUrl] = []
+        # fetch -> parse -> index stages, None is the end of stream marker
+        self.fetched_pages: "queue.Queue[Optional[FetchedUrl]]" = queue.Queue(
+            self.FETCHED_QUEUE_SIZE
+        )
+        self.parsed_pages: "queue.Queue[Optional[ParsedPage]]" = queue.Queue(
+            self.PARSED_QUEUE_SIZE
+        )
         self.stop_flag = False
         self.parser = Parser()
+        # 0 parses in the parse thread, otherwise in a pool of worker processes
+        self.parse_workers = parse_workers
+        # incremental crawl keeps the index and skips pages that did not change
+        self.url_states = self.db.get_url_states() if incremental else dict()
+        self.fingerprints = FingerprintIndex()
+        self.fingerprints.load(self.db.get_fingerprints())
 
     def start_crawl(self):
-        logger.info(f"Starting web crawler ... urls_to_crawl={self.urls_to_crawl}")
+        logger.info(f"Starting web crawler ... urls_to_crawl={self.start_url_list}")
         self._create_stat_csv()
+        fetch_thread = threading.Thread(target=self.async_fetch_urls)
+        parse_thread = threading.Thread(target=self.parse_pages)
+        segment_merger = None
+        if self.db.index_layout == "segments":
+            segment_merger = SegmentMerger(self.db.segment_store)
+            segment_merger.start()
+        fetch_thread.start()
+        parse_thread.start()
         try:
-            fetch_thread = threading.Thread(target=self.async_fetch_urls)
-            fetch_thread.start()
-            time.sleep(2)
-            idle_counter = 0
-            while True:
-                if not self.pages_to_process:
-                    logger.debug(f"Empty pages to process - ({idle_counter}) Sleep ...")
-                    time.sleep(self.IDLE_WORK_SLEEP_INTERVAL)
-                    idle_counter += 1
-                    if idle_counter >= self.IDLE_COUNT_BEFORE_EXIT:
-                        break
-                    continue
-                try:
-                    page_to_process = self.pages_to_process.pop(0)
-                    idle_counter = 0
-                except IndexError:
-                    continue
-                self._crawl_iteration(page_to_process)
+            self.index_pages()
         except KeyboardInterrupt:
             logger.info("Crawler was stopped by user")
             self.stop_flag = True
         except Exception as e:
             logger.exception(e)
             logger.critical(f"Unexpected end of crawling - {e}")
+            self.stop_flag = True
         finally:
-            logger.debug("Wait fetch thread to end ...")
+            if self.stop_flag:
+                self._drain_parsed_pages()
+            logger.debug("Wait fetch and parse threads to end ...")
             fetch_thread.join()
+            parse_thread.join()
             logger.success(
                 f"Crawl finished. Crawled pages: {self.crawl_count}. Time elapsed: {(datetime.datetime.now(datetime.timezone.utc) - self.start_time).seconds / 60 :.2f} min. Started from: {self.start_url_list}"
             )
@@ -92,8 +135,14 @@ class Crawler:
                 logger.warning(
                     f"Unprocessed urls ({len(self.error_processed_urls)}): {self.error_processed_urls[:3]} ... {self.error_processed_urls[-3:]}"
                 )
+            if self.deferred_indexes:
+                logger.info("Creating indexes")
+                self.db.create_indexes()
             self.db.save_to_db_to_disk()
+            if segment_merger:
+                segment_merger.stop()
             self.db.close()
+            self.frontier.close()
 
     def _create_stat_csv(self):
         with open(STATISTICS_FILENAME, "w") as csv_file:
@@ -115,157 +164,228 @@ class Crawler:
             asyncio.run(self.fetch_urls())
         except (KeyboardInterrupt, RuntimeError):
             logger.info("Finished fetch thread")
+        finally:
+            self.fetched_pages.put(None)
 
     async def fetch_urls(self):
-        idle_counter = 0
+        robots = RobotsCache()
+        scheduler = HostScheduler(robots, self.HOST_RATE, self.HOST_BURST)
+        async with Fetcher(robots, self.url_states) as fetcher:
+            await self._fetch_frontier(fetcher, scheduler)
+
+        if self.stop_flag:
+            self.error_processed_urls.extend(link.link for link in scheduler.drain())
+            while self.frontier:
+                self.error_processed_urls.extend(
+                    link.link for link in self.frontier.pop_batch(self.FETCH_WINDOW_SIZE)
+                )
+        logger.info("Finishing fetch thread ...")
+
+    async def _fetch_frontier(self, fetcher: Fetcher, scheduler: HostScheduler):
+        window = FetchWindow(fetcher, self.FETCH_WINDOW_SIZE)
+        reported_at = time.monotonic()
         while True:
-            if self.stop_flag:
-                self.error_processed_urls.extend(self.urls_to_crawl)
-                break
-
-            if not self.urls_to_crawl:
-                logger.debug(f"Empty urls to fetch ({idle_counter}). Sleeping ...")
-                await asyncio.sleep(self.IDLE_WORK_SLEEP_INTERVAL)
-                idle_counter += 1
-                if idle_counter >= self.IDLE_COUNT_BEFORE_EXIT:
+            if not self.stop_flag:
+                for link in self.frontier.pop_batch(scheduler.free_buffer):
+                    scheduler.push(link)
+                for link in scheduler.pop_ready(window.free_slots):
+                    window.submit(link)
+
+            if not window:
+                if self.stop_flag or self.frontier.is_exhausted():
                     break
+                if scheduler:
+                    # every host with queued links is over its rate
+                    await asyncio.sleep(scheduler.next_ready_in())
+                    continue
+                # links are still being parsed, wait until they reach the frontier
+                await asyncio.to_thread(
+                    self.frontier.wait_for_work, self.FRONTIER_WAIT_TIMEOUT
+                )
                 continue
 
-            urls_batch: List[LinkToGo] = self.urls_to_crawl[: self.FETCH_BATCH_SIZE]
-            self.urls_to_crawl = self.urls_to_crawl[self.FETCH_BATCH_SIZE :]
-
-            async def fetch(session: aiohttp.ClientSession, link: LinkToGo):
-                retries_count = 0
-                while retries_count < self.FETCH_MAX_RETRIES_COUNT:
-                    try:
-                        async with session.get(link.link) as response:
-                            text = await response.text()
-                            logger.debug(f"Fetched {link.link}")
-                            return FetchedUrl(
-                                url=link.link, text=text, depth=link.depth
-                            )
-                    except (
-                        aiohttp.ServerTimeoutError,
-                        aiohttp.ServerConnectionError,
-                        aiohttp.ClientConnectionError,
-                        asyncio.exceptions.TimeoutError,
-                    ) as e:
-                        retries_count += 1
-                        logger.warning(f"{link.link} - {repr(e)} - {retries_count}")
-                        await asyncio.sleep(self.FETCH_EXCEPTION_SLEEP_INTERVAL)
-                    except (aiohttp.TooManyRedirects, UnicodeDecodeError):
-                        break
-                    except Exception as e:
-                        logger.error(e)
-                        break
-
-                self.error_processed_urls.append(link.link)
-                logger.error(f"Max retries exceed - {link.link}")
-                return FetchedUrl(url="", text="")
-
-            timeout = aiohttp.ClientTimeout(
-                total=self.FETCH_TOTAL_TIMEOUT, connect=self.FETCH_CONNECT_TIMEOUT
-            )
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                results: List[FetchedUrl] = await asyncio.gather(
-                    *[fetch(session, url) for url in urls_batch], return_exceptions=True
+            # the timeout lets free slots pick up newly discovered links
+            # and hosts whose rate allows the next request
+            timeout = self.FRONTIER_WAIT_TIMEOUT
+            if window.free_slots and scheduler:
+                timeout = min(timeout, scheduler.next_ready_in())
+            results = await window.wait_completed(timeout)
+            for result in results:
+                if not result.text and not result.not_modified:
+                    self.error_processed_urls.append(result.url)
+                    self.frontier.task_done()
+                    continue
+                # blocks while the parse stage is behind
+                await asyncio.to_thread(self.fetched_pages.put, result)
+
+            if time.monotonic() - reported_at >= self.FETCH_STAT_INTERVAL:
+                reported_at = time.monotonic()
+                logger.info(
+                    f"Fetch window: {window.report()} "
+                    f"len_urls_to_fetch={len(self.frontier)} "
+                    f"len_urls_scheduled={len(scheduler)} "
+                    f"len_pages_to_process={self.fetched_pages.qsize()}"
                 )
-                results = [result for result in results if result.text]
-                self.pages_to_process.extend(results)
 
-            logger.info(
-                f"End fetch iteration (batch={self.FETCH_BATCH_SIZE}). "
-                f"len_urls_to_fetch={len(self.urls_to_crawl)} "
-                f"len_pages_to_process={len(self.pages_to_process)}"
-            )
-            idle_counter = 0
-            await asyncio.sleep(self.IDLE_WORK_SLEEP_INTERVAL)
+        logger.info(f"Fetch window finished: {window.report()}")
 
-        logger.info("Finishing fetch thread ...")
+    def parse_pages(self):
+        logger.debug(f"Starting parse thread (workers={self.parse_workers})")
+        if self.parse_workers:
+            with ProcessPoolExecutor(self.parse_workers) as executor:
+                self._parse_pages_in_pool(executor)
+        else:
+            self._parse_pages_in_thread()
+        self.parsed_pages.put(None)
+        logger.info("Finished parse thread")
 
-    def _crawl_iteration(self, fetched_url: FetchedUrl):
-        if self.crawl_count and self.crawl_count % self.STAT_INTERVAL == 0:
-            self.db.fill_stat(self.crawl_count)
-        self.crawl_count += 1
-        logger.debug(
-            f"{self.crawl_count} - Processing {fetched_url.url} ({fetched_url.depth}) ..."
-        )
+    def _parse_pages_in_thread(self):
+        while (fetched_url := self.fetched_pages.get()) is not None:
+            if self.stop_flag:
+                self._skip_fetched_url(fetched_url)
+                continue
+            if fetched_url.not_modified:
+                self._put_unchanged_page(fetched_url)
+                continue
+            try:
+                parsed = parse_page(
+                    fetched_url.text, self.parser.engine, self._stored_hash(fetched_url)
+                )
+            except Exception as e:
+                logger.warning(f"Failed to parse {fetched_url.url} - {e}")
+                self._skip_fetched_url(fetched_url)
+                continue
+            self._put_parsed_page(fetched_url, *parsed)
+
+    def _parse_pages_in_pool(self, executor: ProcessPoolExecutor):
+        # futures are collected in submit order, at most PARSE_TASKS_PER_WORKER
+        # pages per worker are shipped to the pool at a time
+        pending: Deque[Tuple[FetchedUrl, Future]] = deque()
+        max_pending = self.parse_workers * self.PARSE_TASKS_PER_WORKER
+        end_of_stream = False
+        while not end_of_stream or pending:
+            fetched_url = None
+            if not end_of_stream and len(pending) < max_pending:
+                with contextlib.suppress(queue.Empty):
+                    fetched_url = self.fetched_pages.get(block=not pending)
+                    end_of_stream = fetched_url is None
+
+            if fetched_url is not None:
+                if self.stop_flag:
+                    self._skip_fetched_url(fetched_url)
+                elif fetched_url.not_modified:
+                    self._put_unchanged_page(fetched_url)
+                else:
+                    # hashing and fingerprinting run in the worker as well
+                    future = executor.submit(
+                        parse_compact,
+                        fetched_url.text,
+                        self.parser.engine,
+                        self._stored_hash(fetched_url),
+                    )
+                    pending.append((fetched_url, future))
+                continue
 
-        if not fetched_url.text:
+            if not pending:
+                continue
+            fetched_url, future = pending.popleft()
+            try:
+                compact, text_hash, fingerprint = future.result()
+            except Exception as e:
+                logger.warning(f"Failed to parse {fetched_url.url} - {e}")
+                self._skip_fetched_url(fetched_url)
+                continue
+            if self.stop_flag:
+                self._skip_fetched_url(fetched_url)
+                continue
+            elements = None if compact is None else Parser.from_compact(compact)
+            self._put_parsed_page(fetched_url, elements, text_hash, fingerprint)
+
+    def _put_parsed_page(
+        self,
+        fetched_url: FetchedUrl,
+        elements: Optional[List[Element]],
+        text_hash: str,
+        fingerprint: int,
+    ):
+        if elements is None:
+            # same content hash as the indexed page
+            self._put_unchanged_page(fetched_url)
             return
-
-        elements = self.parser.parse_text_elements(fetched_url.text)
-
-        try:
-            fetched_url_id = self.db.insert_url(fetched_url.url)
-            self.db.insert_links_from_elements(elements)
-            self.db.insert_words_from_elements(elements)
-            self.db.insert_links_between_by_elements(elements, fetched_url_id)
-            self.db.fill_words_locations_by_elements(elements, fetched_url_id)
-            self.db.fill_link_words_by_elements(elements)
-
-            self.crawled_urls.append(fetched_url.url)
-
-            if fetched_url.depth + 1 > self.MAX_DEPTH:
-                return
-
-            links_to_go_next = [
+        # links are followed before indexing, the index stage never holds up
+        # the frontier
+        if fetched_url.depth + 1 <= self.MAX_DEPTH:
+            self.frontier.push_many(
                 LinkToGo(element.href, fetched_url.depth + 1)
                 for element in elements
-                if element.href and element.href not in self.crawled_urls
-            ]
-
-            self.urls_to_crawl.extend(links_to_go_next)
-            self.urls_to_crawl = list(dict.fromkeys(self.urls_to_crawl))
-        except SQLAlchemyError as e:
-            logger.warning(
-                f"Failed to write to DB {fetched_url.url} {fetched_url.depth} - {e}"
+                if element.href
             )
-            self.error_processed_urls.append(fetched_url.url)
-
-
-class Parser:
-    def parse_text_elements(self, text: str) -> List[Element]:
-        soup = BeautifulSoup(text, "html.parser")
+        # blocks while the index stage is behind
+        self.parsed_pages.put(
+            ParsedPage(
+                url=fetched_url.url,
+                elements=elements,
+                depth=fetched_url.depth,
+                etag=fetched_url.etag,
+                last_modified=fetched_url.last_modified,
+                content_hash=text_hash,
+                fingerprint=fingerprint,
+            )
+        )
 
-        for data in soup(["style", "script", "meta", "template"]):
-            data.decompose()
+    def _stored_hash(self, fetched_url: FetchedUrl) -> str:
+        state = self.url_states.get(fetched_url.url)
+        return state.content_hash if state else ""
+
+    def _put_unchanged_page(self, fetched_url: FetchedUrl) -> None:
+        self.parsed_pages.put(
+            ParsedPage(
+                url=fetched_url.url,
+                elements=[],
+                depth=fetched_url.depth,
+                not_modified=True,
+            )
+        )
 
-        for element in soup(
-            text=lambda text: isinstance(text, Comment)
-        ):  # remove html comments
-            element.extract()
+    def _skip_fetched_url(self, fetched_url: FetchedUrl):
+        self.error_processed_urls.append(fetched_url.url)
+        self.frontier.task_done()
 
-        return self._parse_tags(tags=soup.find_all())
+    def index_pages(self):
+        writer = IndexWriter(self.db, self.url_states, self.fingerprints)
+        try:
+            while True:
+                try:
+                    parsed_page = self.parsed_pages.get(timeout=writer.time_to_flush())
+                except queue.Empty:
+                    writer.flush()
+                    continue
+                if parsed_page is None:
+                    break
+                self.crawl_count += 1
+                logger.debug(
+                    f"{self.crawl_count} - Processing {parsed_page.url} ({parsed_page.depth}) ..."
+                )
+                try:
+                    if parsed_page.not_modified:
+                        self._follow_stored_links(parsed_page)
+                    else:
+                        writer.add(parsed_page)
+                finally:
+                    self.frontier.task_done()
+        finally:
+            writer.flush()
+            self.error_processed_urls.extend(writer.failed_urls)
 
-    def _parse_tags(self, tags: List[bs4.Tag]) -> List[Element]:
-        output_elements: List[Element] = []
+    def _drain_parsed_pages(self):
+        while (parsed_page := self.parsed_pages.get()) is not None:
+            self.error_processed_urls.append(parsed_page.url)
+            self.frontier.task_done()
 
-        for tag in tags:
-            tag_text = tag.find(text=True, recursive=False)
-            if tag_text is None:
-                continue
-            words = self._text_to_words(tag_text)
-            href = ""
-            if tag.name == "a":
-                href = tag.get("href")
-                if not (href is None):
-                    if (
-                        "mailto:" in href
-                        or "tel:" in href
-                        or href.endswith((".jpg", ".png", ".gif", ".jpeg", ".pdf"))
-                        or not href.startswith("http")
-                    ):
-                        href = ""
-                    href = href.strip("/")
-
-            for i, word in enumerate(words, start=len(output_elements)):
-                output_elements.append(Element(word=word, location=i, href=href))
-
-        return output_elements
-
-    def _text_to_words(self, text: str) -> List[str]:
-        words = list(filter(None, re.split("[\W\d]+", text, flags=re.UNICODE)))
-        for i, word in enumerate(words):
-            words[i] = word.lower()
-        return words
+    def _follow_stored_links(self, parsed_page: ParsedPage):
+        if parsed_page.depth + 1 > self.MAX_DEPTH:
+            return
+        url_id = self.url_states[parsed_page.url].url_id
+        self.frontier.push_many(
+            LinkToGo(url, parsed_page.depth + 1) for url in self.db.get_linked_urls(url_id)
+        )
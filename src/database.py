@@ -1,15 +1,42 @@
 import csv
 import itertools
 import os
-from typing import List, Tuple
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
+import numpy as np
 import sqlalchemy
 from loguru import logger
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker
-
-from src.model import Element, ResultURL, PageRankURL, WordLocationsCombination
-from src.settings import DATABASE_FILENAME, IGNORED_WORDS, STATISTICS_FILENAME
+from sqlalchemy.pool import QueuePool
+
+from src.model import (
+    Element,
+    PageRankURL,
+    ResultURL,
+    UrlState,
+    WordLocationsCombination,
+)
+from src.settings import (
+    DATABASE_FILENAME,
+    DATABASE_STORAGE,
+    IGNORED_WORDS,
+    INDEX_LAYOUT,
+    SEGMENTS_DIRECTORY,
+    SHARD_FILENAME_TEMPLATE,
+    SHARDS_COUNT,
+    STATISTICS_FILENAME,
+)
+from src.postings import (
+    combine_postings,
+    decode_positions,
+    encode_positions,
+    group_positions,
+)
+from src.segments import SegmentBuilder, SegmentIndex, SegmentStore
+from src.shards import ShardSet
+from src.terms import TermDictionary
 
 
 class DbCreator:
@@ -55,6 +82,14 @@ class DbCreator:
         rank REAL
     )
     """
+    CREATE_TABLE_URL_STATE = """
+    CREATE TABLE IF NOT EXISTS url_state (
+        fkUrlId INTEGER PRIMARY KEY REFERENCES url_list(urlId) ON DELETE CASCADE ON UPDATE CASCADE,
+        etag TEXT,
+        lastModified TEXT,
+        contentHash TEXT
+    )
+    """
 
     SELECT_TABLES_COUNT = """
     SELECT COUNT(name) FROM sqlite_master WHERE type='table'
@@ -72,16 +107,128 @@ class DbCreator:
     LIMIT 20
     """
 
-    TOTAL_TABLES_COUNT = 6
+    CREATE_TABLE_URL_FINGERPRINT = """
+    CREATE TABLE IF NOT EXISTS url_fingerprint (
+        fkUrlId INTEGER PRIMARY KEY REFERENCES url_list(urlId) ON DELETE CASCADE ON UPDATE CASCADE,
+        fingerprint INT
+    )
+    """
+    CREATE_TABLE_URL_ALIAS = """
+    CREATE TABLE IF NOT EXISTS url_alias (
+        fkUrlId INTEGER PRIMARY KEY REFERENCES url_list(urlId) ON DELETE CASCADE ON UPDATE CASCADE,
+        fkCanonicalUrlId INT REFERENCES url_list(urlId) ON DELETE CASCADE ON UPDATE CASCADE
+    )
+    """
+
+    # urls whose outgoing links changed or that are new since the page ranks
+    # were calculated, with the links they had then, update_ranks only
+    # recalculates from these
+    CREATE_TABLE_PAGE_RANK_CHANGE = """
+    CREATE TABLE IF NOT EXISTS page_rank_change (
+        fkUrlId INTEGER PRIMARY KEY
+    )
+    """
+
+    CREATE_TABLE_PAGE_RANK_CHANGE_LINK = """
+    CREATE TABLE IF NOT EXISTS page_rank_change_link (
+        fkFromUrlId INT,
+        fkLinkId INT,
+        fkToUrlId INT,
+        PRIMARY KEY (fkFromUrlId, fkLinkId)
+    ) WITHOUT ROWID
+    """
+
+    # one row per (word, url) with all positions of the word on the page,
+    # clustered by word so a term lookup is one sequential range read
+    CREATE_TABLE_WORD_POSTING = """
+    CREATE TABLE IF NOT EXISTS word_posting (
+        fkWordId INT REFERENCES word_list(wordId) ON DELETE CASCADE ON UPDATE CASCADE,
+        fkUrlId INT REFERENCES url_list(urlId) ON DELETE CASCADE ON UPDATE CASCADE,
+        positions BLOB,
+        PRIMARY KEY (fkWordId, fkUrlId)
+    ) WITHOUT ROWID
+    """
+
+    TOTAL_TABLES_COUNT = 12
+
+    # PRAGMA user_version of a db with every index below, see migrate()
+    SCHEMA_VERSION = 3
+
+    # url and word uniqueness is kept by unique indexes, sqlite can not add
+    # a UNIQUE constraint to an existing table
+    CREATE_INDEXES = (
+        "CREATE UNIQUE INDEX IF NOT EXISTS url_list_url ON url_list(url)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS word_list_word ON word_list(word)",
+        "CREATE INDEX IF NOT EXISTS word_location_word_url ON word_location(fkWordId, fkUrlId)",
+        "CREATE INDEX IF NOT EXISTS word_location_url ON word_location(fkUrlId)",
+        "CREATE INDEX IF NOT EXISTS link_between_url_to ON link_between_url(fkToUrlId)",
+        "CREATE INDEX IF NOT EXISTS link_between_url_from ON link_between_url(fkFromUrlId)",
+        "CREATE INDEX IF NOT EXISTS link_word_link ON link_word(fkLinkId)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS page_rank_url ON page_rank(fkUrlId)",
+        "CREATE INDEX IF NOT EXISTS word_posting_url ON word_posting(fkUrlId)",
+    )
+
+    SELECT_USER_VERSION = "PRAGMA user_version"
+    SET_USER_VERSION = "PRAGMA user_version = {version}"
+
+    # (table, column) pairs referencing url_list.urlId and word_list.wordId
+    URL_ID_COLUMNS = (
+        ("word_location", "fkUrlId"),
+        ("word_posting", "fkUrlId"),
+        ("link_between_url", "fkFromUrlId"),
+        ("link_between_url", "fkToUrlId"),
+        ("link_word", "fkLinkId"),
+        ("url_state", "fkUrlId"),
+        ("url_fingerprint", "fkUrlId"),
+        ("url_alias", "fkUrlId"),
+        ("url_alias", "fkCanonicalUrlId"),
+    )
+    WORD_ID_COLUMNS = (
+        ("word_location", "fkWordId"),
+        ("word_posting", "fkWordId"),
+        ("link_word", "fkWordId"),
+    )
+
+    CREATE_DUPLICATE_IDS = """
+    CREATE TEMP TABLE duplicate_ids AS
+    SELECT duplicate.{id_column} AS oldId, kept.keptId AS newId FROM {table} AS duplicate
+    INNER JOIN (SELECT {value_column}, MIN({id_column}) AS keptId FROM {table} GROUP BY {value_column}) AS kept
+    ON duplicate.{value_column} = kept.{value_column}
+    WHERE duplicate.{id_column} != kept.keptId
+    """
+    # OR IGNORE leaves rows whose primary key is already taken by the kept id,
+    # they are deleted right after
+    REMAP_DUPLICATE_IDS = """
+    UPDATE OR IGNORE {table} SET {column} = (SELECT newId FROM duplicate_ids WHERE oldId = {column})
+    WHERE {column} IN (SELECT oldId FROM duplicate_ids)
+    """
+    DELETE_BY_DUPLICATE_IDS = """
+    DELETE FROM {table} WHERE {column} IN (SELECT oldId FROM duplicate_ids)
+    """
+    DROP_DUPLICATE_IDS = "DROP TABLE duplicate_ids"
+
+    # per page tables of a shard file, see src.shards
+    SHARD_CREATE_TABLES = (CREATE_TABLE_WORD_LOCATION, CREATE_TABLE_WORD_POSTING)
+    SHARD_CREATE_INDEXES = (
+        "CREATE INDEX IF NOT EXISTS word_location_word_url ON word_location(fkWordId, fkUrlId)",
+        "CREATE INDEX IF NOT EXISTS word_location_url ON word_location(fkUrlId)",
+        "CREATE INDEX IF NOT EXISTS word_posting_url ON word_posting(fkUrlId)",
+    )
 
     @classmethod
-    def initialize_db(cls, session) -> None:
+    def create_tables(cls, session) -> None:
         session.execute(cls.CREATE_TABLE_WORD_LIST)
         session.execute(cls.CREATE_TABLE_URL_LIST)
         session.execute(cls.CREATE_TABLE_WORD_LOCATION)
         session.execute(cls.CREATE_TABLE_LINK_BETWEEN_URL)
         session.execute(cls.CREATE_TABLE_LINK_WORD)
         session.execute(cls.CREATE_TABLE_PAGE_RANK)
+        session.execute(cls.CREATE_TABLE_URL_STATE)
+        session.execute(cls.CREATE_TABLE_URL_FINGERPRINT)
+        session.execute(cls.CREATE_TABLE_URL_ALIAS)
+        session.execute(cls.CREATE_TABLE_WORD_POSTING)
+        session.execute(cls.CREATE_TABLE_PAGE_RANK_CHANGE)
+        session.execute(cls.CREATE_TABLE_PAGE_RANK_CHANGE_LINK)
 
         result = session.execute(cls.SELECT_TABLES_COUNT)
         tables_count = result.fetchone()[0]
@@ -91,38 +238,139 @@ class DbCreator:
             )
             exit(1)
 
+    @classmethod
+    def initialize_db(cls, session, deferred_indexes: bool = False) -> None:
+        """Creates a new db, with deferred_indexes the indexes are left to
+        create_indexes() once the bulk load is done."""
+        cls.create_tables(session)
+        if not deferred_indexes:
+            cls.create_indexes(session)
+
+    @classmethod
+    def create_indexes(cls, session) -> None:
+        for query in cls.CREATE_INDEXES:
+            session.execute(query)
+        session.execute(cls.SET_USER_VERSION.format(version=cls.SCHEMA_VERSION))
+
+    @classmethod
+    def initialize_shard(cls, session, deferred_indexes: bool = False) -> None:
+        for query in cls.SHARD_CREATE_TABLES:
+            session.execute(query)
+        if not deferred_indexes:
+            cls.create_shard_indexes(session)
+
+    @classmethod
+    def create_shard_indexes(cls, session) -> None:
+        for query in cls.SHARD_CREATE_INDEXES:
+            session.execute(query)
+
+    @classmethod
+    def get_version(cls, session) -> int:
+        return session.execute(cls.SELECT_USER_VERSION).fetchone()[0]
+
+    @classmethod
+    def migrate(cls, session) -> None:
+        version = cls.get_version(session)
+        if version >= cls.SCHEMA_VERSION:
+            logger.info(f"Db schema is up to date, version {version}")
+            return
+        cls.create_tables(session)
+        for target_version in range(version + 1, cls.SCHEMA_VERSION + 1):
+            getattr(cls, f"_migrate_to_{target_version}")(session)
+            session.execute(cls.SET_USER_VERSION.format(version=target_version))
+            session.commit()
+            logger.info(f"Db schema migrated to version {target_version}")
+
+    @classmethod
+    def _migrate_to_1(cls, session) -> None:
+        # unique indexes need the duplicated urls and words merged first
+        cls._merge_duplicates(session, "url_list", "urlId", "url", cls.URL_ID_COLUMNS)
+        cls._merge_duplicates(
+            session, "word_list", "wordId", "word", cls.WORD_ID_COLUMNS
+        )
+        # ranks are recalculated by calculate_ranks, drop the ones of merged urls
+        session.execute(
+            "DELETE FROM page_rank WHERE fkUrlId NOT IN (SELECT urlId FROM url_list)"
+            " OR id NOT IN (SELECT MIN(id) FROM page_rank GROUP BY fkUrlId)"
+        )
+        for query in cls.CREATE_INDEXES:
+            session.execute(query)
+
+    @classmethod
+    def _migrate_to_2(cls, session) -> None:
+        # word_posting table is added by create_tables
+        for query in cls.CREATE_INDEXES:
+            session.execute(query)
+
+    @classmethod
+    def _migrate_to_3(cls, session) -> None:
+        # page_rank_change tables are added by create_tables, links changed
+        # before they existed are unknown, every url is logged as changed
+        # with its current links so the next update recalculates all
+        session.execute(
+            "INSERT OR IGNORE INTO page_rank_change(fkUrlId) SELECT urlId FROM url_list"
+        )
+        session.execute(
+            "INSERT OR IGNORE INTO page_rank_change_link(fkFromUrlId, fkLinkId, fkToUrlId)"
+            " SELECT fkFromUrlId, linkId, fkToUrlId FROM link_between_url"
+        )
+
+    @classmethod
+    def _merge_duplicates(
+        cls,
+        session,
+        table: str,
+        id_column: str,
+        value_column: str,
+        references: Tuple[Tuple[str, str], ...],
+    ) -> None:
+        session.execute(
+            cls.CREATE_DUPLICATE_IDS.format(
+                table=table, id_column=id_column, value_column=value_column
+            )
+        )
+        duplicates_count = session.execute(
+            "SELECT COUNT(*) FROM duplicate_ids"
+        ).fetchone()[0]
+        if duplicates_count:
+            logger.info(f"Merging {duplicates_count} duplicated rows of {table}")
+        for reference_table, column in references:
+            session.execute(
+                cls.REMAP_DUPLICATE_IDS.format(table=reference_table, column=column)
+            )
+            session.execute(
+                cls.DELETE_BY_DUPLICATE_IDS.format(table=reference_table, column=column)
+            )
+        session.execute(
+            cls.DELETE_BY_DUPLICATE_IDS.format(table=table, column=id_column)
+        )
+        session.execute(cls.DROP_DUPLICATE_IDS)
+
 
 class DbActor:
+    # prepared statements, rows are passed to executemany as tuples
     INSERT_INTO_URL_LIST = """
-    INSERT INTO url_list(url) VALUES ('{url}')
+    INSERT INTO url_list(urlId, url) VALUES (?, ?)
     """
 
-    INSERT_INTO_URL_LIST_BATCH = """
-    INSERT INTO url_list(url) VALUES {urls}
+    INSERT_INTO_WORD_LIST = """
+    INSERT INTO word_list(wordId, word) VALUES (?, ?)
     """
 
-    INSERT_INTO_WORD_LIST_BATCH = """
-    INSERT INTO word_list(word) VALUES {words}
+    INSERT_INTO_WORD_POSTING = """
+    INSERT INTO word_posting(fkWordId, fkUrlId, positions) VALUES (?, ?, ?)
     """
 
     INSERT_INTO_WORD_LOCATIONS = """
-    INSERT INTO word_location(fkWordId, fkUrlId, location) VALUES {list_of_values}
+    INSERT INTO word_location(fkWordId, fkUrlId, location) VALUES (?, ?, ?)
     """
 
     INSERT_INTO_LINKS_BETWEEN = """
-    INSERT INTO link_between_url(fkFromUrlId, fkToUrlId) VALUES {list_of_values}
+    INSERT INTO link_between_url(fkFromUrlId, fkToUrlId) VALUES (?, ?)
     """
 
     INSERT_INTO_LINK_WORD = """
-    INSERT INTO link_word(fkWordId, fkLinkId) VALUES {list_of_values}
-    """
-
-    SELECT_LAST_WORD_ID = """
-    SELECT MAX(wordId) FROM word_list
-    """
-
-    SELECT_LAST_URL_ID = """
-    SELECT MAX(urlId) FROM url_list
+    INSERT INTO link_word(fkWordId, fkLinkId) VALUES (?, ?)
     """
 
     SELECT_LINK_BETWEEN_STATS = """
@@ -141,6 +389,10 @@ class DbActor:
     SELECT COUNT(*), 'word_list' as temp_field FROM word_list
     """
 
+    SELECT_WORD_POSTING_STATS = """
+    SELECT COUNT(*), 'word_location' as temp_field FROM word_posting
+    """
+
     SELECT_WORD_LOCATION_STATS = """
     SELECT COUNT(*), 'word_location' as temp_field FROM word_location
     """
@@ -171,11 +423,11 @@ class DbActor:
     """
 
     INSERT_IN_RANGE_RANK_MAIN = """
-    INSERT INTO page_rank(fkUrlId, rank) VALUES {list_of_values}
+    INSERT INTO page_rank(fkUrlId, rank) VALUES (?, ?)
     """
 
     INSERT_IN_RANGE_RANK_TEMP = """
-    INSERT INTO page_rank_temp(fkUrlId, rank) VALUES {list_of_values}
+    INSERT INTO page_rank_temp(fkUrlId, rank) VALUES (?, ?)
     """
 
     SELECT_ALL_REFERENCES_TO_URL_BY_ID = """
@@ -234,55 +486,448 @@ class DbActor:
     WHERE url_list.urlId IN {url_ids_list}
     """
 
+    SELECT_URL_STATES = """
+    SELECT urlId, url, etag, lastModified, contentHash FROM url_list
+    INNER JOIN url_state ON urlId = fkUrlId
+    """
+
+    UPSERT_URL_STATE = """
+    INSERT OR REPLACE INTO url_state(fkUrlId, etag, lastModified, contentHash)
+    VALUES (:url_id, :etag, :last_modified, :content_hash)
+    """
+
+    # links of a near duplicate are the links stored for its canonical url
+    SELECT_LINKED_URLS_BY_FROM = """
+    SELECT url FROM link_between_url INNER JOIN url_list ON urlId = fkToUrlId
+    WHERE fkFromUrlId = COALESCE(
+        (SELECT fkCanonicalUrlId FROM url_alias WHERE fkUrlId = {url_id}), {url_id}
+    )
+    """
+
+    DELETE_WORD_POSTINGS_BY_URL = """
+    DELETE FROM word_posting WHERE fkUrlId = {url_id}
+    """
+
+    SELECT_POSTINGS_BY_WORD = """
+    SELECT fkUrlId, positions FROM word_posting
+    WHERE fkWordId = (SELECT wordId FROM word_list WHERE word = :word)
+    """
+
+    SELECT_POSTINGS_BY_URL = """
+    SELECT word, positions FROM word_list INNER JOIN word_posting ON wordId = fkWordId
+    WHERE fkUrlId = {url_id}
+    """
+
+    SELECT_SHARD_POSTINGS_BY_WORD = """
+    SELECT fkUrlId, positions FROM word_posting WHERE fkWordId = {word_id}
+    """
+
+    SELECT_SHARD_POSTINGS_BY_URL = """
+    SELECT fkWordId, positions FROM word_posting WHERE fkUrlId = {url_id}
+    """
+
+    SELECT_SHARD_LOCATIONS_BY_URL = """
+    SELECT location, fkWordId FROM word_location WHERE fkUrlId = {url_id}
+    """
+
+    SELECT_ALL_WORD_LOCATIONS = """
+    SELECT fkWordId, fkUrlId, location FROM word_location
+    """
+
+    SELECT_ALL_WORD_POSTINGS = """
+    SELECT fkWordId, fkUrlId, positions FROM word_posting
+    """
+
+    SELECT_ALL_LINKS = """
+    SELECT fkFromUrlId, fkToUrlId FROM link_between_url
+    """
+
+    SELECT_URL_LIST = """
+    SELECT urlId, url FROM url_list ORDER BY urlId
+    """
+
+    SELECT_PAGE_RANKS = """
+    SELECT fkUrlId, rank FROM page_rank ORDER BY fkUrlId
+    """
+
+    DELETE_PAGE_RANK_BY_URL = """
+    DELETE FROM page_rank WHERE fkUrlId = ?
+    """
+
+    # links are logged on the first change of a url only, they are the
+    # links the ranks were calculated with
+    INSERT_PAGE_RANK_CHANGE_LINKS = """
+    INSERT OR IGNORE INTO page_rank_change_link(fkFromUrlId, fkLinkId, fkToUrlId)
+    SELECT fkFromUrlId, linkId, fkToUrlId FROM link_between_url
+    WHERE fkFromUrlId = {url_id}
+    """
+
+    INSERT_PAGE_RANK_CHANGE = """
+    INSERT OR IGNORE INTO page_rank_change(fkUrlId) VALUES (?)
+    """
+
+    SELECT_PAGE_RANK_CHANGE = """
+    SELECT 1 FROM page_rank_change WHERE fkUrlId = {url_id}
+    """
+
+    SELECT_PAGE_RANK_CHANGES = """
+    SELECT fkUrlId FROM page_rank_change ORDER BY fkUrlId
+    """
+
+    SELECT_PAGE_RANK_CHANGE_LINKS_BY_IDS = """
+    SELECT fkFromUrlId, fkToUrlId FROM page_rank_change_link WHERE fkFromUrlId IN ({url_ids})
+    """
+
+    DELETE_PAGE_RANK_CHANGE = """
+    DELETE FROM page_rank_change WHERE fkUrlId = ?
+    """
+
+    DELETE_PAGE_RANK_CHANGE_LINKS = """
+    DELETE FROM page_rank_change_link WHERE fkFromUrlId = ?
+    """
+
+    SELECT_LINKS_BY_FROM_IDS = """
+    SELECT fkFromUrlId, fkToUrlId FROM link_between_url WHERE fkFromUrlId IN ({url_ids})
+    """
+
+    SELECT_LINKS_BY_TO_IDS = """
+    SELECT fkFromUrlId, fkToUrlId FROM link_between_url WHERE fkToUrlId IN ({url_ids})
+    """
+
+    SELECT_OUT_DEGREES_BY_IDS = """
+    SELECT fkFromUrlId, COUNT(*) FROM link_between_url WHERE fkFromUrlId IN ({url_ids})
+    GROUP BY fkFromUrlId
+    """
+
+    SELECT_PAGE_RANKS_BY_IDS = """
+    SELECT fkUrlId, rank FROM page_rank WHERE fkUrlId IN ({url_ids})
+    """
+
+    SELECT_RANKED_URL_IDS = """
+    SELECT fkUrlId FROM page_rank ORDER BY fkUrlId LIMIT {limit}
+    """
+
+    SELECT_LINKS_COUNT = """
+    SELECT COUNT(*) FROM link_between_url
+    """
+
+    SELECT_WORD_ID_BY_WORD = """
+    SELECT wordId FROM word_list WHERE word = :word
+    """
+
+    SELECT_WORDS_BY_IDS = """
+    SELECT wordId, word FROM word_list WHERE wordId IN ({word_ids})
+    """
+
+    SELECT_POSTINGS_DOCUMENT_FREQUENCY = """
+    SELECT COUNT(*) FROM word_posting WHERE fkWordId = {word_id}
+    """
+
+    SELECT_LOCATIONS_DOCUMENT_FREQUENCY = """
+    SELECT COUNT(DISTINCT fkUrlId) FROM word_location WHERE fkWordId = {word_id}
+    """
+
+    DELETE_WORD_LOCATIONS_BY_URL = """
+    DELETE FROM word_location WHERE fkUrlId = {url_id}
+    """
+
+    DELETE_LINKS_BETWEEN_BY_FROM = """
+    DELETE FROM link_between_url WHERE fkFromUrlId = {url_id}
+    """
+
+    SELECT_FINGERPRINTS = """
+    SELECT fkUrlId, fingerprint FROM url_fingerprint
+    """
+
+    UPSERT_URL_FINGERPRINT = """
+    INSERT OR REPLACE INTO url_fingerprint(fkUrlId, fingerprint) VALUES ({url_id}, {fingerprint})
+    """
+
+    UPSERT_URL_ALIAS = """
+    INSERT OR REPLACE INTO url_alias(fkUrlId, fkCanonicalUrlId) VALUES ({url_id}, {canonical_url_id})
+    """
+
+    DELETE_URL_FINGERPRINT = """
+    DELETE FROM url_fingerprint WHERE fkUrlId = {url_id}
+    """
+
+    DELETE_URL_ALIAS = """
+    DELETE FROM url_alias WHERE fkUrlId = {url_id}
+    """
+
+    SELECT_WORD_IDS = """
+    SELECT wordId, word FROM word_list ORDER BY wordId
+    """
+
+    SELECT_URL_IDS_BY_URL = """
+    SELECT urlId, url FROM url_list ORDER BY urlId DESC
+    """
+
     SQLALCHEMY_DATABASE_URL_MEMORY = "sqlite:///:memory:"
     SQLALCHEMY_DATABASE_URL_FILE = f"sqlite:///{DATABASE_FILENAME}"
 
-    def __init__(self) -> None:
+    STORAGE_MODES = ("disk", "memory")
+    # pragmas of every connection to the db file in disk mode, WAL lets
+    # readers work while the crawler writes, NORMAL syncs only on checkpoints
+    DISK_PRAGMAS = (
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA temp_store = MEMORY",
+        "PRAGMA cache_size = -65536",
+        "PRAGMA mmap_size = 268435456",
+    )
+    WAL_CHECKPOINT = "PRAGMA wal_checkpoint(PASSIVE)"
+    READ_ONLY_PRAGMAS = (
+        "PRAGMA query_only = ON",
+        "PRAGMA temp_store = MEMORY",
+        "PRAGMA cache_size = -65536",
+        "PRAGMA mmap_size = 268435456",
+    )
+
+    # engines, shards and segments of read-only DbActors are opened once per
+    # process, every read-only DbActor after the first only opens a session
+    _read_only_handles: Dict[
+        tuple,
+        Tuple[sqlalchemy.engine.Engine, Optional[ShardSet], Optional[SegmentIndex]],
+    ] = dict()
+    _read_only_lock = threading.Lock()
+
+    INDEX_LAYOUTS = ("rows", "postings", "segments")
+
+    def __init__(
+        self,
+        deferred_indexes: bool = False,
+        storage: str = DATABASE_STORAGE,
+        index_layout: str = INDEX_LAYOUT,
+        shards_count: int = SHARDS_COUNT,
+        read_only: bool = False,
+    ) -> None:
         self.url_ids_dict = dict()
+        self.last_url_id = 0
+        self.terms = TermDictionary()
+        if storage not in self.STORAGE_MODES:
+            raise ValueError(
+                f"Unknown storage {storage}, expected one of {self.STORAGE_MODES}"
+            )
+        self.storage = storage
+        if index_layout not in self.INDEX_LAYOUTS:
+            raise ValueError(
+                f"Unknown index layout {index_layout}, expected one of {self.INDEX_LAYOUTS}"
+            )
+        self.index_layout = index_layout
+        self.read_only = read_only
+        if read_only:
+            self._open_read_only(shards_count)
+            return
+        if index_layout == "segments":
+            # word positions and link edges go to immutable segment files,
+            # url_list and word_list stay in the db
+            self.segment_store = SegmentStore(SEGMENTS_DIRECTORY)
+            self.segment_builder = SegmentBuilder()
+            self.segment_index = SegmentIndex(SEGMENTS_DIRECTORY)
+        is_new = DATABASE_FILENAME not in os.listdir()
+        logger.info("Db in disk not found" if is_new else "Db in disk found")
+
+        if storage == "disk":
+            self.engine = self._create_file_engine()
+        else:
+            self.engine = self._create_memory_engine(is_new)
+        DbSession = sessionmaker(autoflush=False, bind=self.engine)
+        self.db = DbSession()
+        self.shards: Optional[ShardSet] = None
+        if shards_count > 1:
+            self._open_shards(shards_count, deferred_indexes)
+
+        if is_new:
+            # Create tables
+            DbCreator.initialize_db(self.db, deferred_indexes)
+            self.db.commit()
+            return
 
-        # https://stackoverflow.com/questions/5831548/how-to-save-my-in-memory-database-to-hard-disk
+        # tables added after the db was written
+        DbCreator.create_tables(self.db)
+        version = DbCreator.get_version(self.db)
+        if version < DbCreator.SCHEMA_VERSION:
+            logger.warning(
+                f"Db schema version {version} is older than {DbCreator.SCHEMA_VERSION}, "
+                f"lookups run without indexes. Run `python main.py migrate`"
+            )
+        self._load_url_ids()
+        self.terms.load(self.db.execute(self.SELECT_WORD_IDS))
 
+    def _open_read_only(self, shards_count: int) -> None:
         if DATABASE_FILENAME not in os.listdir():
-            logger.info("Db in disk not found")
-
-            # Open db in memory
-            memory_engine = create_engine(self.SQLALCHEMY_DATABASE_URL_MEMORY)
-            self.raw_connection_memory = memory_engine.raw_connection()
-            DbSessionMemory = sessionmaker(autoflush=False, bind=memory_engine)
-            memory_session_ = DbSessionMemory()
+            raise FileNotFoundError(f"{DATABASE_FILENAME} not found, run the crawler first")
+        key = (os.path.abspath(DATABASE_FILENAME), self.index_layout, shards_count)
+        with self._read_only_lock:
+            handles = self._read_only_handles.get(key)
+            if handles is None:
+                logger.info("Opening shared read-only index")
+                handles = self._create_read_only_handles(shards_count)
+                self._read_only_handles[key] = handles
+        self.engine, self.shards, segment_index = handles
+        if segment_index is not None:
+            self.segment_index = segment_index
+        DbSession = sessionmaker(autoflush=False, bind=self.engine)
+        self.db = DbSession()
+        # sessions are not thread safe, every reader gets its own on the
+        # shared engines
+        if self.shards:
+            self.shard_sessions = self.shards.open_sessions()
+
+    def _create_read_only_handles(
+        self, shards_count: int
+    ) -> Tuple[sqlalchemy.engine.Engine, Optional[ShardSet], Optional[SegmentIndex]]:
+        engine = self._create_file_engine(
+            self._read_only_url(DATABASE_FILENAME), self.READ_ONLY_PRAGMAS
+        )
+        shards = None
+        if shards_count > 1:
+            shards = ShardSet(
+                [
+                    self._create_file_engine(
+                        self._read_only_url(SHARD_FILENAME_TEMPLATE.format(shard=shard)),
+                        self.READ_ONLY_PRAGMAS,
+                    )
+                    for shard in range(shards_count)
+                ]
+            )
+        segment_index = None
+        if self.index_layout == "segments":
+            segment_index = SegmentIndex(SEGMENTS_DIRECTORY)
+        return engine, shards, segment_index
 
-            # Create tables
-            DbCreator.initialize_db(memory_session_)
-            self.db = memory_session_
-            return
+    @staticmethod
+    def _read_only_url(filename: str) -> str:
+        return f"sqlite:///file:{filename}?mode=ro&uri=true"
 
-        logger.info("Db in disk found")
+    def _open_shards(self, shards_count: int, deferred_indexes: bool) -> None:
+        if self.storage != "disk" or self.index_layout == "segments":
+            raise ValueError(
+                "Shards need disk storage and the rows or postings index layout"
+            )
+        self.shards = ShardSet(
+            [
+                self._create_file_engine(
+                    f"sqlite:///{SHARD_FILENAME_TEMPLATE.format(shard=shard)}"
+                )
+                for shard in range(shards_count)
+            ]
+        )
+        self.shard_sessions = self.shards.sessions
+        for session in self.shard_sessions:
+            DbCreator.initialize_shard(session, deferred_indexes)
+        self.shards.commit()
+
+    def _create_file_engine(
+        self,
+        database_url: str = SQLALCHEMY_DATABASE_URL_FILE,
+        pragmas: Tuple[str, ...] = DISK_PRAGMAS,
+    ) -> sqlalchemy.engine.Engine:
+        # pooled connections keep pragmas and the page cache between
+        # transactions. A connection is used by one thread at a time, but
+        # shard and reader threads take turns on it
+        engine = create_engine(
+            database_url,
+            poolclass=QueuePool,
+            connect_args={"check_same_thread": False},
+        )
 
-        # Open db in memory
-        memory_engine = create_engine(self.SQLALCHEMY_DATABASE_URL_MEMORY)
-        raw_connection_memory = memory_engine.raw_connection()
-        self.raw_connection_memory = raw_connection_memory
-        DbSessionMemory = sessionmaker(autoflush=False, bind=memory_engine)
-        memory_session_ = DbSessionMemory()
+        @event.listens_for(engine, "connect")
+        def set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in pragmas:
+                cursor.execute(pragma)
+            cursor.close()
 
-        file_engine = sqlalchemy.create_engine(self.SQLALCHEMY_DATABASE_URL_FILE)
-        raw_connection_file = file_engine.raw_connection()
-        raw_connection_file.backup(raw_connection_memory.connection)
-        raw_connection_file.close()
-        file_engine.dispose()
+        return engine
 
-        self.db = memory_session_
-        return
+    def _create_memory_engine(self, is_new: bool) -> sqlalchemy.engine.Engine:
+        # https://stackoverflow.com/questions/5831548/how-to-save-my-in-memory-database-to-hard-disk
+        engine = create_engine(self.SQLALCHEMY_DATABASE_URL_MEMORY)
+        self.raw_connection_memory = engine.raw_connection()
+        if not is_new:
+            file_engine = create_engine(self.SQLALCHEMY_DATABASE_URL_FILE)
+            raw_connection_file = file_engine.raw_connection()
+            raw_connection_file.backup(self.raw_connection_memory.connection)
+            raw_connection_file.close()
+            file_engine.dispose()
+        return engine
+
+    def _load_url_ids(self) -> None:
+        # descending order leaves the first id of a duplicated url in the dict
+        for url_id, url in self.db.execute(self.SELECT_URL_IDS_BY_URL):
+            self.url_ids_dict[url] = url_id
+            self.last_url_id = max(self.last_url_id, url_id)
 
     def save_to_db_to_disk(self) -> None:
+        if self.storage == "disk":
+            self.db.commit()
+            self.checkpoint()
+            return
         engine_file = sqlalchemy.create_engine(self.SQLALCHEMY_DATABASE_URL_FILE)
         raw_connection_file = engine_file.raw_connection()
         self.raw_connection_memory.backup(raw_connection_file.connection)
         raw_connection_file.close()
         engine_file.dispose()
 
+    def create_indexes(self) -> None:
+        DbCreator.create_indexes(self.db)
+        self.db.commit()
+        if self.shards:
+            for session in self.shards.sessions:
+                DbCreator.create_shard_indexes(session)
+            self.shards.commit()
+
+    def checkpoint(self) -> None:
+        """Moves committed pages from the WAL into the db file in disk mode.
+
+        Memory mode has nothing to checkpoint until save_to_db_to_disk().
+        """
+        if self.storage == "disk":
+            self.db.execute(self.WAL_CHECKPOINT)
+        if self.shards:
+            self.shards.execute_all(self.WAL_CHECKPOINT)
+
     def close(self):
         self.db.close()
+        if self.read_only:
+            # the shared handles stay open for the next reader
+            if self.shards:
+                for session in self.shard_sessions:
+                    session.close()
+            return
+        if self.shards:
+            self.shards.close()
+        if self.index_layout == "segments":
+            self.segment_index.close()
+        # the last connection to close checkpoints and removes the WAL
+        self.engine.dispose()
+
+    # insert and delete methods used for indexing do not commit,
+    # the index writer groups them into one transaction per batch
+    def commit(self) -> None:
+        self.db.commit()
+        # urls are committed before their shard rows, a crash in between
+        # leaves a page without words rather than words of a reused url id
+        if self.shards:
+            self.shards.commit()
+        # urls of a segment are committed before it becomes visible
+        if self.index_layout == "segments" and len(self.segment_builder):
+            self.segment_store.add(self.segment_builder)
+            self.segment_builder = SegmentBuilder()
+
+    def rollback(self) -> None:
+        self.db.rollback()
+        if self.shards:
+            self.shards.rollback()
+        if self.index_layout == "segments":
+            self.segment_builder = SegmentBuilder()
+        # ids handed out by the rolled back transaction are not valid any more
+        self.url_ids_dict.clear()
+        self.last_url_id = 0
+        self._load_url_ids()
+        self.terms.load(self.db.execute(self.SELECT_WORD_IDS))
 
     def fill_stat(self, urls_crawled: int):
         data = []
@@ -299,9 +944,19 @@ class DbActor:
         result = self.db.execute(self.SELECT_WORD_LIST_STATS)
         result = result.fetchall()
         data.append((result[0][1], result[0][0]))
-        result = self.db.execute(self.SELECT_WORD_LOCATION_STATS)
-        result = result.fetchall()
-        data.append((result[0][1], result[0][0]))
+        if self.index_layout == "segments":
+            data.append(("word_location", self.segment_store.postings_count))
+        else:
+            query = (
+                self.SELECT_WORD_POSTING_STATS
+                if self.index_layout == "postings"
+                else self.SELECT_WORD_LOCATION_STATS
+            )
+            count = sum(
+                session.execute(query).fetchone()[0]
+                for session in self._index_sessions()
+            )
+            data.append(("word_location", count))
 
         self._append_csv_stat(data, urls_crawled)
 
@@ -320,130 +975,186 @@ class DbActor:
                 )
             )
 
-    def _get_last_word_id(self) -> int:
-        result = self.db.execute(self.SELECT_LAST_WORD_ID)
-        result = result.fetchone()[0]
-        return result
-
-    def _get_last_url_id(self) -> int:
-        result = self.db.execute(self.SELECT_LAST_URL_ID)
-        result = result.fetchone()[0]
-        return result
+    def _index_session(self, url_id: int):
+        """Session holding the word locations of the url."""
+        if self.shards:
+            return self.shard_sessions[self.shards.shard_of(url_id)]
+        return self.db
+
+    def _index_sessions(self) -> list:
+        return self.shard_sessions if self.shards else [self.db]
+
+    def _execute_many(self, query: str, rows: Iterable[tuple], session=None) -> None:
+        # DBAPI cursor of the session connection, runs in the open transaction
+        session = session or self.db
+        cursor = session.connection().connection.cursor()
+        try:
+            cursor.executemany(query, rows)
+        finally:
+            cursor.close()
+
+    def _add_url(self, url: str) -> Tuple[int, bool]:
+        url_id = self.url_ids_dict.get(url)
+        if url_id is not None:
+            return url_id, False
+        self.last_url_id += 1
+        self.url_ids_dict[url] = self.last_url_id
+        return self.last_url_id, True
 
     def insert_url(self, url: str) -> int:
-        already_in_db = self.db.execute(
-            f"SELECT urlId FROM url_list WHERE url = '{url}'"
-        ).fetchone()
-        if already_in_db:
-            return already_in_db[0]
-
-        query = self.INSERT_INTO_URL_LIST.format(url=url)
-        self.db.execute(query)
-        row_id = self._get_last_insert_rowid()
-        self.db.commit()
-        self.url_ids_dict[url] = row_id
-        return row_id
+        url_id, is_new_url = self._add_url(url)
+        if is_new_url:
+            self._execute_many(self.INSERT_INTO_URL_LIST, [(url_id, url)])
+            self._execute_many(self.INSERT_PAGE_RANK_CHANGE, [(url_id,)])
+        return url_id
+
+    def get_url_states(self) -> Dict[str, UrlState]:
+        result = self.db.execute(self.SELECT_URL_STATES).fetchall()
+        return {
+            row[1]: UrlState(
+                url_id=row[0],
+                etag=row[2] or "",
+                last_modified=row[3] or "",
+                content_hash=row[4] or "",
+            )
+            for row in result
+        }
 
-    def _get_last_insert_rowid(self) -> int:
-        return self.db.execute("SELECT last_insert_rowid();").fetchall()[0][0]
+    def upsert_url_state(self, state: UrlState) -> None:
+        self.db.execute(
+            text(self.UPSERT_URL_STATE),
+            {
+                "url_id": state.url_id,
+                "etag": state.etag,
+                "last_modified": state.last_modified,
+                "content_hash": state.content_hash,
+            },
+        )
 
-    def insert_links_from_elements(self, elements: List[Element]) -> None:
-        last_url_id = self._get_last_url_id() or 1
-        list_of_values = ""
+    def get_linked_urls(self, url_id: int) -> List[str]:
+        result = self.db.execute(
+            self.SELECT_LINKED_URLS_BY_FROM.format(url_id=url_id)
+        ).fetchall()
+        return [row[0] for row in result]
+
+    def delete_url_index(self, url_id: int) -> None:
+        # link_word rows reference the target url only, they are shared
+        # between all pages linking to it and are kept
+        index_session = self._index_session(url_id)
+        index_session.execute(self.DELETE_WORD_LOCATIONS_BY_URL.format(url_id=url_id))
+        index_session.execute(self.DELETE_WORD_POSTINGS_BY_URL.format(url_id=url_id))
+        if self.index_layout == "segments":
+            self.segment_builder.add_document(url_id)
+        self._log_page_rank_change(url_id)
+        self.db.execute(self.DELETE_LINKS_BETWEEN_BY_FROM.format(url_id=url_id))
+        self.db.execute(self.DELETE_URL_FINGERPRINT.format(url_id=url_id))
+        self.db.execute(self.DELETE_URL_ALIAS.format(url_id=url_id))
+
+    # sqlite integers are signed, fingerprints are stored in two's complement
+    def get_fingerprints(self) -> List[Tuple[int, int]]:
+        result = self.db.execute(self.SELECT_FINGERPRINTS).fetchall()
+        return [(row[0], row[1] & 0xFFFFFFFFFFFFFFFF) for row in result]
+
+    def insert_url_fingerprint(self, url_id: int, fingerprint: int) -> None:
+        if fingerprint >= 1 << 63:
+            fingerprint -= 1 << 64
+        self.db.execute(
+            self.UPSERT_URL_FINGERPRINT.format(url_id=url_id, fingerprint=fingerprint)
+        )
 
-        for element in elements:
-            if not element.href:
-                continue
-            if element.href not in self.url_ids_dict:
-                last_url_id += 1
-                self.url_ids_dict[element.href] = last_url_id
-                list_of_values += f"('{element.href}'),"
+    def insert_url_alias(self, url_id: int, canonical_url_id: int) -> None:
+        self.db.execute(
+            self.UPSERT_URL_ALIAS.format(
+                url_id=url_id, canonical_url_id=canonical_url_id
+            )
+        )
 
+    def insert_links_from_elements(self, elements: List[Element]) -> None:
+        new_urls = []
         for element in elements:
             if not element.href:
                 continue
-            element.link_id = self.url_ids_dict[element.href]
-
-        list_of_values = list_of_values.strip(",")
-        if not list_of_values:
-            return
-        self.db.execute(self.INSERT_INTO_URL_LIST_BATCH.format(urls=list_of_values))
-        self.db.commit()
+            element.link_id, is_new_url = self._add_url(element.href)
+            if is_new_url:
+                new_urls.append((element.link_id, element.href))
+        self._execute_many(self.INSERT_INTO_URL_LIST, new_urls)
+        # new urls have no rank yet, not even the ones that are not crawled
+        self._execute_many(
+            self.INSERT_PAGE_RANK_CHANGE, ((url_id,) for url_id, _ in new_urls)
+        )
 
     def insert_words_from_elements(self, elements: List[Element]) -> None:
-        last_word_id = self._get_last_word_id() or 1
-        values_list = ""
-        unique_words = dict()
+        new_words = []
         for element in elements:
             if not element.word:
                 continue
-            safe_word = element.word.replace("'", "").strip()
-            if safe_word in IGNORED_WORDS:
-                continue
-            if safe_word in unique_words.values():
-                element.word_id = list(unique_words.keys())[
-                    list(unique_words.values()).index(safe_word)
-                ]
+            word = element.word.strip()
+            if word in IGNORED_WORDS:
                 continue
-            already_in_db = self.db.execute(
-                f"SELECT wordId FROM word_list WHERE word = '{safe_word}'"
-            ).fetchone()
-            if already_in_db:
-                element.word_id = already_in_db[0]
-                unique_words[already_in_db[0]] = safe_word
-                continue
-            values_list += f"('{safe_word}'),"
-            last_word_id += 1
-            element.word_id = last_word_id
-            unique_words[last_word_id] = safe_word
-        values_list = values_list.strip(",")
-        if not values_list:
-            return
-        self.db.execute(self.INSERT_INTO_WORD_LIST_BATCH.format(words=values_list))
-        self.db.commit()
+            element.word_id, is_new_word = self.terms.add(word)
+            if is_new_word:
+                new_words.append((element.word_id, word))
+        self._execute_many(self.INSERT_INTO_WORD_LIST, new_words)
 
     def insert_links_between_by_elements(
         self, elements: List[Element], original_link_id: int
     ) -> None:
-        values_list = ""
-        unique_urls = dict()
-        for element in elements:
-            if not element.href:
-                continue
-            unique_urls.setdefault(element.href, element.link_id)
-        for unique_url_id in unique_urls.values():
-            values_list += f"({original_link_id}, {unique_url_id}),"
-        values_list = values_list.strip(",")
-        if not values_list:
-            return
-        query = self.INSERT_INTO_LINKS_BETWEEN.format(list_of_values=values_list)
-        self.db.execute(query)
-        self.db.commit()
+        unique_url_ids = dict.fromkeys(
+            element.link_id for element in elements if element.href
+        )
+        self._log_page_rank_change(original_link_id)
+        self._execute_many(
+            self.INSERT_INTO_LINKS_BETWEEN,
+            ((original_link_id, url_id) for url_id in unique_url_ids),
+        )
+        if self.index_layout == "segments":
+            self.segment_builder.add_edges(original_link_id, unique_url_ids)
 
     def fill_words_locations_by_elements(self, elements: List[Element], url_id: int):
-        values_list = ""
-        for element in elements:
-            if element.word_id == 0:
-                continue
-            values_list += f"({element.word_id}, {url_id}, {element.location}),"
-        values_list = values_list.strip(",")
-        if not values_list:
+        if self.index_layout == "segments":
+            self.segment_builder.add_postings(
+                url_id,
+                (
+                    (element.word, element.location)
+                    for element in elements
+                    if element.word_id != 0
+                ),
+            )
             return
-        query = self.INSERT_INTO_WORD_LOCATIONS.format(list_of_values=values_list)
-        self.db.execute(query)
-        self.db.commit()
+        if self.index_layout == "postings":
+            postings = group_positions(
+                (element.word_id, element.location)
+                for element in elements
+                if element.word_id != 0
+            )
+            self._execute_many(
+                self.INSERT_INTO_WORD_POSTING,
+                (
+                    (word_id, url_id, encode_positions(positions))
+                    for word_id, positions in postings.items()
+                ),
+                self._index_session(url_id),
+            )
+            return
+        self._execute_many(
+            self.INSERT_INTO_WORD_LOCATIONS,
+            (
+                (element.word_id, url_id, element.location)
+                for element in elements
+                if element.word_id != 0
+            ),
+            self._index_session(url_id),
+        )
 
     def fill_link_words_by_elements(self, elements: List[Element]):
-        list_of_values = ""
-        for element in elements:
-            if element.word and element.href and element.word_id != 0:
-                list_of_values += f"({element.word_id}, {element.link_id}),"
-        list_of_values = list_of_values.strip(",")
-        if not list_of_values:
-            return
-        query = self.INSERT_INTO_LINK_WORD.format(list_of_values=list_of_values)
-        self.db.execute(query)
-        self.db.commit()
+        self._execute_many(
+            self.INSERT_INTO_LINK_WORD,
+            (
+                (element.word_id, element.link_id)
+                for element in elements
+                if element.word and element.href and element.word_id != 0
+            ),
+        )
 
     def get_urls_ids(self) -> List[int]:
         result = self.db.execute(self.SELECT_URL_IDS)
@@ -452,25 +1163,90 @@ class DbActor:
         return result[0]
 
     def fill_page_rank(self, page_ranks: List[PageRankURL]) -> None:
+        self.replace_page_ranks((page.id, page.rank) for page in page_ranks)
+
+    def replace_page_ranks(self, rows: Iterable[Tuple[int, float]]) -> None:
         self.db.execute("delete from page_rank")
+        self._execute_many(self.INSERT_IN_RANGE_RANK_MAIN, rows)
         self.db.commit()
 
-        list_of_values = ""
-        for page in page_ranks:
-            list_of_values += f"({page.id}, {page.rank}),"
-        list_of_values = list_of_values.strip(",")
-        self.db.execute(
-            self.INSERT_IN_RANGE_RANK_MAIN.format(list_of_values=list_of_values)
-        )
+    def update_page_ranks(self, rows: Iterable[Tuple[int, float]]) -> None:
+        """Ranks of the given urls replaced, other ranks are kept."""
+        rows = list(rows)
+        self._execute_many(self.DELETE_PAGE_RANK_BY_URL, ((url_id,) for url_id, _ in rows))
+        self._execute_many(self.INSERT_IN_RANGE_RANK_MAIN, rows)
+        self.db.commit()
+
+    def _log_page_rank_change(self, url_id: int) -> None:
+        """Called before the links of url_id change. New urls are logged when
+        they are inserted, they have no links to keep, so link_between_url
+        is only read for urls crawled again after the ranks were calculated,
+        it may have no index during a bulk load."""
+        if self.db.execute(self.SELECT_PAGE_RANK_CHANGE.format(url_id=url_id)).fetchone():
+            return
+        self.db.execute(self.INSERT_PAGE_RANK_CHANGE_LINKS.format(url_id=url_id))
+        self._execute_many(self.INSERT_PAGE_RANK_CHANGE, [(url_id,)])
+
+    def get_page_rank_changes(self) -> List[int]:
+        return [row[0] for row in self.db.execute(self.SELECT_PAGE_RANK_CHANGES)]
+
+    def delete_page_rank_changes(self, url_ids: Iterable[int]) -> None:
+        """Changes taken into account by the ranks, later ones are kept."""
+        rows = [(url_id,) for url_id in url_ids]
+        self._execute_many(self.DELETE_PAGE_RANK_CHANGE, rows)
+        self._execute_many(self.DELETE_PAGE_RANK_CHANGE_LINKS, rows)
         self.db.commit()
 
+    def get_schema_version(self) -> int:
+        return DbCreator.get_version(self.db)
+
+    # queries of push_page_rank, url ids and results are numpy arrays
+    IDS_CHUNK_SIZE = 10_000
+
+    def _select_by_ids(self, query: str, url_ids: np.ndarray) -> Iterator[tuple]:
+        for start in range(0, len(url_ids), self.IDS_CHUNK_SIZE):
+            chunk = url_ids[start : start + self.IDS_CHUNK_SIZE]
+            yield from self.db.execute(query.format(url_ids=",".join(map(str, chunk.tolist()))))
+
+    def _select_links_by_ids(self, query: str, url_ids: np.ndarray) -> np.ndarray:
+        links = np.fromiter(
+            itertools.chain.from_iterable(self._select_by_ids(query, url_ids)), dtype=np.int64
+        )
+        return links.reshape(-1, 2)
+
+    def get_links_from(self, url_ids: np.ndarray) -> np.ndarray:
+        """(from, to) url id pairs of the links from the urls."""
+        return self._select_links_by_ids(self.SELECT_LINKS_BY_FROM_IDS, url_ids)
+
+    def get_links_to(self, url_ids: np.ndarray) -> np.ndarray:
+        """(from, to) url id pairs of the links to the urls."""
+        return self._select_links_by_ids(self.SELECT_LINKS_BY_TO_IDS, url_ids)
+
+    def get_page_rank_change_links(self, url_ids: np.ndarray) -> np.ndarray:
+        """(from, to) url id pairs of the links the changed urls had when the
+        ranks were calculated."""
+        return self._select_links_by_ids(self.SELECT_PAGE_RANK_CHANGE_LINKS_BY_IDS, url_ids)
+
+    def get_out_degrees(self, url_ids: np.ndarray) -> np.ndarray:
+        degrees = dict(self._select_by_ids(self.SELECT_OUT_DEGREES_BY_IDS, url_ids))
+        return np.array([degrees.get(url_id, 0) for url_id in url_ids.tolist()], dtype=np.int64)
+
+    def get_page_ranks(self, url_ids: np.ndarray) -> np.ndarray:
+        """Ranks of the urls, nan for urls without a rank."""
+        ranks = dict(self._select_by_ids(self.SELECT_PAGE_RANKS_BY_IDS, url_ids))
+        return np.array([ranks.get(url_id, np.nan) for url_id in url_ids.tolist()])
+
+    def get_ranked_url_ids(self, limit: int) -> np.ndarray:
+        result = self.db.execute(self.SELECT_RANKED_URL_IDS.format(limit=limit))
+        return np.array([row[0] for row in result], dtype=np.int64)
+
+    def get_links_count(self) -> int:
+        return self.db.execute(self.SELECT_LINKS_COUNT).fetchone()[0]
+
     def fill_temp_page_rank(self, entities: List[PageRankURL]) -> None:
-        list_of_values = ""
-        for entity in entities:
-            list_of_values += f"({entity.id}, {entity.rank}),"
-        list_of_values = list_of_values.strip(",")
-        self.db.execute(
-            self.INSERT_IN_RANGE_RANK_TEMP.format(list_of_values=list_of_values)
+        self._execute_many(
+            self.INSERT_IN_RANGE_RANK_TEMP,
+            ((entity.id, entity.rank) for entity in entities),
         )
         self.db.commit()
 
@@ -495,17 +1271,99 @@ class DbActor:
         self.db.execute(self.SYNC_TEMP_AND_MAIN_PAGE_RANKS)
         self.db.commit()
 
+    def iter_word_locations(self) -> Iterator[Tuple[int, int, int]]:
+        """(word id, url id, location) of every indexed word, in no particular order."""
+        if self.index_layout == "segments":
+            word_ids = {word: word_id for word_id, word in self.db.execute(self.SELECT_WORD_IDS)}
+            self.segment_index.refresh()
+            for word, url_id, blob in self.segment_index.all_postings():
+                for location in decode_positions(blob):
+                    yield word_ids[word], url_id, location
+            return
+        for session in self._index_sessions():
+            if self.index_layout == "postings":
+                for word_id, url_id, blob in session.execute(self.SELECT_ALL_WORD_POSTINGS):
+                    for location in decode_positions(blob):
+                        yield word_id, url_id, location
+            else:
+                yield from session.execute(self.SELECT_ALL_WORD_LOCATIONS)
+
+    def iter_links(self) -> Iterator[Tuple[int, int]]:
+        return iter(self.db.execute(self.SELECT_ALL_LINKS))
+
+    def iter_urls(self) -> Iterator[Tuple[int, str]]:
+        return iter(self.db.execute(self.SELECT_URL_LIST))
+
+    def iter_words(self) -> Iterator[Tuple[int, str]]:
+        return iter(self.db.execute(self.SELECT_WORD_IDS))
+
+    def iter_page_ranks(self) -> Iterator[Tuple[int, float]]:
+        return iter(self.db.execute(self.SELECT_PAGE_RANKS))
+
+    def insert_url_rows(self, rows: Iterable[Tuple[int, str]]) -> None:
+        """(url id, url) rows with ids assigned elsewhere, e.g. by a snapshot."""
+        rows = list(rows)
+        for url_id, url in rows:
+            self.url_ids_dict.setdefault(url, url_id)
+            self.last_url_id = max(self.last_url_id, url_id)
+        self._execute_many(self.INSERT_INTO_URL_LIST, rows)
+
+    def insert_word_rows(self, rows: Iterable[Tuple[int, str]]) -> None:
+        rows = list(rows)
+        self.terms.load(rows)
+        self._execute_many(self.INSERT_INTO_WORD_LIST, rows)
+
+    def insert_page_rank_rows(self, rows: Iterable[Tuple[int, float]]) -> None:
+        self._execute_many(self.INSERT_IN_RANGE_RANK_MAIN, rows)
+
     def get_words_by_url(self, url_id):
+        if self.shards:
+            return self._get_words_by_url_from_shard(url_id)
+        if self.index_layout == "postings":
+            return self._get_words_by_url_from_postings(url_id)
+        if self.index_layout == "segments":
+            self.segment_index.refresh()
+            return self.segment_index.words_by_url(url_id)
         result = self.db.execute(
             self.SELECT_ALL_WORDS_BY_URL.format(url_id=url_id)
         ).fetchall()
         return list(zip(*result))[0]
 
+    def _get_words_by_url_from_postings(self, url_id):
+        located_words = [
+            (position, word)
+            for word, blob in self.db.execute(
+                self.SELECT_POSTINGS_BY_URL.format(url_id=url_id)
+            )
+            for position in decode_positions(blob)
+        ]
+        located_words.sort()
+        return tuple(word for _, word in located_words)
+
     # get combinations of all word locations from list on all avaliable urls
     # returns WordLocationsCombination or null if words not specified
     def get_words_location_combinations(self, words: List[str]):
         if len(words) == 0:
             return
+        if self.shards:
+            return self._get_words_location_combinations_from_shards(words)
+        if self.index_layout == "postings":
+            return combine_postings(
+                [
+                    dict(
+                        self.db.execute(
+                            text(self.SELECT_POSTINGS_BY_WORD), {"word": word}
+                        ).fetchall()
+                    )
+                    for word in words
+                ]
+            )
+        if self.index_layout == "segments":
+            # one manifest generation for all words of the query
+            self.segment_index.refresh()
+            return combine_postings(
+                [self.segment_index.postings(word) for word in words]
+            )
 
         query = f"select {words[0]}_url as url"
         for i, word in enumerate(words):
@@ -536,6 +1394,95 @@ class DbActor:
 
         return combinations_list
 
+    def _get_words_by_url_from_shard(self, url_id):
+        shard = self._index_session(url_id)
+        if self.index_layout == "postings":
+            located_word_ids = [
+                (position, word_id)
+                for word_id, blob in shard.execute(
+                    self.SELECT_SHARD_POSTINGS_BY_URL.format(url_id=url_id)
+                )
+                for position in decode_positions(blob)
+            ]
+        else:
+            located_word_ids = shard.execute(
+                self.SELECT_SHARD_LOCATIONS_BY_URL.format(url_id=url_id)
+            ).fetchall()
+        located_word_ids.sort()
+        word_ids = {word_id for _, word_id in located_word_ids}
+        words = dict(
+            self.db.execute(
+                self.SELECT_WORDS_BY_IDS.format(
+                    word_ids=",".join(map(str, word_ids)) or "NULL"
+                )
+            ).fetchall()
+        )
+        return tuple(words[word_id] for _, word_id in located_word_ids)
+
+    def _get_words_location_combinations_from_shards(self, words: List[str]):
+        # word ids are global, every shard joins the locations of its own pages
+        word_ids = [self._get_word_id(word) for word in words]
+        if None in word_ids:
+            return []
+        if self.index_layout == "postings":
+
+            def select(connection):
+                return combine_postings(
+                    [
+                        dict(
+                            connection.execute(
+                                self.SELECT_SHARD_POSTINGS_BY_WORD.format(word_id=word_id)
+                            ).fetchall()
+                        )
+                        for word_id in word_ids
+                    ]
+                )
+
+        else:
+            query = "SELECT location0.fkUrlId"
+            for i in range(len(word_ids)):
+                query += f", location{i}.location"
+            query += " FROM word_location AS location0"
+            for i, word_id in enumerate(word_ids[1:], start=1):
+                query += (
+                    f" INNER JOIN word_location AS location{i}"
+                    f" ON location{i}.fkUrlId = location0.fkUrlId AND location{i}.fkWordId = {word_id}"
+                )
+            query += f" WHERE location0.fkWordId = {word_ids[0]}"
+
+            def select(connection):
+                return [
+                    WordLocationsCombination(row[0], list(row[1:]))
+                    for row in connection.execute(query)
+                ]
+
+        return list(itertools.chain.from_iterable(self.shards.map(select)))
+
+    def _get_word_id(self, word: str) -> Optional[int]:
+        # readers do not load the term dictionary, word_list is looked up
+        return self.db.execute(
+            text(self.SELECT_WORD_ID_BY_WORD), {"word": word}
+        ).scalar()
+
+    def get_document_frequency(self, word: str) -> int:
+        """Count of indexed pages containing the word, over all shards."""
+        if self.index_layout == "segments":
+            self.segment_index.refresh()
+            return self.segment_index.document_frequency(word)
+        word_id = self._get_word_id(word)
+        if word_id is None:
+            return 0
+        query = (
+            self.SELECT_POSTINGS_DOCUMENT_FREQUENCY
+            if self.index_layout == "postings"
+            else self.SELECT_LOCATIONS_DOCUMENT_FREQUENCY
+        ).format(word_id=word_id)
+        if self.shards:
+            return sum(
+                self.shards.map(lambda connection: connection.execute(query).scalar())
+            )
+        return self.db.execute(query).scalar()
+
     def get_url_page_rank_info(self, url_id):
         result = self.db.execute(
             self.SELECT_URL_RANK_INFO.format(url_id=url_id)
@@ -571,3 +1518,18 @@ class DbActor:
             )
             for row in result
         ]
+
+
+def migrate_db():
+    if DATABASE_FILENAME not in os.listdir():
+        logger.error(f"{DATABASE_FILENAME} not found")
+        exit(1)
+
+    file_engine = create_engine(DbActor.SQLALCHEMY_DATABASE_URL_FILE)
+    DbSessionFile = sessionmaker(autoflush=False, bind=file_engine)
+    file_session = DbSessionFile()
+    try:
+        DbCreator.migrate(file_session)
+    finally:
+        file_session.close()
+        file_engine.dispose()
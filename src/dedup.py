@@ -0,0 +1,102 @@
+import hashlib
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+
+class SimHash:
+    BITS = 64
+    SHINGLE_SIZE = 3
+    MIN_WORDS_COUNT = 30
+
+    def __init__(self, shingle_size: int = SHINGLE_SIZE) -> None:
+        self.shingle_size = shingle_size
+
+    def fingerprint(self, words: Sequence[str]) -> int:
+        """64 bit SimHash of word shingles, 0 for pages too short to compare."""
+        if len(words) < self.MIN_WORDS_COUNT:
+            return 0
+        weights = [0] * self.BITS
+        shingles_count = len(words) - self.shingle_size + 1
+        for i in range(shingles_count):
+            shingle = " ".join(words[i : i + self.shingle_size])
+            shingle_hash = int.from_bytes(
+                hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "big"
+            )
+            for bit in range(self.BITS):
+                if shingle_hash >> bit & 1:
+                    weights[bit] += 1
+                else:
+                    weights[bit] -= 1
+        fingerprint = 0
+        for bit, weight in enumerate(weights):
+            if weight > 0:
+                fingerprint |= 1 << bit
+        return fingerprint
+
+
+def hamming_distance(first: int, second: int) -> int:
+    return bin(first ^ second).count("1")
+
+
+class FingerprintIndex:
+    """Finds fingerprints within MAX_DISTANCE bits of each other.
+
+    Fingerprints are split into MAX_DISTANCE + 1 bands, two fingerprints that
+    differ in at most MAX_DISTANCE bits share at least one band exactly.
+    """
+
+    MAX_DISTANCE = 3
+
+    def __init__(self, max_distance: int = MAX_DISTANCE) -> None:
+        self.max_distance = max_distance
+        self.bands_count = max_distance + 1
+        self.band_bits = SimHash.BITS // self.bands_count
+        self._fingerprints: Dict[int, int] = dict()
+        self._bands: List[Dict[int, Set[int]]] = [
+            dict() for _ in range(self.bands_count)
+        ]
+
+    def __len__(self) -> int:
+        return len(self._fingerprints)
+
+    def _split(self, fingerprint: int) -> List[Tuple[int, int]]:
+        mask = (1 << self.band_bits) - 1
+        return [
+            (band, fingerprint >> (band * self.band_bits) & mask)
+            for band in range(self.bands_count)
+        ]
+
+    def load(self, rows: Iterable[Tuple[int, int]]) -> None:
+        self._fingerprints.clear()
+        for bands in self._bands:
+            bands.clear()
+        for url_id, fingerprint in rows:
+            self.add(url_id, fingerprint)
+
+    def add(self, url_id: int, fingerprint: int) -> None:
+        self.remove(url_id)
+        if not fingerprint:
+            return
+        self._fingerprints[url_id] = fingerprint
+        for band, value in self._split(fingerprint):
+            self._bands[band].setdefault(value, set()).add(url_id)
+
+    def remove(self, url_id: int) -> None:
+        fingerprint = self._fingerprints.pop(url_id, None)
+        if fingerprint is None:
+            return
+        for band, value in self._split(fingerprint):
+            self._bands[band][value].discard(url_id)
+
+    def find(self, fingerprint: int) -> Optional[int]:
+        """Closest indexed url id within max_distance bits."""
+        if not fingerprint:
+            return None
+        candidates: Set[int] = set()
+        for band, value in self._split(fingerprint):
+            candidates.update(self._bands[band].get(value, ()))
+        best_url_id, best_distance = None, self.max_distance + 1
+        for url_id in sorted(candidates):
+            distance = hamming_distance(fingerprint, self._fingerprints[url_id])
+            if distance < best_distance:
+                best_url_id, best_distance = url_id, distance
+        return best_url_id
@@ -0,0 +1,208 @@
+import asyncio
+import codecs
+import contextlib
+import re
+import time
+from typing import Dict, List, Optional, Set
+
+import aiohttp
+import charset_normalizer
+from aiohttp import hdrs
+from loguru import logger
+
+from src.model import FetchedUrl, LinkToGo, UrlState
+from src.politeness import RobotsCache
+
+
+class Fetcher:
+    EXCEPTION_SLEEP_INTERVAL = 0.25
+    MAX_RETRIES_COUNT = 3
+    TOTAL_TIMEOUT = 10
+    CONNECT_TIMEOUT = 2
+    CONNECTIONS_LIMIT = 100
+    CONNECTIONS_PER_HOST_LIMIT = 8
+    KEEPALIVE_TIMEOUT = 30
+    DNS_CACHE_TTL = 600
+    MAX_BODY_BYTES = 2 * 1024 * 1024
+    READ_CHUNK_SIZE = 64 * 1024
+    HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+    META_CHARSET_SNIFF_BYTES = 2048
+    META_CHARSET_RE = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([\w.:-]+)""", re.I)
+
+    def __init__(
+        self,
+        robots: Optional[RobotsCache] = None,
+        url_states: Optional[Dict[str, UrlState]] = None,
+        max_body_bytes: int = MAX_BODY_BYTES,
+    ) -> None:
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.max_body_bytes = max_body_bytes
+        self.robots = robots
+        # validators of already indexed urls for conditional requests
+        self.url_states = url_states or dict()
+
+    async def __aenter__(self) -> "Fetcher":
+        # one session for the whole crawl keeps connections, TLS sessions
+        # and resolved hosts warm between requests
+        connector = aiohttp.TCPConnector(
+            limit=self.CONNECTIONS_LIMIT,
+            limit_per_host=self.CONNECTIONS_PER_HOST_LIMIT,
+            keepalive_timeout=self.KEEPALIVE_TIMEOUT,
+            use_dns_cache=True,
+            ttl_dns_cache=self.DNS_CACHE_TTL,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=self.TOTAL_TIMEOUT, connect=self.CONNECT_TIMEOUT
+        )
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.session.close()
+        self.session = None
+
+    async def fetch(self, link: LinkToGo) -> FetchedUrl:
+        if self.robots and not await self.robots.can_fetch(self.session, link.link):
+            logger.debug(f"Disallowed by robots.txt - {link.link}")
+            return FetchedUrl(url=link.link, text="", depth=link.depth)
+
+        headers = self._conditional_headers(link.link)
+        retries_count = 0
+        while retries_count < self.MAX_RETRIES_COUNT:
+            try:
+                async with self.session.get(link.link, headers=headers) as response:
+                    if response.status == 304:
+                        logger.debug(f"Not modified {link.link}")
+                        return FetchedUrl(
+                            url=link.link, text="", depth=link.depth, not_modified=True
+                        )
+                    if not self._is_html(response):
+                        logger.debug(
+                            f"Skip {response.content_type} "
+                            f"({response.content_length} bytes) - {link.link}"
+                        )
+                        return FetchedUrl(url=link.link, text="", depth=link.depth)
+                    body = await self._read_body(response)
+                    text = self._decode(body, response.charset)
+                    logger.debug(f"Fetched {link.link}")
+                    return FetchedUrl(
+                        url=link.link,
+                        text=text,
+                        depth=link.depth,
+                        etag=response.headers.get(hdrs.ETAG, ""),
+                        last_modified=response.headers.get(hdrs.LAST_MODIFIED, ""),
+                    )
+            except (
+                aiohttp.ServerTimeoutError,
+                aiohttp.ServerConnectionError,
+                aiohttp.ClientConnectionError,
+                asyncio.exceptions.TimeoutError,
+            ) as e:
+                retries_count += 1
+                logger.warning(f"{link.link} - {repr(e)} - {retries_count}")
+                await asyncio.sleep(self.EXCEPTION_SLEEP_INTERVAL)
+            except (aiohttp.TooManyRedirects, UnicodeDecodeError):
+                break
+            except Exception as e:
+                logger.error(e)
+                break
+
+        logger.error(f"Max retries exceed - {link.link}")
+        return FetchedUrl(url=link.link, text="", depth=link.depth)
+
+    def _is_html(self, response: aiohttp.ClientResponse) -> bool:
+        if (
+            hdrs.CONTENT_TYPE in response.headers
+            and response.content_type not in self.HTML_CONTENT_TYPES
+        ):
+            return False
+        return (
+            response.content_length is None
+            or response.content_length <= self.max_body_bytes
+        )
+
+    async def _read_body(self, response: aiohttp.ClientResponse) -> bytes:
+        # bodies without Content-Length are cut at max_body_bytes
+        body = bytearray()
+        async for chunk in response.content.iter_chunked(self.READ_CHUNK_SIZE):
+            body += chunk
+            if len(body) >= self.max_body_bytes:
+                del body[self.max_body_bytes :]
+                break
+        return bytes(body)
+
+    def _decode(self, body: bytes, declared_charset: Optional[str]) -> str:
+        meta_charset = self.META_CHARSET_RE.search(
+            body[: self.META_CHARSET_SNIFF_BYTES]
+        )
+        charsets = [declared_charset]
+        if meta_charset:
+            charsets.append(meta_charset.group(1).decode("ascii"))
+        for charset in filter(None, charsets):
+            with contextlib.suppress(LookupError):
+                return body.decode(charset, errors="replace")
+
+        # final=False tolerates a multibyte character cut by the size cap
+        with contextlib.suppress(UnicodeDecodeError):
+            return codecs.getincrementaldecoder("utf-8")().decode(body, final=False)
+        best_match = charset_normalizer.from_bytes(body).best()
+        if best_match is not None:
+            return str(best_match)
+        return body.decode("utf-8", errors="replace")
+
+    def _conditional_headers(self, url: str) -> Dict[str, str]:
+        state = self.url_states.get(url)
+        if state is None:
+            return dict()
+        headers = dict()
+        if state.etag:
+            headers[hdrs.IF_NONE_MATCH] = state.etag
+        if state.last_modified:
+            headers[hdrs.IF_MODIFIED_SINCE] = state.last_modified
+        return headers
+
+
+class FetchWindow:
+    """Keeps up to ``size`` fetches in flight, refilled as each one completes."""
+
+    def __init__(self, fetcher: Fetcher, size: int) -> None:
+        self.fetcher = fetcher
+        self.size = size
+        self.in_flight: Set[asyncio.Task] = set()
+        self.completed_count = 0
+        self.started_at = time.monotonic()
+        self._reported_at = self.started_at
+        self._reported_count = 0
+
+    def __len__(self) -> int:
+        return len(self.in_flight)
+
+    @property
+    def free_slots(self) -> int:
+        return self.size - len(self.in_flight)
+
+    def submit(self, link: LinkToGo) -> None:
+        self.in_flight.add(asyncio.create_task(self.fetcher.fetch(link)))
+
+    async def wait_completed(self, timeout: Optional[float] = None) -> List[FetchedUrl]:
+        if not self.in_flight:
+            return []
+        done, self.in_flight = await asyncio.wait(
+            self.in_flight, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+        )
+        self.completed_count += len(done)
+        return [task.result() for task in done]
+
+    def report(self) -> str:
+        now = time.monotonic()
+        recent_rate = (self.completed_count - self._reported_count) / max(
+            now - self._reported_at, 1e-9
+        )
+        total_rate = self.completed_count / max(now - self.started_at, 1e-9)
+        self._reported_at = now
+        self._reported_count = self.completed_count
+        return (
+            f"in_flight={len(self.in_flight)}/{self.size} "
+            f"completed={self.completed_count} "
+            f"rate={recent_rate:.1f}/s (avg {total_rate:.1f}/s)"
+        )
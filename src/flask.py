@@ -20,7 +20,9 @@ def index():
 @app.get("/get_results")
 def get_results():
     query = request.args.get("query")
-    Searcher().search(query)
+    searcher = Searcher()
+    searcher.search(query)
+    searcher.close()
     return redirect("/results")
 
 
@@ -0,0 +1,185 @@
+import heapq
+import itertools
+import os
+import sqlite3
+import threading
+from typing import Iterable, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from src.model import LinkToGo
+from src.settings import FRONTIER_FILENAME
+
+
+class Frontier:
+    """Deduplicating crawl frontier ordered by (depth, -priority, insertion order).
+
+    Links are kept in an in-memory heap; when the heap grows over
+    ``max_in_memory`` the tail of the queue is spilled to an on-disk sqlite
+    table and loaded back in order as the queue drains.
+
+    Like ``queue.Queue`` every popped link is counted as in flight until
+    ``task_done`` is called for it, so consumers can tell an exhausted
+    frontier from one that is only waiting for new links to be discovered.
+    """
+
+    MAX_IN_MEMORY = 100_000
+    SPILL_BATCH_SIZE = 10_000
+
+    CREATE_TABLE_SPILLED = """
+    CREATE TABLE IF NOT EXISTS spilled (
+        depth INT,
+        priority INT,
+        seq INT,
+        link TEXT
+    )
+    """
+    CREATE_INDEX_SPILLED = """
+    CREATE INDEX IF NOT EXISTS spilled_order ON spilled(depth, priority, seq)
+    """
+
+    def __init__(
+        self,
+        links: Iterable[LinkToGo] = (),
+        max_in_memory: int = MAX_IN_MEMORY,
+        spill_filename: Optional[str] = FRONTIER_FILENAME,
+    ) -> None:
+        self.max_in_memory = max_in_memory
+        self.spill_filename = spill_filename
+        self._heap: List[Tuple[int, int, int, str]] = []
+        self._seen: Set[str] = set()
+        self._counter = itertools.count()
+        self._spilled_count = 0
+        self._spilled_head: Optional[Tuple[int, int, int]] = None
+        self._spill_db: Optional[sqlite3.Connection] = None
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self.push_many(links)
+
+    def __len__(self) -> int:
+        return len(self._heap) + self._spilled_count
+
+    def __contains__(self, link: str) -> bool:
+        return link in self._seen
+
+    def push(self, link: LinkToGo) -> bool:
+        return self.push_many([link]) == 1
+
+    def push_many(self, links: Iterable[LinkToGo]) -> int:
+        pushed = 0
+        with self._lock:
+            for link in links:
+                if link.link in self._seen:
+                    continue
+                self._seen.add(link.link)
+                heapq.heappush(
+                    self._heap,
+                    (link.depth, -link.priority, next(self._counter), link.link),
+                )
+                pushed += 1
+            if self.spill_filename and len(self._heap) > self.max_in_memory:
+                self._spill()
+            if pushed:
+                self._changed.notify_all()
+        return pushed
+
+    def pop(self) -> Optional[LinkToGo]:
+        batch = self.pop_batch(1)
+        return batch[0] if batch else None
+
+    def pop_batch(self, size: int) -> List[LinkToGo]:
+        batch: List[LinkToGo] = []
+        with self._lock:
+            while len(batch) < size:
+                if self._spilled_count and (
+                    not self._heap or self._heap[0][:3] > self._spilled_head
+                ):
+                    self._load_spilled()
+                if not self._heap:
+                    break
+                depth, priority, _, link = heapq.heappop(self._heap)
+                batch.append(LinkToGo(link, depth, -priority))
+            self._in_flight += len(batch)
+        return batch
+
+    def task_done(self, count: int = 1) -> None:
+        with self._lock:
+            self._in_flight -= count
+            if self._in_flight < 0:
+                raise ValueError("task_done() called too many times")
+            if not self._in_flight:
+                self._changed.notify_all()
+
+    def is_exhausted(self) -> bool:
+        with self._lock:
+            return not self._heap and not self._spilled_count and not self._in_flight
+
+    def wait_for_work(self, timeout: Optional[float] = None) -> bool:
+        """Block until links are queued or nothing is in flight any more.
+
+        Returns True if there are links to pop.
+        """
+        with self._lock:
+            self._changed.wait_for(
+                lambda: self._heap or self._spilled_count or not self._in_flight,
+                timeout,
+            )
+            return bool(self._heap or self._spilled_count)
+
+    def mark_seen(self, link: str) -> None:
+        with self._lock:
+            self._seen.add(link)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._spill_db is None:
+                return
+            self._spill_db.close()
+            self._spill_db = None
+            os.remove(self.spill_filename)
+
+    def _spill(self) -> None:
+        if self._spill_db is None:
+            if os.path.exists(self.spill_filename):
+                os.remove(self.spill_filename)
+            self._spill_db = sqlite3.connect(
+                self.spill_filename, check_same_thread=False
+            )
+            self._spill_db.execute(self.CREATE_TABLE_SPILLED)
+            self._spill_db.execute(self.CREATE_INDEX_SPILLED)
+
+        # keep the head of the queue in memory, move the tail to disk
+        self._heap.sort()
+        keep = self.max_in_memory // 2
+        tail = self._heap[keep:]
+        del self._heap[keep:]
+        self._spill_db.executemany(
+            "INSERT INTO spilled(depth, priority, seq, link) VALUES (?, ?, ?, ?)",
+            tail,
+        )
+        self._spill_db.commit()
+        self._spilled_count += len(tail)
+        self._spilled_head = self._select_spilled_head()
+        logger.debug(f"Spilled {len(tail)} urls to {self.spill_filename}")
+
+    def _select_spilled_head(self) -> Optional[Tuple[int, int, int]]:
+        row = self._spill_db.execute(
+            "SELECT depth, priority, seq FROM spilled ORDER BY depth, priority, seq LIMIT 1"
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def _load_spilled(self) -> None:
+        rows = self._spill_db.execute(
+            "SELECT rowid, depth, priority, seq, link FROM spilled "
+            "ORDER BY depth, priority, seq LIMIT ?",
+            (self.SPILL_BATCH_SIZE,),
+        ).fetchall()
+        self._spill_db.executemany(
+            "DELETE FROM spilled WHERE rowid = ?", [(row[0],) for row in rows]
+        )
+        self._spill_db.commit()
+        self._spilled_count -= len(rows)
+        self._spilled_head = self._select_spilled_head()
+        for row in rows:
+            heapq.heappush(self._heap, tuple(row[1:]))
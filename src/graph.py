@@ -0,0 +1,230 @@
+import itertools
+import os
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Tuple
+
+import numpy as np
+
+
+@dataclass
+class LinkGraph:
+    """Link graph of the crawled urls in flat arrays.
+
+    Node i is url url_ids[i], the nodes linking to it are
+    in_sources[in_offsets[i]:in_offsets[i + 1]], parallel links repeat.
+    """
+
+    url_ids: np.ndarray
+    out_degrees: np.ndarray
+    in_offsets: np.ndarray
+    in_sources: np.ndarray
+
+    @property
+    def nodes_count(self) -> int:
+        return len(self.url_ids)
+
+    @property
+    def links_count(self) -> int:
+        return len(self.in_sources)
+
+    def in_targets(self) -> np.ndarray:
+        """Target node of every in_sources entry."""
+        return np.repeat(np.arange(self.nodes_count), np.diff(self.in_offsets))
+
+    def sources_of(self, node: int) -> np.ndarray:
+        return self.in_sources[self.in_offsets[node] : self.in_offsets[node + 1]]
+
+    @classmethod
+    def from_links(
+        cls, url_ids: np.ndarray, from_ids: np.ndarray, to_ids: np.ndarray
+    ) -> "LinkGraph":
+        """Graph of the links between url_ids, links to or from other ids are dropped."""
+        url_ids = np.unique(np.asarray(url_ids, dtype=np.int64))
+        nodes_count = len(url_ids)
+        from_indexes = np.searchsorted(url_ids, from_ids)
+        to_indexes = np.searchsorted(url_ids, to_ids)
+        if nodes_count:
+            known = (url_ids[np.minimum(from_indexes, nodes_count - 1)] == from_ids) & (
+                url_ids[np.minimum(to_indexes, nodes_count - 1)] == to_ids
+            )
+            from_indexes, to_indexes = from_indexes[known], to_indexes[known]
+        else:
+            from_indexes, to_indexes = from_indexes[:0], to_indexes[:0]
+
+        order = np.argsort(to_indexes, kind="stable")
+        in_offsets = np.zeros(nodes_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(to_indexes, minlength=nodes_count), out=in_offsets[1:])
+        return cls(
+            url_ids=url_ids,
+            out_degrees=np.bincount(from_indexes, minlength=nodes_count),
+            in_offsets=in_offsets,
+            in_sources=from_indexes[order],
+        )
+
+
+def _ranges(offsets: np.ndarray, nodes: np.ndarray) -> np.ndarray:
+    """Indexes offsets[node]:offsets[node + 1] of every node, concatenated."""
+    starts, ends = offsets[nodes], offsets[nodes + 1]
+    lengths = ends - starts
+    shifts = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return shifts + np.arange(int(lengths.sum()))
+
+
+@dataclass
+class RankedGraph:
+    """LinkGraph with a stored rank per node, nan for new nodes, answering
+    the queries push_page_rank sends to a DbActor."""
+
+    graph: LinkGraph
+    ranks: np.ndarray
+
+    def __post_init__(self) -> None:
+        # outgoing links of node i are out_targets[out_offsets[i]:[i + 1]]
+        order = np.argsort(self.graph.in_sources, kind="stable")
+        self._out_targets = self.graph.in_targets()[order]
+        self._out_offsets = np.zeros(self.graph.nodes_count + 1, dtype=np.int64)
+        np.cumsum(self.graph.out_degrees, out=self._out_offsets[1:])
+
+    @property
+    def last_url_id(self) -> int:
+        return int(self.graph.url_ids.max(initial=0))
+
+    def _nodes(self, url_ids: np.ndarray) -> np.ndarray:
+        return np.searchsorted(self.graph.url_ids, url_ids)
+
+    def get_links_from(self, url_ids: np.ndarray) -> np.ndarray:
+        nodes = self._nodes(url_ids)
+        sources = np.repeat(nodes, self.graph.out_degrees[nodes])
+        targets = self._out_targets[_ranges(self._out_offsets, nodes)]
+        return self.graph.url_ids[np.stack([sources, targets], axis=1)]
+
+    def get_links_to(self, url_ids: np.ndarray) -> np.ndarray:
+        nodes = self._nodes(url_ids)
+        targets = np.repeat(nodes, np.diff(self.graph.in_offsets)[nodes])
+        sources = self.graph.in_sources[_ranges(self.graph.in_offsets, nodes)]
+        return self.graph.url_ids[np.stack([sources, targets], axis=1)]
+
+    def get_out_degrees(self, url_ids: np.ndarray) -> np.ndarray:
+        return self.graph.out_degrees[self._nodes(url_ids)]
+
+    def get_page_ranks(self, url_ids: np.ndarray) -> np.ndarray:
+        return self.ranks[self._nodes(url_ids)]
+
+    def get_ranked_url_ids(self, limit: int) -> np.ndarray:
+        return self.graph.url_ids[~np.isnan(self.ranks)][:limit]
+
+
+def load_link_graph(source) -> LinkGraph:
+    """Graph of a DbActor or Snapshot read in one pass over the links."""
+    return load_link_graph_from(source.get_urls_ids(), source.iter_links())
+
+
+def load_link_graph_from(
+    url_ids: Iterable[int], links: Iterable[Tuple[int, int]]
+) -> LinkGraph:
+    """Links are streamed straight into an int64 array, no per link objects
+    are kept."""
+    url_ids = np.fromiter(url_ids, dtype=np.int64)
+    flat_links = np.fromiter(itertools.chain.from_iterable(links), dtype=np.int64)
+    flat_links = flat_links.reshape(-1, 2)
+    return LinkGraph.from_links(url_ids, flat_links[:, 0], flat_links[:, 1])
+
+
+# node indexes of a spilled link, targets first so the file sorts by target
+NODE_TYPE = np.uint32
+
+
+@dataclass
+class EdgeFile:
+    """Links as (target, source) node pairs sorted by target in a memory
+    mapped file, with the per node arrays of the graph in memory.
+
+    Node i is url url_ids[i] like in LinkGraph.
+    """
+
+    url_ids: np.ndarray
+    out_degrees: np.ndarray
+    links: np.ndarray
+
+    @property
+    def nodes_count(self) -> int:
+        return len(self.url_ids)
+
+    @property
+    def links_count(self) -> int:
+        return len(self.links)
+
+    def blocks(self, block_size: int) -> Iterator[np.ndarray]:
+        for start in range(0, self.links_count, block_size):
+            yield self.links[start : start + block_size]
+
+
+def _node_pairs(url_ids: np.ndarray, links: np.ndarray) -> np.ndarray:
+    """(target, source) node pairs of (from url id, to url id) links."""
+    nodes_count = len(url_ids)
+    pairs = np.searchsorted(url_ids, links[:, ::-1])
+    known = (url_ids[np.minimum(pairs, nodes_count - 1)] == links[:, ::-1]).all(axis=1)
+    return pairs[known].astype(NODE_TYPE)
+
+
+def spill_links(
+    url_ids: Iterable[int],
+    links: Iterable[Tuple[int, int]],
+    path: str,
+    block_size: int,
+) -> EdgeFile:
+    """Links streamed to path sorted by target, holding at most block_size
+    links and a few arrays per node in memory.
+
+    The links are appended to an unsorted file while the degrees are
+    counted, then every block of it is moved to the slots of its targets.
+    """
+    url_ids = np.unique(np.fromiter(url_ids, dtype=np.int64))
+    nodes_count = len(url_ids)
+    if nodes_count >= np.iinfo(NODE_TYPE).max:
+        raise ValueError(f"{nodes_count} urls do not fit {np.dtype(NODE_TYPE).name} nodes")
+    in_degrees = np.zeros(nodes_count, dtype=np.int64)
+    out_degrees = np.zeros(nodes_count, dtype=np.int64)
+
+    links = iter(links)
+    links_count = 0
+    unsorted_path = f"{path}.unsorted"
+    with open(unsorted_path, "wb") as unsorted_file:
+        while nodes_count:
+            flat_links = np.fromiter(
+                itertools.chain.from_iterable(itertools.islice(links, block_size)),
+                dtype=np.int64,
+            )
+            if len(flat_links) == 0:
+                break
+            pairs = _node_pairs(url_ids, flat_links.reshape(-1, 2))
+            in_degrees += np.bincount(pairs[:, 0], minlength=nodes_count)
+            out_degrees += np.bincount(pairs[:, 1], minlength=nodes_count)
+            pairs.tofile(unsorted_file)
+            links_count += len(pairs)
+
+    if links_count == 0:
+        os.remove(unsorted_path)
+        return EdgeFile(url_ids, out_degrees, np.empty((0, 2), dtype=NODE_TYPE))
+
+    # counting sort, the links of a target go to consecutive slots in the
+    # order they came in
+    next_slots = np.zeros(nodes_count, dtype=np.int64)
+    np.cumsum(in_degrees[:-1], out=next_slots[1:])
+    del in_degrees
+    sorted_links = np.memmap(path, dtype=NODE_TYPE, mode="w+", shape=(links_count, 2))
+    unsorted_links = np.memmap(unsorted_path, dtype=NODE_TYPE, mode="r", shape=(links_count, 2))
+    for start in range(0, links_count, block_size):
+        block = np.array(unsorted_links[start : start + block_size])
+        block = block[np.argsort(block[:, 0], kind="stable")]
+        targets = block[:, 0]
+        # place of every link among the links of the block to its target
+        ranks = np.arange(len(block)) - np.searchsorted(targets, targets)
+        sorted_links[next_slots[targets] + ranks] = block
+        next_slots += np.bincount(targets, minlength=nodes_count)
+    sorted_links.flush()
+    del sorted_links, unsorted_links
+    os.remove(unsorted_path)
+
+    links = np.memmap(path, dtype=NODE_TYPE, mode="r", shape=(links_count, 2))
+    return EdgeFile(url_ids, out_degrees, links)
@@ -2,13 +2,8 @@ from random import randint
 
 from airium import Airium
 
-from src.database import DbActor
-
 
 class Htmler:
-    def __init__(self) -> None:
-        self.db = DbActor()
-
     def create_marked_html_file(self, marked_html_filename, words, marked_words):
         marked_set = {}
         for i in tuple(marked_words):
@@ -36,6 +31,3 @@ class Htmler:
         html = str(doc_gen)
         with open("search_results/" + marked_html_filename, "wb") as f:
             f.write(bytes(html, encoding="utf8"))
-
-    def close(self) -> None:
-        self.db.close()
@@ -0,0 +1,132 @@
+import time
+from typing import Dict, List, Optional
+
+from loguru import logger
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.database import DbActor
+from src.dedup import FingerprintIndex
+from src.model import ParsedPage, UrlState
+
+
+class IndexWriter:
+    """Buffers parsed pages and writes them to the db in one transaction per batch.
+
+    A batch is flushed once it holds ``batch_size`` pages or its oldest page
+    waited ``flush_interval_ms``. Every ``checkpoint_interval`` seconds the
+    committed batches are checkpointed into the db file.
+    """
+
+    BATCH_SIZE = 50
+    FLUSH_INTERVAL_MS = 500
+    CHECKPOINT_INTERVAL = 30
+
+    def __init__(
+        self,
+        db: DbActor,
+        url_states: Dict[str, UrlState],
+        fingerprints: FingerprintIndex,
+        batch_size: int = BATCH_SIZE,
+        flush_interval_ms: int = FLUSH_INTERVAL_MS,
+        checkpoint_interval: float = CHECKPOINT_INTERVAL,
+    ) -> None:
+        self.db = db
+        self.url_states = url_states
+        self.fingerprints = fingerprints
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.pages: List[ParsedPage] = []
+        self.indexed_count = 0
+        self.failed_urls: List[str] = []
+        self._first_buffered_at = 0.0
+        self.checkpoint_interval = checkpoint_interval
+        self._checkpointed_at = time.monotonic()
+
+    def add(self, parsed_page: ParsedPage) -> None:
+        if not self.pages:
+            self._first_buffered_at = time.monotonic()
+        self.pages.append(parsed_page)
+        if len(self.pages) >= self.batch_size:
+            self.flush()
+
+    def time_to_flush(self) -> Optional[float]:
+        """Seconds until the buffered batch is due, None while nothing is buffered."""
+        if not self.pages:
+            return None
+        return max(
+            0.0, self._first_buffered_at + self.flush_interval - time.monotonic()
+        )
+
+    def flush(self) -> None:
+        if not self.pages:
+            return
+        pages, self.pages = self.pages, []
+        start = time.monotonic()
+        try:
+            for parsed_page in pages:
+                self._index_page(parsed_page)
+            self.db.commit()
+        except SQLAlchemyError as e:
+            logger.warning(f"Failed to write batch of {len(pages)} pages - {e}")
+            self._rollback()
+            # write page by page to keep everything but the broken pages
+            for parsed_page in pages:
+                self._index_page_alone(parsed_page)
+        self.indexed_count += len(pages)
+        self.db.fill_stat(self.indexed_count)
+        logger.debug(
+            f"Indexed batch of {len(pages)} pages in {time.monotonic() - start:.3f}s"
+        )
+        if time.monotonic() - self._checkpointed_at >= self.checkpoint_interval:
+            self.db.checkpoint()
+            self._checkpointed_at = time.monotonic()
+
+    def _index_page_alone(self, parsed_page: ParsedPage) -> None:
+        try:
+            self._index_page(parsed_page)
+            self.db.commit()
+        except SQLAlchemyError as e:
+            logger.warning(
+                f"Failed to write to DB {parsed_page.url} {parsed_page.depth} - {e}"
+            )
+            self._rollback()
+            self.failed_urls.append(parsed_page.url)
+
+    def _rollback(self) -> None:
+        self.db.rollback()
+        # fingerprints of the rolled back pages would make them near
+        # duplicates of themselves when they are written again
+        self.fingerprints.load(self.db.get_fingerprints())
+
+    def _index_page(self, parsed_page: ParsedPage) -> None:
+        elements = parsed_page.elements
+
+        fetched_url_id = self.db.insert_url(parsed_page.url)
+        if parsed_page.url in self.url_states:
+            self.db.delete_url_index(fetched_url_id)
+            self.fingerprints.remove(fetched_url_id)
+
+        canonical_url_id = self.fingerprints.find(parsed_page.fingerprint)
+        if canonical_url_id is not None:
+            logger.debug(
+                f"{parsed_page.url} is a near duplicate of url {canonical_url_id}"
+            )
+            self.db.insert_url_alias(fetched_url_id, canonical_url_id)
+        else:
+            self.db.insert_links_from_elements(elements)
+            self.db.insert_words_from_elements(elements)
+            self.db.insert_links_between_by_elements(elements, fetched_url_id)
+            self.db.fill_words_locations_by_elements(elements, fetched_url_id)
+            self.db.fill_link_words_by_elements(elements)
+            if parsed_page.fingerprint:
+                self.db.insert_url_fingerprint(fetched_url_id, parsed_page.fingerprint)
+                self.fingerprints.add(fetched_url_id, parsed_page.fingerprint)
+
+        self.db.upsert_url_state(
+            UrlState(
+                url_id=fetched_url_id,
+                etag=parsed_page.etag,
+                last_modified=parsed_page.last_modified,
+                content_hash=parsed_page.content_hash,
+            )
+        )
@@ -15,6 +15,7 @@ class Element:
 class LinkToGo:
     link: str
     depth: int = 0
+    priority: int = 0
 
     def __hash__(self) -> int:
         return hash(self.link)
@@ -25,6 +26,30 @@ class FetchedUrl:
     url: str
     text: str
     depth: int = 0
+    etag: str = ""
+    last_modified: str = ""
+    not_modified: bool = False
+
+
+@dataclass
+class ParsedPage:
+    url: str
+    elements: List[Element]
+    depth: int = 0
+    etag: str = ""
+    last_modified: str = ""
+    content_hash: str = ""
+    fingerprint: int = 0
+    not_modified: bool = False
+
+
+@dataclass
+class UrlState:
+    url_id: int
+    etag: str = ""
+    last_modified: str = ""
+    content_hash: str = ""
+
 
 @dataclass
 class WordLocationsCombination:
@@ -0,0 +1,399 @@
+import multiprocessing
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from src.graph import EdgeFile, LinkGraph
+from src.model import PageRankURL
+
+# ranks are kept on the scale the ranker always stored: every page starts
+# at 1.0 and gets (1 - damping) + damping * sum of rank / links count over
+# the pages linking to it, so ranks sum up to the pages count
+
+
+@dataclass
+class PageRankResult:
+    ranks: np.ndarray
+    iterations: int
+    # mean absolute rank change of the last iteration
+    residual: float
+
+
+def loop_page_rank(
+    pages: Dict[int, PageRankURL], iterations: int, damping: float
+) -> None:
+    """Ranks of pages updated in place by the reference lists, links of pages
+    without outgoing links are lost. The original engine, kept for parity."""
+    for _ in range(iterations):
+        for page in pages.values():
+            other_links_sum = 0
+            for ref in page.references:
+                other_links_sum += pages.get(ref).ratio
+            page.rank = (1 - damping) + damping * other_links_sum
+
+        for page in pages.values():
+            page.ratio = page.rank / page.links_count if page.links_count else page.rank
+
+
+def build_pages(graph: LinkGraph) -> Dict[int, PageRankURL]:
+    """Pages of loop_page_rank at their starting ranks."""
+    pages: Dict[int, PageRankURL] = dict()
+    for node, url_id in enumerate(graph.url_ids.tolist()):
+        links_count = int(graph.out_degrees[node])
+        pages[url_id] = PageRankURL(
+            id=url_id,
+            links_count=links_count,
+            rank=1.0,
+            ratio=1.0 / links_count if links_count else 1.0,
+            references=graph.url_ids[graph.sources_of(node)].tolist(),
+        )
+    return pages
+
+
+def build_transition(graph: LinkGraph) -> sparse.csr_matrix:
+    """Link matrix in CSR, row i holds 1 / out degree of every node linking
+    to node i, parallel links add up like they do in the links count.
+
+    The in-edge arrays of the graph already are the CSR structure.
+    """
+    weights = 1.0 / graph.out_degrees[graph.in_sources]
+    return sparse.csr_matrix(
+        (weights, graph.in_sources, graph.in_offsets),
+        shape=(graph.nodes_count, graph.nodes_count),
+    )
+
+
+def sparse_page_rank(
+    transition: sparse.csr_matrix,
+    out_degrees: np.ndarray,
+    damping: float,
+    tolerance: float,
+    max_iterations: int,
+    redistribute_dangling: bool = True,
+) -> PageRankResult:
+    """Power iteration until the mean absolute rank change is under tolerance.
+
+    Rank of pages without outgoing links is spread over all pages, without
+    redistribute_dangling it is lost like in loop_page_rank, which together
+    with tolerance=0 reproduces the loop engine.
+    """
+    nodes_count = transition.shape[0]
+    ranks = np.ones(nodes_count)
+    if nodes_count == 0:
+        return PageRankResult(ranks=ranks, iterations=0, residual=0.0)
+
+    dangling = out_degrees == 0
+    iterations = 0
+    residual = np.inf
+    while iterations < max_iterations and residual > tolerance:
+        spread = transition @ ranks
+        if redistribute_dangling:
+            spread += ranks[dangling].sum() / nodes_count
+        new_ranks = (1 - damping) + damping * spread
+        residual = float(np.abs(new_ranks - ranks).sum() / nodes_count)
+        ranks = new_ranks
+        iterations += 1
+    return PageRankResult(ranks=ranks, iterations=iterations, residual=residual)
+
+
+def out_of_core_page_rank(
+    edge_file: EdgeFile,
+    damping: float,
+    tolerance: float,
+    max_iterations: int,
+    block_size: int,
+) -> PageRankResult:
+    """sparse_page_rank over the links of edge_file read block_size at a time.
+
+    Only vectors of the nodes are kept in memory, the links sorted by target
+    sum up into a contiguous range of the nodes per block.
+    """
+    nodes_count = edge_file.nodes_count
+    ranks = np.ones(nodes_count)
+    if nodes_count == 0:
+        return PageRankResult(ranks=ranks, iterations=0, residual=0.0)
+
+    out_degrees = edge_file.out_degrees
+    dangling = out_degrees == 0
+    inverse_degrees = np.zeros(nodes_count)
+    np.divide(1.0, out_degrees, out=inverse_degrees, where=~dangling)
+    iterations = 0
+    residual = np.inf
+    while iterations < max_iterations and residual > tolerance:
+        ratios = ranks * inverse_degrees
+        spread = np.zeros(nodes_count)
+        for block in edge_file.blocks(block_size):
+            targets = block[:, 0]
+            first, last = int(targets[0]), int(targets[-1])
+            spread[first : last + 1] += np.bincount(
+                targets - first, weights=ratios[block[:, 1]], minlength=last - first + 1
+            )
+        spread += ranks[dangling].sum() / nodes_count
+        new_ranks = (1 - damping) + damping * spread
+        residual = float(np.abs(new_ranks - ranks).sum() / nodes_count)
+        ranks = new_ranks
+        iterations += 1
+    return PageRankResult(ranks=ranks, iterations=iterations, residual=residual)
+
+
+class _SharedArrays:
+    """Copies of arrays in shared memory blocks, attached by name in workers."""
+
+    def __init__(self) -> None:
+        self.arrays: Dict[str, np.ndarray] = dict()
+        self.layouts: Dict[str, Tuple[str, tuple, str]] = dict()
+        self._memories: List[shared_memory.SharedMemory] = []
+
+    def add(self, key: str, array: np.ndarray) -> None:
+        memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self._memories.append(memory)
+        self.arrays[key] = np.ndarray(array.shape, dtype=array.dtype, buffer=memory.buf)
+        self.arrays[key][:] = array
+        self.layouts[key] = (memory.name, array.shape, array.dtype.str)
+
+    def close(self) -> None:
+        # views have to go before their blocks are closed
+        self.arrays.clear()
+        for memory in self._memories:
+            memory.close()
+            memory.unlink()
+
+
+# shared arrays of a parallel_page_rank worker process
+_worker_memories: List[shared_memory.SharedMemory] = []
+_worker_arrays: Dict[str, np.ndarray] = dict()
+
+
+def _attach_worker(layouts: Dict[str, Tuple[str, tuple, str]]) -> None:
+    for key, (name, shape, dtype) in layouts.items():
+        memory = shared_memory.SharedMemory(name=name)
+        _worker_memories.append(memory)
+        _worker_arrays[key] = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+
+
+def _spread_part(bounds: Tuple[int, int]) -> None:
+    """Rows first:last of the link matrix times the ranks, into spread."""
+    first, last = bounds
+    indptr = _worker_arrays["indptr"]
+    start, end = int(indptr[first]), int(indptr[last])
+    part = sparse.csr_matrix(
+        (
+            _worker_arrays["data"][start:end],
+            _worker_arrays["indices"][start:end],
+            indptr[first : last + 1] - start,
+        ),
+        shape=(last - first, len(_worker_arrays["ranks"])),
+    )
+    _worker_arrays["spread"][first:last] = part @ _worker_arrays["ranks"]
+
+
+def _partition(indptr: np.ndarray, parts_count: int) -> List[Tuple[int, int]]:
+    """Row ranges with about the same number of links each."""
+    links_count = int(indptr[-1])
+    bounds = np.searchsorted(indptr, np.linspace(0, links_count, parts_count + 1))
+    bounds[0], bounds[-1] = 0, len(indptr) - 1
+    bounds = np.unique(bounds)
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def _apply_spread(arrays: Dict[str, np.ndarray], dangling: np.ndarray, damping: float) -> float:
+    """Ranks of the next iteration from the spread, returns the residual."""
+    ranks, spread = arrays["ranks"], arrays["spread"]
+    spread += ranks[dangling].sum() / len(ranks)
+    new_ranks = (1 - damping) + damping * spread
+    residual = float(np.abs(new_ranks - ranks).sum() / len(ranks))
+    ranks[:] = new_ranks
+    return residual
+
+
+def parallel_page_rank(
+    graph: LinkGraph,
+    damping: float,
+    tolerance: float,
+    max_iterations: int,
+    processes: int,
+) -> PageRankResult:
+    """sparse_page_rank with the rows of the link matrix split over processes.
+
+    The link matrix, ranks and spread live in shared memory. Every process
+    multiplies a range of target rows with about the same number of links
+    each and the rest of the iteration runs here. A row is summed by the
+    same CSR kernel in the same order as in sparse_page_rank, the ranks are
+    the same bit for bit whatever the number of processes.
+
+    A single process only adds the pool overhead, sparse_page_rank runs
+    instead.
+    """
+    nodes_count = graph.nodes_count
+    if nodes_count == 0:
+        return PageRankResult(ranks=np.ones(0), iterations=0, residual=0.0)
+
+    transition = build_transition(graph)
+    if processes <= 1:
+        return sparse_page_rank(
+            transition, graph.out_degrees, damping, tolerance, max_iterations
+        )
+    dangling = graph.out_degrees == 0
+    shared = _SharedArrays()
+    try:
+        shared.add("indptr", transition.indptr)
+        shared.add("indices", transition.indices)
+        shared.add("data", transition.data)
+        del transition
+        shared.add("ranks", np.ones(nodes_count))
+        shared.add("spread", np.zeros(nodes_count))
+        bounds = _partition(shared.arrays["indptr"], processes)
+
+        with multiprocessing.Pool(
+            processes, initializer=_attach_worker, initargs=(shared.layouts,)
+        ) as pool:
+            iterations = 0
+            residual = np.inf
+            while iterations < max_iterations and residual > tolerance:
+                pool.map(_spread_part, bounds)
+                residual = _apply_spread(shared.arrays, dangling, damping)
+                iterations += 1
+        return PageRankResult(
+            ranks=shared.arrays["ranks"].copy(), iterations=iterations, residual=residual
+        )
+    finally:
+        shared.close()
+
+
+@dataclass
+class PushResult:
+    # urls whose rank changed and their ranks, on the scale of the stored ranks
+    url_ids: np.ndarray
+    ranks: np.ndarray
+    pushes: int
+    # links read for the residuals and the pushes
+    read_links: int
+    # absolute residuals left, every url is under the push tolerance
+    residual: float
+
+
+# ranked urls sampled for the scale of the stored ranks
+SCALE_SAMPLE_SIZE = 100
+
+
+def _stored_terms(
+    source, url_ids: np.ndarray, damping: float
+) -> Tuple[np.ndarray, np.ndarray, int]:
+    """Stored ranks of the sorted url_ids, damping * the sum of stored rank /
+    out degree over the urls linking to them, new urls rank 0, and the
+    number of links read."""
+    links = source.get_links_to(url_ids)
+    sources, link_sources = np.unique(links[:, 0], return_inverse=True)
+    ratios = np.nan_to_num(source.get_page_ranks(sources)) / source.get_out_degrees(sources)
+    incoming = np.bincount(
+        np.searchsorted(url_ids, links[:, 1]),
+        weights=ratios[link_sources],
+        minlength=len(url_ids),
+    )
+    return np.nan_to_num(source.get_page_ranks(url_ids)), damping * incoming, len(links)
+
+
+def _link_shares(
+    links: np.ndarray, url_ids: np.ndarray, values: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Value of every sorted url_ids split evenly over its links in (from,
+    to) pairs, as the targets and the sum of the shares they get."""
+    link_sources = np.searchsorted(url_ids, links[:, 0])
+    out_degrees = np.bincount(link_sources, minlength=len(url_ids))
+    shares = values[link_sources] / out_degrees[link_sources]
+    targets, link_targets = np.unique(links[:, 1], return_inverse=True)
+    return targets, np.bincount(link_targets, weights=shares, minlength=len(targets))
+
+
+def push_page_rank(
+    source,
+    changed_url_ids: np.ndarray,
+    changed_links: np.ndarray,
+    damping: float,
+    tolerance: float,
+    max_read_links: int,
+) -> Optional[PushResult]:
+    """Stored ranks of a DbActor, or a RankedGraph, brought up to date by
+    pushing residuals from the urls whose links changed.
+
+    With the rank of pages without outgoing links spread over all pages the
+    ranks are a multiple of u = (1 - damping) + damping * P u, which has no
+    global term, so a change only reaches the urls downstream of it. The
+    stored ranks x are scaled to u and only the columns of P of the urls in
+    changed_url_ids changed since they were calculated, their links then are
+    changed_links. So the residual (1 - damping) + damping * P x - x is
+    damping * x_s / out degree taken from the old targets and given to the
+    new targets of every changed url s, plus 1 - damping for new urls. The
+    urls whose residual is over tolerance add it to their rank and pass
+    damping * residual / out degree to the urls they link to, a whole
+    frontier at a time, until no residual is over tolerance.
+
+    Only the links of the changed and the pushed urls are read. Once more
+    than max_read_links are read None is returned, a full calculation is
+    cheaper.
+    """
+    changed_url_ids = np.unique(np.asarray(changed_url_ids, dtype=np.int64))
+    links = source.get_links_from(changed_url_ids)
+    read_links = len(links) + len(changed_links)
+    if read_links > max_read_links:
+        return None
+
+    stored = source.get_page_ranks(changed_url_ids)
+    new_url_ids = changed_url_ids[np.isnan(stored)]
+    stored = np.nan_to_num(stored)
+    targets, shares = _link_shares(links, changed_url_ids, stored)
+    old_targets, old_shares = _link_shares(changed_links, changed_url_ids, stored)
+    touched = np.union1d(new_url_ids, np.union1d(targets, old_targets))
+
+    # (1 - damping) / scale on every url with an unchanged row
+    sample = source.get_ranked_url_ids(SCALE_SAMPLE_SIZE + len(touched))
+    sample = np.setdiff1d(sample, touched)[:SCALE_SAMPLE_SIZE]
+    sample_ranks, sample_incoming, sample_links = _stored_terms(source, sample, damping)
+    read_links += sample_links
+    if read_links > max_read_links:
+        return None
+    local = sample_ranks - sample_incoming
+    local = local[local > 0]
+    if len(local) == 0:
+        # every ranked url changed, nothing keeps the scale
+        return None
+    scale = (1 - damping) / np.median(local)
+
+    # residuals and rank changes on the u scale, indexed by url id
+    residuals = np.zeros(source.last_url_id + 1)
+    deltas = np.zeros(len(residuals))
+    pushed_mask = np.zeros(len(residuals), dtype=bool)
+    residuals[new_url_ids] = 1 - damping
+    residuals[targets] += damping * scale * shares
+    residuals[old_targets] -= damping * scale * old_shares
+
+    frontier = touched[np.abs(residuals[touched]) > tolerance]
+    pushes = 0
+    while len(frontier):
+        pushed = residuals[frontier]
+        residuals[frontier] = 0.0
+        deltas[frontier] += pushed
+        pushed_mask[frontier] = True
+        pushes += len(frontier)
+
+        links = source.get_links_from(frontier)
+        read_links += len(links)
+        if read_links > max_read_links:
+            return None
+        # frontier is sorted, it comes out of np.unique
+        targets, shares = _link_shares(links, frontier, pushed)
+        residuals[targets] += damping * shares
+        frontier = targets[np.abs(residuals[targets]) > tolerance]
+
+    url_ids = np.flatnonzero(pushed_mask)
+    stored_ranks = np.nan_to_num(source.get_page_ranks(url_ids))
+    return PushResult(
+        url_ids=url_ids,
+        ranks=stored_ranks + deltas[url_ids] / scale,
+        pushes=pushes,
+        read_links=read_links,
+        residual=float(np.abs(residuals).sum() / scale),
+    )
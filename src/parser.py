@@ -0,0 +1,216 @@
+import hashlib
+import re
+from html.parser import HTMLParser
+from typing import List, Optional, Tuple
+
+import bs4
+from bs4 import BeautifulSoup, Comment
+
+from src.dedup import SimHash
+from src.model import Element
+
+# words of a page plus (start, end, href) runs of the words inside links
+CompactElements = Tuple[List[str], List[Tuple[int, int, str]]]
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8", errors="replace")).hexdigest()
+
+
+def parse_page(
+    text: str, engine: str, stored_hash: str = ""
+) -> Tuple[Optional[List[Element]], str, int]:
+    """Elements, content hash and SimHash fingerprint of a page, the CPU
+    heavy part of the parse stage. Elements are None when the content hash
+    equals stored_hash, the page did not change since it was indexed."""
+    text_hash = content_hash(text)
+    if text_hash == stored_hash:
+        return None, text_hash, 0
+    elements = Parser(engine).parse_text_elements(text)
+    fingerprint = SimHash().fingerprint([element.word for element in elements])
+    return elements, text_hash, fingerprint
+
+
+def parse_compact(
+    text: str, engine: str, stored_hash: str = ""
+) -> Tuple[Optional[CompactElements], str, int]:
+    """Process pool entry point, parse_page with elements in a compact form
+    that is cheap to pickle."""
+    elements, text_hash, fingerprint = parse_page(text, engine, stored_hash)
+    if elements is None:
+        return None, text_hash, fingerprint
+    return Parser.to_compact(elements), text_hash, fingerprint
+
+
+class StreamTokenizer(HTMLParser):
+    """Event based tokenizer collecting what the soup engine reads from the tree.
+
+    ``tags`` holds a (name, first direct text, href) entry per tag in start tag
+    order; tags are only opened and closed, no tree is built.
+    """
+
+    SKIPPED_TAGS = {"script", "style", "template"}
+    # html.parser tree builder closes these right away, they never hold text
+    VOID_TAGS = {
+        "area", "base", "basefont", "bgsound", "br", "col", "command", "embed",
+        "frame", "hr", "image", "img", "input", "isindex", "keygen", "link",
+        "menuitem", "meta", "nextid", "param", "source", "spacer", "track", "wbr",
+    }
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.tags: List[List] = []
+        # open tags as (name, index in self.tags), index is -1 inside skipped tags
+        self._open: List[Tuple[str, int]] = []
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        if tag in self.VOID_TAGS:
+            return
+        if tag in self.SKIPPED_TAGS or (self._open and self._open[-1][1] == -1):
+            self._open.append((tag, -1))
+            return
+        href = None
+        if tag == "a":
+            href = next((value or "" for name, value in attrs if name == "href"), None)
+        self._open.append((tag, len(self.tags)))
+        self.tags.append([tag, None, href])
+
+    def handle_startendtag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        self.handle_starttag(tag, attrs)
+        self.handle_endtag(tag)
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in self.VOID_TAGS:
+            return
+        for i in range(len(self._open) - 1, -1, -1):
+            if self._open[i][0] == tag:
+                del self._open[i:]
+                return
+
+    def handle_data(self, data: str) -> None:
+        if not self._open:
+            return
+        index = self._open[-1][1]
+        if index != -1 and self.tags[index][1] is None:
+            self.tags[index][1] = data
+
+    # the soup tree keeps declarations and processing instructions as strings
+    # of their tag, their text is taken the way html.parser tree builder does
+
+    def handle_decl(self, decl: str) -> None:
+        self.handle_data(decl[len("DOCTYPE "):])
+
+    def unknown_decl(self, data: str) -> None:
+        if data.upper().startswith("CDATA["):
+            data = data[len("CDATA["):]
+        self.handle_data(data)
+
+    def handle_pi(self, data: str) -> None:
+        self.handle_data(data)
+
+
+class Parser:
+    ENGINES = ("soup", "stream")
+    DEFAULT_ENGINE = "stream"
+
+    def __init__(self, engine: str = DEFAULT_ENGINE) -> None:
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown parser engine {engine}. Available: {self.ENGINES}")
+        self.engine = engine
+
+    def parse_text_elements(self, text: str) -> List[Element]:
+        if self.engine == "stream":
+            return self._parse_stream(text)
+        return self._parse_soup(text)
+
+    def _parse_soup(self, text: str) -> List[Element]:
+        soup = BeautifulSoup(text, "html.parser")
+
+        for data in soup(["style", "script", "meta", "template"]):
+            data.decompose()
+
+        for element in soup(
+            text=lambda text: isinstance(text, Comment)
+        ):  # remove html comments
+            element.extract()
+
+        return self._parse_tags(tags=soup.find_all())
+
+    def _parse_tags(self, tags: List[bs4.Tag]) -> List[Element]:
+        output_elements: List[Element] = []
+
+        for tag in tags:
+            tag_text = tag.find(text=True, recursive=False)
+            if tag_text is None:
+                continue
+            href = ""
+            if tag.name == "a":
+                href = self._clean_href(tag.get("href"))
+            self._append_words(output_elements, tag_text, href)
+
+        return output_elements
+
+    def _parse_stream(self, text: str) -> List[Element]:
+        tokenizer = StreamTokenizer()
+        tokenizer.feed(text)
+        tokenizer.close()
+
+        output_elements: List[Element] = []
+        for tag_name, tag_text, href in tokenizer.tags:
+            if tag_text is None:
+                continue
+            if tag_name == "a":
+                href = self._clean_href(href)
+            else:
+                href = ""
+            self._append_words(output_elements, tag_text, href)
+
+        return output_elements
+
+    def _append_words(
+        self, output_elements: List[Element], text: str, href: Optional[str]
+    ) -> None:
+        words = self._text_to_words(text)
+        for i, word in enumerate(words, start=len(output_elements)):
+            output_elements.append(Element(word=word, location=i, href=href))
+
+    @staticmethod
+    def _clean_href(href: Optional[str]) -> Optional[str]:
+        if href is None:
+            return href
+        if (
+            "mailto:" in href
+            or "tel:" in href
+            or href.endswith((".jpg", ".png", ".gif", ".jpeg", ".pdf"))
+            or not href.startswith("http")
+        ):
+            href = ""
+        return href.strip("/")
+
+    def _text_to_words(self, text: str) -> List[str]:
+        words = list(filter(None, re.split("[\W\d]+", text, flags=re.UNICODE)))
+        for i, word in enumerate(words):
+            words[i] = word.lower()
+        return words
+
+    @staticmethod
+    def to_compact(elements: List[Element]) -> CompactElements:
+        words = [element.word for element in elements]
+        links: List[Tuple[int, int, str]] = []
+        for i, element in enumerate(elements):
+            if not element.href:
+                continue
+            if links and links[-1][1] == i and links[-1][2] == element.href:
+                links[-1] = (links[-1][0], i + 1, element.href)
+            else:
+                links.append((i, i + 1, element.href))
+        return words, links
+
+    @staticmethod
+    def from_compact(compact: CompactElements) -> List[Element]:
+        words, links = compact
+        elements = [Element(word=word, location=i) for i, word in enumerate(words)]
+        for start, end, href in links:
+            for element in elements[start:end]:
+                element.href = href
+        return elements
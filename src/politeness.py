@@ -0,0 +1,177 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+
+import aiohttp
+from loguru import logger
+
+from src.model import LinkToGo
+
+
+def get_host(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if now <= self.updated_at:
+            return
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def try_acquire(self, now: float) -> bool:
+        self._refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def wait_time(self, now: float) -> float:
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class RobotsCache:
+    USER_AGENT = "*"
+    FETCH_TIMEOUT = 5
+
+    def __init__(self) -> None:
+        self._robots: Dict[str, "asyncio.Future[RobotFileParser]"] = dict()
+
+    def is_loaded(self, host: str) -> bool:
+        robots = self._robots.get(host)
+        return robots is not None and robots.done()
+
+    def crawl_delay(self, host: str) -> Optional[float]:
+        if not self.is_loaded(host):
+            return None
+        delay = self._robots[host].result().crawl_delay(self.USER_AGENT)
+        return float(delay) if delay else None
+
+    async def can_fetch(self, session: aiohttp.ClientSession, url: str) -> bool:
+        robots = await self._get(session, url)
+        return robots.can_fetch(self.USER_AGENT, url)
+
+    async def _get(self, session: aiohttp.ClientSession, url: str) -> RobotFileParser:
+        host = get_host(url)
+        if host not in self._robots:
+            # concurrent requests to a new host wait for the same robots.txt
+            self._robots[host] = asyncio.ensure_future(self._load(session, url))
+        return await self._robots[host]
+
+    async def _load(self, session: aiohttp.ClientSession, url: str) -> RobotFileParser:
+        parts = urlsplit(url)
+        robots_url = f"{parts.scheme}://{parts.netloc}/robots.txt"
+        robots = RobotFileParser(robots_url)
+        try:
+            async with session.get(
+                robots_url, timeout=aiohttp.ClientTimeout(total=self.FETCH_TIMEOUT)
+            ) as response:
+                # same status handling as RobotFileParser.read()
+                if response.status in (401, 403):
+                    robots.disallow_all = True
+                elif 400 <= response.status < 500:
+                    robots.allow_all = True
+                else:
+                    text = await response.text(errors="replace")
+                    robots.parse(text.splitlines())
+        except Exception as e:
+            logger.debug(f"Failed to fetch {robots_url} - {repr(e)}")
+            robots.allow_all = True
+        logger.debug(f"Loaded {robots_url}")
+        return robots
+
+
+class HostScheduler:
+    """Per host queues of links released at a token bucket rate per host.
+
+    Once robots.txt of a host is loaded its Crawl-delay caps the host rate.
+    """
+
+    HOST_RATE = 2.0
+    HOST_BURST = 2
+    MAX_BUFFERED = 1000
+
+    def __init__(
+        self,
+        robots: RobotsCache,
+        rate: float = HOST_RATE,
+        burst: int = HOST_BURST,
+        max_buffered: int = MAX_BUFFERED,
+    ) -> None:
+        self.robots = robots
+        self.rate = rate
+        self.burst = burst
+        self.max_buffered = max_buffered
+        # hosts with queued links, rotated for round robin between hosts
+        self._queues: "OrderedDict[str, Deque[LinkToGo]]" = OrderedDict()
+        self._buckets: Dict[str, TokenBucket] = dict()
+        self._delay_applied = set()
+        self._buffered = 0
+
+    def __len__(self) -> int:
+        return self._buffered
+
+    @property
+    def free_buffer(self) -> int:
+        return max(0, self.max_buffered - self._buffered)
+
+    def push(self, link: LinkToGo) -> None:
+        host = get_host(link.link)
+        self._queues.setdefault(host, deque()).append(link)
+        self._buffered += 1
+
+    def pop_ready(self, limit: int) -> List[LinkToGo]:
+        ready: List[LinkToGo] = []
+        now = time.monotonic()
+        for host in list(self._queues):
+            if len(ready) >= limit:
+                break
+            queue = self._queues[host]
+            if not self._bucket(host).try_acquire(now):
+                continue
+            ready.append(queue.popleft())
+            if queue:
+                self._queues.move_to_end(host)
+            else:
+                del self._queues[host]
+        self._buffered -= len(ready)
+        return ready
+
+    def next_ready_in(self) -> Optional[float]:
+        if not self._queues:
+            return None
+        now = time.monotonic()
+        return min(self._bucket(host).wait_time(now) for host in self._queues)
+
+    def drain(self) -> List[LinkToGo]:
+        links = [link for queue in self._queues.values() for link in queue]
+        self._queues.clear()
+        self._buffered = 0
+        return links
+
+    def _bucket(self, host: str) -> TokenBucket:
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+            self._buckets[host] = bucket
+        if host not in self._delay_applied and self.robots.is_loaded(host):
+            self._delay_applied.add(host)
+            delay = self.robots.crawl_delay(host)
+            if delay:
+                bucket.rate = min(bucket.rate, 1 / delay)
+                bucket.capacity = 1
+                bucket.tokens = min(bucket.tokens, 1)
+                logger.debug(f"Crawl-delay {delay}s for {host}")
+        return bucket
@@ -0,0 +1,85 @@
+import itertools
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from src.model import WordLocationsCombination
+
+
+def encode_varint(value: int, blob: bytearray) -> None:
+    # 7 bits per byte, the high bit marks that more bytes follow
+    while value >= 0x80:
+        blob.append(value & 0x7F | 0x80)
+        value >>= 7
+    blob.append(value)
+
+
+def decode_varint(blob, offset: int) -> Tuple[int, int]:
+    """Value of the varint at offset and the offset right after it."""
+    value = 0
+    shift = 0
+    while True:
+        byte = blob[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+def encode_positions(positions: Iterable[int]) -> bytes:
+    """Sorted positions as varint encoded gaps from the previous position."""
+    blob = bytearray()
+    previous = 0
+    for position in sorted(positions):
+        encode_varint(position - previous, blob)
+        previous = position
+    return bytes(blob)
+
+
+def decode_positions(blob: bytes) -> List[int]:
+    positions = []
+    position = 0
+    gap = 0
+    shift = 0
+    for byte in blob:
+        gap |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        position += gap
+        positions.append(position)
+        gap = 0
+        shift = 0
+    return positions
+
+
+def group_positions(pairs: Iterable[tuple]) -> Dict[int, List[int]]:
+    """(word id, position) pairs to positions of every word id."""
+    postings: Dict[int, List[int]] = dict()
+    for word_id, position in pairs:
+        postings.setdefault(word_id, []).append(position)
+    return postings
+
+
+def combine_postings(
+    postings_by_word: List[Dict[int, bytes]],
+    decode: Callable[[bytes], Sequence[int]] = decode_positions,
+) -> List[WordLocationsCombination]:
+    """Every combination of locations of the words on each url containing all of them.
+
+    Same rows as the word_location join, only positions of urls holding
+    every word are decoded.
+    """
+    combinations_list = []
+    for url_id, first_blob in postings_by_word[0].items():
+        blobs = [first_blob]
+        for postings in postings_by_word[1:]:
+            blob = postings.get(url_id)
+            if blob is None:
+                break
+            blobs.append(blob)
+        else:
+            for locations in itertools.product(*map(decode, blobs)):
+                combinations_list.append(
+                    WordLocationsCombination(url_id, list(locations))
+                )
+    return combinations_list
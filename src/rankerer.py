@@ -1,63 +1,204 @@
-from typing import Dict
+import os
+import tempfile
 
+import numpy as np
 from loguru import logger
 
-from src.database import DbActor
-from src.model import PageRankURL
+from src.database import DbActor, DbCreator
+from src.graph import LinkGraph, load_link_graph, spill_links
+from src.pagerank import (
+    PageRankResult,
+    build_pages,
+    build_transition,
+    loop_page_rank,
+    out_of_core_page_rank,
+    parallel_page_rank,
+    push_page_rank,
+    sparse_page_rank,
+)
+from src.settings import (
+    PAGE_RANK_BLOCK_SIZE,
+    PAGE_RANK_ENGINE,
+    PAGE_RANK_MAX_ITERATIONS,
+    PAGE_RANK_PROCESSES,
+    PAGE_RANK_PUSH_MAX_LINKS_SHARE,
+    PAGE_RANK_PUSH_TOLERANCE,
+    PAGE_RANK_TOLERANCE,
+    SNAPSHOT_DIRECTORY,
+    USE_SNAPSHOT,
+)
+from src.snapshot import Snapshot
 
 
 def calculate_ranks():
-    PageRankerer().calculate_ranks()
+    rankerer = PageRankerer()
+    rankerer.calculate_ranks()
+    rankerer.close()
+
+
+def update_ranks():
+    rankerer = PageRankerer()
+    rankerer.update_ranks()
+    rankerer.close()
 
 
 class PageRankerer:
-    def __init__(self) -> None:
+    ENGINES = ("loop", "sparse", "out_of_core", "parallel")
+
+    def __init__(
+        self, use_snapshot: bool = USE_SNAPSHOT, engine: str = PAGE_RANK_ENGINE
+    ) -> None:
+        if engine not in self.ENGINES:
+            raise ValueError(f"engine must be one of {self.ENGINES}, got {engine!r}")
+        self.engine = engine
+        self.use_snapshot = use_snapshot
         self.db = DbActor()
+        # links are read from the snapshot when there is one, ranks are
+        # written to the db either way
+        self.graph = Snapshot(SNAPSHOT_DIRECTORY) if use_snapshot else self.db
         self.iterations_count = 25
         self.rank_coeff = 0.85
+        self.tolerance = PAGE_RANK_TOLERANCE
+        self.max_iterations = PAGE_RANK_MAX_ITERATIONS
+        self.push_tolerance = PAGE_RANK_PUSH_TOLERANCE
+        self.push_max_links_share = PAGE_RANK_PUSH_MAX_LINKS_SHARE
+        self.block_size = PAGE_RANK_BLOCK_SIZE
+        self.processes = PAGE_RANK_PROCESSES or os.cpu_count()
 
     def close(self) -> None:
+        self.graph.close()
         self.db.close()
 
     def calculate_ranks(self):
-        logger.info("Start calculating page ranks ...")
-        url_ids = self.db.get_urls_ids()
-
-        page_ranks: Dict[int, PageRankURL] = dict()
-
-        for url_id in url_ids:
-            links_count = self.db.get_from_url_count(
-                url_id
-            )  # на сколько страниц можно попасть с нашей
-            references = self.db.get_from_urls_by_to(
-                url_id
-            )  # страницы которые смотрят на нашу
-            page_ranks.setdefault(
-                url_id,
-                PageRankURL(
-                    id=url_id,
-                    links_count=links_count,
-                    rank=1.0,
-                    ratio=1.0 / links_count if links_count else 1.0,
-                    references=references,
-                ),
+        # the change log is kept by the db, a snapshot may be older than it
+        changes = [] if self.use_snapshot else self.db.get_page_rank_changes()
+        self._calculate_engine_ranks()
+        self.db.delete_page_rank_changes(changes)
+        self.db.save_to_db_to_disk()
+
+    def _calculate_engine_ranks(self) -> None:
+        logger.info(f"Start calculating page ranks with the {self.engine} engine ...")
+        if self.engine == "out_of_core":
+            self._calculate_out_of_core_ranks()
+        else:
+            graph = load_link_graph(self.graph)
+            logger.info(f"Loaded {graph.nodes_count} urls and {graph.links_count} links")
+            if self.engine == "sparse":
+                self._calculate_sparse_ranks(graph)
+            elif self.engine == "parallel":
+                self._calculate_parallel_ranks(graph)
+            else:
+                self._calculate_loop_ranks(graph)
+
+    def update_ranks(self):
+        """Stored ranks brought up to date with the urls logged in the db as
+        changed since they were calculated, ranks of untouched urls are left
+        as they are. Falls back to a full calculation when that is cheaper."""
+        full_reason = None
+        if self.use_snapshot:
+            full_reason = "Links are read from the snapshot"
+        elif self.db.get_schema_version() < DbCreator.SCHEMA_VERSION:
+            full_reason = "Db has no page rank change log yet"
+        elif self.db.is_page_rank_table_empty():
+            full_reason = "No stored page ranks to update"
+        if full_reason:
+            logger.info(f"{full_reason}, calculating all page ranks")
+            self.calculate_ranks()
+            return
+
+        changes = self.db.get_page_rank_changes()
+        if not changes:
+            logger.info("Page ranks are up to date")
+            return
+        logger.info(f"Start updating page ranks from {len(changes)} changed urls ...")
+        max_read_links = int(self.db.get_links_count() * self.push_max_links_share)
+        changed_url_ids = np.array(changes, dtype=np.int64)
+        result = push_page_rank(
+            self.db,
+            changed_url_ids,
+            self.db.get_page_rank_change_links(changed_url_ids),
+            self.rank_coeff,
+            self.push_tolerance,
+            max_read_links,
+        )
+        if result is None:
+            logger.info(
+                f"Changes reach more than {max_read_links} links, calculating all page ranks"
+            )
+            self._calculate_engine_ranks()
+        else:
+            self.db.update_page_ranks(zip(result.url_ids.tolist(), result.ranks.tolist()))
+            logger.success(
+                f"Page ranks of {len(result.url_ids)} urls updated in {result.pushes} pushes"
+                f" over {result.read_links} links, residual {result.residual:.2e}"
             )
+        self.db.delete_page_rank_changes(changes)
+        self.db.save_to_db_to_disk()
 
-        for _ in range(self.iterations_count):
-            for page in page_ranks.values():
-                other_links_sum = 0
-                for ref in page.references:
-                    other_links_sum += page_ranks.get(ref).ratio
-                page.rank = (1 - self.rank_coeff) + self.rank_coeff * other_links_sum
+    def _calculate_sparse_ranks(self, graph: LinkGraph) -> None:
+        result = sparse_page_rank(
+            build_transition(graph),
+            graph.out_degrees,
+            damping=self.rank_coeff,
+            tolerance=self.tolerance,
+            max_iterations=self.max_iterations,
+        )
+        self._save_ranks(graph.url_ids, result)
 
-            for page in page_ranks.values():
-                page.ratio = (
-                    page.rank / page.links_count if page.links_count else page.rank
-                )
+    def _calculate_parallel_ranks(self, graph: LinkGraph) -> None:
+        logger.info(f"Ranking over {self.processes} processes")
+        result = parallel_page_rank(
+            graph,
+            damping=self.rank_coeff,
+            tolerance=self.tolerance,
+            max_iterations=self.max_iterations,
+            processes=self.processes,
+        )
+        self._save_ranks(graph.url_ids, result)
 
-        self.db.fill_page_rank(list(page_ranks.values()))
+    def _calculate_out_of_core_ranks(self) -> None:
+        # links spilled next to the db, temporary directories may be in memory
+        with tempfile.TemporaryDirectory(dir=os.getcwd()) as directory:
+            edge_file = spill_links(
+                self.graph.get_urls_ids(),
+                self.graph.iter_links(),
+                os.path.join(directory, "links.bin"),
+                self.block_size,
+            )
+            logger.info(
+                f"Spilled {edge_file.links_count} links between {edge_file.nodes_count} urls"
+            )
+            result = out_of_core_page_rank(
+                edge_file,
+                damping=self.rank_coeff,
+                tolerance=self.tolerance,
+                max_iterations=self.max_iterations,
+                block_size=self.block_size,
+            )
+            url_ids = edge_file.url_ids
+            del edge_file
+        self._save_ranks(url_ids, result)
 
-        self.db.save_to_db_to_disk()
+    def _save_ranks(self, url_ids: np.ndarray, result: PageRankResult) -> None:
+        self.db.replace_page_ranks(zip(url_ids.tolist(), result.ranks.tolist()))
+
+        if result.residual > self.tolerance:
+            logger.warning(
+                f"Page ranks did not converge in {result.iterations} iterations,"
+                f" residual {result.residual:.2e}"
+            )
+            return
+        logger.success(
+            f"Page ranks converged in {result.iterations} iterations,"
+            f" residual {result.residual:.2e}"
+        )
+
+    def _calculate_loop_ranks(self, graph: LinkGraph) -> None:
+        page_ranks = build_pages(graph)
+
+        loop_page_rank(page_ranks, self.iterations_count, self.rank_coeff)
+
+        self.db.fill_page_rank(list(page_ranks.values()))
 
         logger.success(
             f"Page ranks are calculated over {self.iterations_count} iterations!"
@@ -9,13 +9,20 @@ from loguru import logger
 from src.model import ResultURL
 from src.htmler import Htmler
 from src.database import DbActor
+from src.settings import SNAPSHOT_DIRECTORY, USE_SNAPSHOT
+from src.snapshot import Snapshot
 
 from src.model import ResultURL, WordLocationsCombination
 
 
 class Searcher:
-    def __init__(self) -> None:
-        self.db = DbActor()
+    def __init__(self, use_snapshot: bool = USE_SNAPSHOT) -> None:
+        if use_snapshot:
+            # exported columns mapped from SNAPSHOT_DIRECTORY, no db needed
+            self.db = Snapshot(SNAPSHOT_DIRECTORY)
+        else:
+            # shared handle on the index files, constant time to open per query
+            self.db = DbActor(read_only=True)
 
     def close(self) -> None:
         self.db.close()
@@ -80,6 +87,11 @@ class Searcher:
             logger.info("No URS found :(")
 
     def distance_score(self, words):
+        # document frequency is global over shards, a word missing
+        # everywhere leaves nothing to join
+        if any(self.db.get_document_frequency(word) == 0 for word in words):
+            return []
+
         combinations: List[WordLocationsCombination] = self.db.get_words_location_combinations(words)
 
         if len(combinations) == 0:
@@ -129,7 +141,7 @@ class Searcher:
     def get_normalized_page_ranks_by_result_urls(
         self, urls: List[ResultURL]
     ) -> List[ResultURL]:
-        if self.db.db.execute("SELECT COUNT(*) FROM page_rank").fetchone()[0] == 0:
+        if self.db.is_page_rank_table_empty():
             raise Exception("Empty ranks table")
 
         urls_dict = {url.url_id: url for url in urls}
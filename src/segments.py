@@ -0,0 +1,505 @@
+import json
+import math
+import mmap
+import os
+import struct
+import bisect
+import threading
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from src.postings import decode_positions, decode_varint, encode_positions, encode_varint
+
+# segment file layout, header fields are little endian, id arrays are
+# native uint32 arrays:
+#   header
+#   doc ids       sorted url ids indexed by the segment, including pages with
+#                 no postings, they hide the same urls in older segments
+#   edges         (from url id, to url id) pairs
+#   term table    TERM_ENTRY per term sorted by the utf-8 word
+#   words         utf-8 words the term table points into
+#   postings      per term: (url id gap, positions size, positions) varints
+#                 ordered by url id, positions as in src.postings
+#   doc table     DOC_ENTRY per doc id, where its forward entries are
+#   forward       per doc: (term index, positions size, positions) varints
+#                 ordered by term index, the postings of the doc
+MAGIC = b"CRSG"
+FORMAT_VERSION = 2
+HEADER = struct.Struct("<4sIIIIQQ")
+TERM_ENTRY = struct.Struct("<QIQII")
+DOC_ENTRY = struct.Struct("<QI")
+
+
+class SegmentBuilder:
+    """Collects indexed pages in memory until they are written as a segment."""
+
+    def __init__(self) -> None:
+        self.docs: Set[int] = set()
+        self.postings: Dict[str, Dict[int, List[int]]] = dict()
+        self.edges: List[Tuple[int, int]] = []
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def add_document(self, url_id: int) -> None:
+        """Marks the url as indexed by this segment, replacing older postings."""
+        if url_id in self.docs:
+            return
+        self.docs.add(url_id)
+        for url_postings in self.postings.values():
+            url_postings.pop(url_id, None)
+        self.edges = [edge for edge in self.edges if edge[0] != url_id]
+
+    def add_postings(self, url_id: int, located_words: Iterable[Tuple[str, int]]) -> None:
+        self.docs.add(url_id)
+        for word, location in located_words:
+            self.postings.setdefault(word, dict()).setdefault(url_id, []).append(
+                location
+            )
+
+    def add_edges(self, url_id: int, to_url_ids: Iterable[int]) -> None:
+        self.docs.add(url_id)
+        self.edges.extend((url_id, to_url_id) for to_url_id in to_url_ids)
+
+    def write(self, path: str) -> int:
+        encoded = {
+            word: {
+                url_id: encode_positions(positions)
+                for url_id, positions in url_postings.items()
+            }
+            for word, url_postings in self.postings.items()
+        }
+        return write_segment(path, self.docs, encoded, self.edges)
+
+
+def write_segment(
+    path: str,
+    docs: Iterable[int],
+    postings: Dict[str, Dict[int, bytes]],
+    edges: Iterable[Tuple[int, int]],
+) -> int:
+    """Writes a segment file and returns its postings count."""
+    doc_ids = array("I", sorted(docs))
+    edge_ids = array("I")
+    for edge in sorted(edges):
+        edge_ids.extend(edge)
+
+    words = bytearray()
+    postings_blob = bytearray()
+    term_table = bytearray()
+    postings_count = 0
+    # url id -> (term index, positions) of the doc
+    forward: Dict[int, List[Tuple[int, bytes]]] = dict()
+    for word in sorted(postings, key=lambda word: word.encode()):
+        url_postings = postings[word]
+        if not url_postings:
+            continue
+        term_index = len(term_table) // TERM_ENTRY.size
+        word_bytes = word.encode()
+        postings_offset = len(postings_blob)
+        previous_url_id = 0
+        for url_id in sorted(url_postings):
+            positions = url_postings[url_id]
+            encode_varint(url_id - previous_url_id, postings_blob)
+            encode_varint(len(positions), postings_blob)
+            postings_blob += positions
+            previous_url_id = url_id
+            forward.setdefault(url_id, []).append((term_index, positions))
+        term_table += TERM_ENTRY.pack(
+            len(words),
+            len(word_bytes),
+            postings_offset,
+            len(postings_blob) - postings_offset,
+            len(url_postings),
+        )
+        words += word_bytes
+        postings_count += len(url_postings)
+
+    doc_table = bytearray()
+    forward_blob = bytearray()
+    for url_id in doc_ids:
+        forward_offset = len(forward_blob)
+        for term_index, positions in forward.get(url_id, ()):
+            encode_varint(term_index, forward_blob)
+            encode_varint(len(positions), forward_blob)
+            forward_blob += positions
+        doc_table += DOC_ENTRY.pack(forward_offset, len(forward_blob) - forward_offset)
+
+    header = HEADER.pack(
+        MAGIC,
+        FORMAT_VERSION,
+        len(doc_ids),
+        len(term_table) // TERM_ENTRY.size,
+        len(edge_ids) // 2,
+        len(words),
+        len(postings_blob),
+    )
+    # the file only appears under its name once it is complete
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as segment_file:
+        segment_file.write(header)
+        segment_file.write(doc_ids.tobytes())
+        segment_file.write(edge_ids.tobytes())
+        segment_file.write(term_table)
+        segment_file.write(words)
+        segment_file.write(postings_blob)
+        segment_file.write(doc_table)
+        segment_file.write(forward_blob)
+    os.replace(temporary_path, path)
+    return postings_count
+
+
+class SegmentReader:
+    """Memory mapped read access to one immutable segment file."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as segment_file:
+            self._mmap = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic,
+            version,
+            docs_count,
+            self.terms_count,
+            self.edges_count,
+            words_size,
+            postings_size,
+        ) = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} segment")
+
+        offset = HEADER.size
+        self._doc_ids = self._read_ids(offset, docs_count)
+        self.docs = frozenset(self._doc_ids)
+        offset += docs_count * 4
+        self._edges_offset = offset
+        offset += self.edges_count * 8
+        self._terms_offset = offset
+        offset += self.terms_count * TERM_ENTRY.size
+        self._words_offset = offset
+        self._postings_offset = offset + words_size
+        self._docs_offset = self._postings_offset + postings_size
+        self._forward_offset = self._docs_offset + docs_count * DOC_ENTRY.size
+
+    def close(self) -> None:
+        self._mmap.close()
+
+    def _read_ids(self, offset: int, count: int) -> array:
+        ids = array("I")
+        ids.frombytes(self._mmap[offset : offset + count * 4])
+        return ids
+
+    def _term(self, index: int) -> Tuple[bytes, int, int, int]:
+        word_offset, word_size, postings_offset, postings_size, docs_count = (
+            TERM_ENTRY.unpack_from(self._mmap, self._terms_offset + index * TERM_ENTRY.size)
+        )
+        start = self._words_offset + word_offset
+        return (
+            self._mmap[start : start + word_size],
+            self._postings_offset + postings_offset,
+            postings_size,
+            docs_count,
+        )
+
+    def _find_term(self, word: str) -> Optional[int]:
+        word_bytes = word.encode()
+        low, high = 0, self.terms_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._term(middle)[0] < word_bytes:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.terms_count and self._term(low)[0] == word_bytes:
+            return low
+        return None
+
+    def _decode_postings(self, offset: int, size: int) -> Iterator[Tuple[int, bytes]]:
+        end = offset + size
+        url_id = 0
+        while offset < end:
+            gap, offset = decode_varint(self._mmap, offset)
+            positions_size, offset = decode_varint(self._mmap, offset)
+            url_id += gap
+            yield url_id, self._mmap[offset : offset + positions_size]
+            offset += positions_size
+
+    def postings(self, word: str) -> Dict[int, bytes]:
+        """url id -> encoded positions of the word."""
+        index = self._find_term(word)
+        if index is None:
+            return dict()
+        _, offset, size, _ = self._term(index)
+        return dict(self._decode_postings(offset, size))
+
+    def terms(self) -> Iterator[Tuple[str, Dict[int, bytes]]]:
+        for index in range(self.terms_count):
+            word, offset, size, _ = self._term(index)
+            yield word.decode(), dict(self._decode_postings(offset, size))
+
+    def edges(self) -> Iterator[Tuple[int, int]]:
+        ids = self._read_ids(self._edges_offset, self.edges_count * 2)
+        return zip(ids[::2], ids[1::2])
+
+    def forward(self, url_id: int) -> Iterator[Tuple[str, bytes]]:
+        """(word, encoded positions) of every posting of the doc."""
+        index = bisect.bisect_left(self._doc_ids, url_id)
+        if index == len(self._doc_ids) or self._doc_ids[index] != url_id:
+            return
+        forward_offset, size = DOC_ENTRY.unpack_from(
+            self._mmap, self._docs_offset + index * DOC_ENTRY.size
+        )
+        offset = self._forward_offset + forward_offset
+        end = offset + size
+        while offset < end:
+            term_index, offset = decode_varint(self._mmap, offset)
+            positions_size, offset = decode_varint(self._mmap, offset)
+            word = self._term(term_index)[0].decode()
+            yield word, self._mmap[offset : offset + positions_size]
+            offset += positions_size
+
+
+def _read_manifest(directory: str) -> dict:
+    try:
+        with open(os.path.join(directory, SegmentStore.MANIFEST_FILENAME)) as manifest:
+            return json.load(manifest)
+    except FileNotFoundError:
+        return {"generation": 0, "next_id": 1, "segments": []}
+
+
+class SegmentIndex:
+    """Consistent read view over the segments listed by one manifest generation.
+
+    Newer segments hide the postings and edges of urls they index again.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.generation = -1
+        self.readers: List[SegmentReader] = []
+        # shared by the request threads of a read-only DbActor
+        self._lock = threading.Lock()
+
+    def refresh(self) -> None:
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self) -> None:
+        # a merge may delete files of the manifest just read, read it again
+        for _ in range(3):
+            manifest = _read_manifest(self.directory)
+            if manifest["generation"] == self.generation:
+                return
+            try:
+                self._open(manifest)
+                return
+            except FileNotFoundError:
+                continue
+        raise RuntimeError(f"Failed to open a consistent segments list in {self.directory}")
+
+    def _open(self, manifest: dict) -> None:
+        current = {reader.path: reader for reader in self.readers}
+        readers = []
+        try:
+            for segment in manifest["segments"]:
+                path = os.path.join(self.directory, segment["name"])
+                readers.append(current.get(path) or SegmentReader(path))
+        except FileNotFoundError:
+            for reader in readers:
+                if reader.path not in current:
+                    reader.close()
+            raise
+        # readers dropped from the list are unmapped once no query holds them
+        self.readers = readers
+        self.generation = manifest["generation"]
+
+    def close(self) -> None:
+        with self._lock:
+            for reader in self.readers:
+                reader.close()
+            self.readers = []
+            self.generation = -1
+
+    @staticmethod
+    def _is_hidden(readers: List[SegmentReader], url_id: int, segment_index: int) -> bool:
+        return any(url_id in reader.docs for reader in readers[segment_index + 1 :])
+
+    # queries work on the list they started with, refresh() replaces it
+    def postings(self, word: str) -> Dict[int, bytes]:
+        readers = self.readers
+        result: Dict[int, bytes] = dict()
+        for segment_index, reader in enumerate(readers):
+            for url_id, positions in reader.postings(word).items():
+                if not self._is_hidden(readers, url_id, segment_index):
+                    result[url_id] = positions
+        return result
+
+    def all_postings(self) -> Iterator[Tuple[str, int, bytes]]:
+        """(word, url id, encoded positions) of every visible posting."""
+        readers = self.readers
+        for segment_index, reader in enumerate(readers):
+            for word, url_postings in reader.terms():
+                for url_id, positions in url_postings.items():
+                    if not self._is_hidden(readers, url_id, segment_index):
+                        yield word, url_id, positions
+
+    def document_frequency(self, word: str) -> int:
+        return len(self.postings(word))
+
+    def words_by_url(self, url_id: int) -> Tuple[str, ...]:
+        # the newest segment holding the url has all of its words
+        for reader in reversed(list(self.readers)):
+            if url_id not in reader.docs:
+                continue
+            located_words = [
+                (position, word)
+                for word, positions in reader.forward(url_id)
+                for position in decode_positions(positions)
+            ]
+            located_words.sort()
+            return tuple(word for _, word in located_words)
+        return tuple()
+
+    def edges(self) -> Iterator[Tuple[int, int]]:
+        readers = self.readers
+        for segment_index, reader in enumerate(readers):
+            for edge in reader.edges():
+                if not self._is_hidden(readers, edge[0], segment_index):
+                    yield edge
+
+
+class SegmentStore:
+    """Writer side of a segments directory.
+
+    New segments are appended to the manifest, merges replace runs of
+    adjacent segments so the newer-hides-older order is kept. The manifest
+    is replaced atomically, readers see either the old or the new list.
+    """
+
+    MANIFEST_FILENAME = "manifest.json"
+    # segments up to this many postings share the lowest tier
+    MIN_TIER_SIZE = 10_000
+    MERGE_FACTOR = 4
+
+    def __init__(
+        self,
+        directory: str,
+        merge_factor: int = MERGE_FACTOR,
+        min_tier_size: int = MIN_TIER_SIZE,
+    ) -> None:
+        self.directory = directory
+        self.merge_factor = merge_factor
+        self.min_tier_size = min_tier_size
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._manifest = _read_manifest(directory)
+
+    def __len__(self) -> int:
+        return len(self._manifest["segments"])
+
+    @property
+    def postings_count(self) -> int:
+        return sum(segment["postings"] for segment in self._manifest["segments"])
+
+    def add(self, builder: SegmentBuilder) -> None:
+        with self._lock:
+            name = self._next_name()
+            postings_count = builder.write(os.path.join(self.directory, name))
+            self._manifest["segments"].append({"name": name, "postings": postings_count})
+            self._save_manifest()
+        logger.debug(f"Flushed segment {name} with {len(builder)} pages")
+
+    def _next_name(self) -> str:
+        segment_id = self._manifest["next_id"]
+        self._manifest["next_id"] += 1
+        return f"segment_{segment_id:08d}.seg"
+
+    def _save_manifest(self) -> None:
+        self._manifest["generation"] += 1
+        path = os.path.join(self.directory, self.MANIFEST_FILENAME)
+        with open(f"{path}.tmp", "w") as manifest:
+            json.dump(self._manifest, manifest)
+        os.replace(f"{path}.tmp", path)
+
+    def _tier(self, postings_count: int) -> int:
+        if postings_count <= self.min_tier_size:
+            return 0
+        return int(math.log(postings_count / self.min_tier_size, self.merge_factor)) + 1
+
+    def _pick_merge(self) -> List[str]:
+        """Oldest run of merge_factor adjacent segments of the same size tier."""
+        with self._lock:
+            segments = list(self._manifest["segments"])
+        run: List[dict] = []
+        for segment in segments:
+            if run and self._tier(run[-1]["postings"]) != self._tier(segment["postings"]):
+                run = []
+            run.append(segment)
+            if len(run) == self.merge_factor:
+                return [segment["name"] for segment in run]
+        return []
+
+    def merge_once(self) -> bool:
+        names = self._pick_merge()
+        if not names:
+            return False
+        readers = [SegmentReader(os.path.join(self.directory, name)) for name in names]
+        try:
+            docs: Set[int] = set()
+            postings: Dict[str, Dict[int, bytes]] = dict()
+            edges: List[Tuple[int, int]] = []
+            # newest first, urls indexed by a newer segment hide older data
+            for reader in reversed(readers):
+                for word, url_postings in reader.terms():
+                    merged = postings.setdefault(word, dict())
+                    for url_id, positions in url_postings.items():
+                        if url_id not in docs:
+                            merged[url_id] = positions
+                edges.extend(edge for edge in reader.edges() if edge[0] not in docs)
+                docs.update(reader.docs)
+        finally:
+            for reader in readers:
+                reader.close()
+
+        with self._lock:
+            name = self._next_name()
+        postings_count = write_segment(
+            os.path.join(self.directory, name), docs, postings, edges
+        )
+
+        with self._lock:
+            segments = self._manifest["segments"]
+            start = [segment["name"] for segment in segments].index(names[0])
+            segments[start : start + len(names)] = [
+                {"name": name, "postings": postings_count}
+            ]
+            self._save_manifest()
+        # readers keep mapped files alive after they are unlinked
+        for merged_name in names:
+            os.remove(os.path.join(self.directory, merged_name))
+        logger.debug(f"Merged {len(names)} segments into {name} ({postings_count} postings)")
+        return True
+
+
+class SegmentMerger(threading.Thread):
+    """Background thread compacting segments of a store on a size tiered policy."""
+
+    MERGE_INTERVAL = 5
+
+    def __init__(self, store: SegmentStore, interval: float = MERGE_INTERVAL) -> None:
+        super().__init__(name="segment-merger", daemon=True)
+        self.store = store
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            while not self._stopped.is_set() and self.store.merge_once():
+                pass
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
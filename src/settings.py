@@ -1,5 +1,43 @@
 DATABASE_FILENAME = "lab1.db"
+# "disk" writes through WAL into DATABASE_FILENAME, "memory" indexes into
+# a :memory: copy saved back to DATABASE_FILENAME at the end
+DATABASE_STORAGE = "disk"
+# "rows" keeps a word_location row per word occurrence, "postings" keeps one
+# delta + varint encoded word_posting blob of positions per (word, url),
+# "segments" writes positions and link edges to immutable segment files
+# in SEGMENTS_DIRECTORY merged in the background
+INDEX_LAYOUT = "rows"
+SEGMENTS_DIRECTORY = "segments"
+# over 1 the word locations of a page go to shard file url_id % SHARDS_COUNT,
+# urls, words, links and ranks stay global in DATABASE_FILENAME
+SHARDS_COUNT = 1
+SHARD_FILENAME_TEMPLATE = "lab1_shard{shard}.db"
+# export writes the index as memory mapped numpy columns to
+# SNAPSHOT_DIRECTORY, with USE_SNAPSHOT the searcher and the ranker read them
+SNAPSHOT_DIRECTORY = "snapshot"
+USE_SNAPSHOT = False
+# "sparse" iterates a scipy CSR link matrix until the mean rank change is
+# under PAGE_RANK_TOLERANCE, "out_of_core" does the same over links spilled
+# to a memory mapped file read PAGE_RANK_BLOCK_SIZE links at a time,
+# "parallel" splits the sparse iterations over PAGE_RANK_PROCESSES processes
+# (None for every core), "loop" is the original 25 python iterations
+PAGE_RANK_ENGINE = "sparse"
+PAGE_RANK_BLOCK_SIZE = 1 << 20
+PAGE_RANK_PROCESSES = None
+PAGE_RANK_TOLERANCE = 1e-6
+PAGE_RANK_MAX_ITERATIONS = 100
+# update_ranks pushes rank changes until the change left at every url is
+# under PAGE_RANK_PUSH_TOLERANCE
+PAGE_RANK_PUSH_TOLERANCE = 1e-4
+# and falls back to a full calculation once it read more links than this
+# share of all links, a link read by id costs about 2.5 links of the full scan
+PAGE_RANK_PUSH_MAX_LINKS_SHARE = 0.25
+# pages are parsed, hashed and fingerprinted in this many worker processes,
+# 0 does it in the crawler's parse thread. The pool is opt in, one worker
+# less than the cores keeps a core for the fetch and index stages
+PARSE_WORKERS_COUNT = 0
 STATISTICS_FILENAME = "statistics.csv"
+FRONTIER_FILENAME = "frontier.db"
 IGNORED_WORDS = set(
     [
         "с помощью",
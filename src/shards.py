@@ -0,0 +1,65 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, TypeVar
+
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+T = TypeVar("T")
+
+
+class ShardSet:
+    """Per page tables spread over one db file per shard.
+
+    A page lives in shard ``url_id % len(shards)``, everything a query needs
+    about one page is in one file, so every shard answers a query on its own
+    and the answers are concatenated.
+
+    Writes go through one session per shard in the indexing thread, reads
+    run in parallel on a thread pool with a connection per thread and shard.
+    Readers sharing the engines open sessions of their own.
+    """
+
+    def __init__(self, engines: List[Engine]) -> None:
+        self.engines = engines
+        self.sessions = self.open_sessions()
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(engines), thread_name_prefix="shard"
+        )
+
+    def __len__(self) -> int:
+        return len(self.engines)
+
+    def open_sessions(self) -> List[Session]:
+        """A new session per shard, the caller closes them."""
+        return [sessionmaker(autoflush=False, bind=engine)() for engine in self.engines]
+
+    def shard_of(self, url_id: int) -> int:
+        return url_id % len(self.engines)
+
+    def execute_all(self, query: str) -> None:
+        for session in self.sessions:
+            session.execute(query)
+
+    def map(self, function: Callable[[Connection], T]) -> List[T]:
+        """Results of function called with a connection of every shard in parallel."""
+
+        def run(engine: Engine) -> T:
+            with engine.connect() as connection:
+                return function(connection)
+
+        return list(self._executor.map(run, self.engines))
+
+    def commit(self) -> None:
+        for session in self.sessions:
+            session.commit()
+
+    def rollback(self) -> None:
+        for session in self.sessions:
+            session.rollback()
+
+    def close(self) -> None:
+        self._executor.shutdown()
+        for session in self.sessions:
+            session.close()
+        for engine in self.engines:
+            engine.dispose()
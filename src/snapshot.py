@@ -0,0 +1,319 @@
+import bisect
+import json
+import os
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+from loguru import logger
+
+from src.database import DbActor
+from src.model import Element, ResultURL, WordLocationsCombination
+from src.postings import combine_postings
+from src.settings import DATABASE_FILENAME, SNAPSHOT_DIRECTORY
+
+# snapshot directory layout, one .npy file per column:
+#   url_ids, url_offsets, url_bytes        urls sorted by id, utf-8 strings
+#                                          concatenated with n + 1 offsets
+#   word_ids, word_offsets, word_bytes     words sorted by their utf-8 bytes
+#   posting_offsets                        postings of word i are
+#                                          posting_offsets[i]:[i + 1]
+#   posting_url_ids, position_offsets      one (word, url) posting per row
+#   positions                              sorted locations of the postings
+#   url_posting_offsets, url_postings      posting rows grouped by url, those
+#                                          of url i are url_postings[
+#                                          url_posting_offsets[i]:[i + 1]]
+#   link_from, link_to                     edges sorted by (to, from)
+#   rank_url_ids, ranks                    page ranks sorted by url id
+#   meta.json                              written last, counts and version
+FORMAT_VERSION = 2
+META_FILENAME = "meta.json"
+ARRAY_NAMES = (
+    "url_ids",
+    "url_offsets",
+    "url_bytes",
+    "word_ids",
+    "word_offsets",
+    "word_bytes",
+    "posting_offsets",
+    "posting_url_ids",
+    "position_offsets",
+    "positions",
+    "url_posting_offsets",
+    "url_postings",
+    "link_from",
+    "link_to",
+    "rank_url_ids",
+    "ranks",
+)
+ID_TYPE = np.uint32
+LINKS_CHUNK_SIZE = 1 << 16
+OFFSET_TYPE = np.uint64
+LOCATION_TYPE = np.dtype([("word_id", ID_TYPE), ("url_id", ID_TYPE), ("location", ID_TYPE)])
+LINK_TYPE = np.dtype([("from_id", ID_TYPE), ("to_id", ID_TYPE)])
+RANK_TYPE = np.dtype([("url_id", ID_TYPE), ("rank", np.float64)])
+
+
+def _encode_strings(strings: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    encoded = [string.encode() for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=OFFSET_TYPE)
+    offsets[1:] = np.cumsum([len(string) for string in encoded], dtype=OFFSET_TYPE)
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def export_snapshot(directory: str = SNAPSHOT_DIRECTORY) -> None:
+    logger.info(f"Exporting index to {directory} ...")
+    db = DbActor(read_only=True)
+    arrays: Dict[str, np.ndarray] = dict()
+    try:
+        urls = list(db.iter_urls())
+        arrays["url_ids"] = np.array([url_id for url_id, _ in urls], dtype=ID_TYPE)
+        arrays["url_offsets"], arrays["url_bytes"] = _encode_strings(
+            [url for _, url in urls]
+        )
+        del urls
+
+        words = sorted(db.iter_words(), key=lambda row: row[1].encode())
+        word_ids = np.array([word_id for word_id, _ in words], dtype=ID_TYPE)
+        arrays["word_ids"] = word_ids
+        arrays["word_offsets"], arrays["word_bytes"] = _encode_strings(
+            [word for _, word in words]
+        )
+        del words
+        # index of every word id in the sorted words
+        word_indexes = np.zeros(int(word_ids.max(initial=0)) + 1, dtype=np.int64)
+        word_indexes[word_ids] = np.arange(len(word_ids))
+
+        locations = np.fromiter(map(tuple, db.iter_word_locations()), dtype=LOCATION_TYPE)
+        location_words = word_indexes[locations["word_id"]]
+        order = np.lexsort((locations["location"], locations["url_id"], location_words))
+        locations, location_words = locations[order], location_words[order]
+        # a posting starts where the (word, url) pair changes
+        is_start = np.ones(len(locations), dtype=bool)
+        is_start[1:] = (location_words[1:] != location_words[:-1]) | (
+            locations["url_id"][1:] != locations["url_id"][:-1]
+        )
+        starts = np.flatnonzero(is_start)
+        arrays["positions"] = locations["location"]
+        arrays["position_offsets"] = np.append(starts, len(locations)).astype(OFFSET_TYPE)
+        arrays["posting_url_ids"] = locations["url_id"][starts]
+        arrays["posting_offsets"] = np.searchsorted(
+            location_words[starts], np.arange(len(word_ids) + 1)
+        ).astype(OFFSET_TYPE)
+        del locations, location_words
+
+        # postings by url, postings of urls not in url_list are left out
+        posting_url_ids = arrays["posting_url_ids"]
+        url_postings = np.argsort(posting_url_ids, kind="stable")
+        url_postings = url_postings[np.isin(posting_url_ids[url_postings], arrays["url_ids"])]
+        arrays["url_postings"] = url_postings.astype(OFFSET_TYPE)
+        arrays["url_posting_offsets"] = np.append(
+            np.searchsorted(posting_url_ids[url_postings], arrays["url_ids"]),
+            len(url_postings),
+        ).astype(OFFSET_TYPE)
+
+        links = np.fromiter(map(tuple, db.iter_links()), dtype=LINK_TYPE)
+        links = links[np.lexsort((links["from_id"], links["to_id"]))]
+        arrays["link_from"], arrays["link_to"] = links["from_id"], links["to_id"]
+
+        ranks = np.fromiter(map(tuple, db.iter_page_ranks()), dtype=RANK_TYPE)
+        arrays["rank_url_ids"], arrays["ranks"] = ranks["url_id"], ranks["rank"]
+    finally:
+        db.close()
+
+    os.makedirs(directory, exist_ok=True)
+    for name in ARRAY_NAMES:
+        np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(arrays[name]))
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "urls": len(arrays["url_ids"]),
+        "words": len(arrays["word_ids"]),
+        "postings": len(arrays["posting_url_ids"]),
+        "positions": len(arrays["positions"]),
+        "links": len(arrays["link_from"]),
+    }
+    with open(os.path.join(directory, META_FILENAME), "w") as meta_file:
+        json.dump(meta, meta_file)
+    logger.success(f"Exported {meta}")
+
+
+class Snapshot:
+    """Read access to an exported snapshot, every column memory mapped.
+
+    Answers the queries Searcher and PageRankerer send to a DbActor.
+    """
+
+    def __init__(self, directory: str = SNAPSHOT_DIRECTORY) -> None:
+        with open(os.path.join(directory, META_FILENAME)) as meta_file:
+            self.meta = json.load(meta_file)
+        if self.meta["format_version"] != FORMAT_VERSION:
+            raise ValueError(
+                f"{directory} is a version {self.meta['format_version']} snapshot,"
+                f" expected {FORMAT_VERSION}"
+            )
+        for name in ARRAY_NAMES:
+            setattr(self, name, self._load(os.path.join(directory, f"{name}.npy")))
+
+    @staticmethod
+    def _load(path: str) -> np.ndarray:
+        try:
+            return np.load(path, mmap_mode="r")
+        except ValueError:
+            # empty arrays can not be mapped
+            return np.load(path)
+
+    def close(self) -> None:
+        pass
+
+    @staticmethod
+    def _string(offsets: np.ndarray, data: np.ndarray, index: int) -> str:
+        return data[int(offsets[index]) : int(offsets[index + 1])].tobytes().decode()
+
+    def _word_index(self, word: str):
+        word_bytes = word.encode()
+        words_count = len(self.word_ids)
+        index = bisect.bisect_left(
+            range(words_count),
+            word_bytes,
+            key=lambda i: self.word_bytes[
+                int(self.word_offsets[i]) : int(self.word_offsets[i + 1])
+            ].tobytes(),
+        )
+        if index < words_count and self._string(self.word_offsets, self.word_bytes, index) == word:
+            return index
+        return None
+
+    def _postings(self, word: str) -> Dict[int, int]:
+        """url id -> posting row of the word."""
+        index = self._word_index(word)
+        if index is None:
+            return dict()
+        start, end = int(self.posting_offsets[index]), int(self.posting_offsets[index + 1])
+        return dict(zip(self.posting_url_ids[start:end].tolist(), range(start, end)))
+
+    def _positions(self, posting: int) -> List[int]:
+        return self.positions[
+            int(self.position_offsets[posting]) : int(self.position_offsets[posting + 1])
+        ].tolist()
+
+    def get_words_location_combinations(self, words: List[str]) -> List[WordLocationsCombination]:
+        if len(words) == 0:
+            return
+        return combine_postings([self._postings(word) for word in words], self._positions)
+
+    def get_document_frequency(self, word: str) -> int:
+        return len(self._postings(word))
+
+    def _url_postings(self, url_id: int) -> np.ndarray:
+        index = int(np.searchsorted(self.url_ids, url_id))
+        if index == len(self.url_ids) or self.url_ids[index] != url_id:
+            return self.url_postings[:0].astype(np.int64)
+        start, end = self.url_posting_offsets[index : index + 2]
+        return self.url_postings[int(start) : int(end)].astype(np.int64)
+
+    def get_words_by_url(self, url_id: int) -> Tuple[str, ...]:
+        postings = self._url_postings(url_id)
+        word_indexes = np.searchsorted(self.posting_offsets, postings, side="right") - 1
+        located_words = [
+            (position, word_index)
+            for posting, word_index in zip(postings.tolist(), word_indexes.tolist())
+            for position in self._positions(posting)
+        ]
+        located_words.sort()
+        return tuple(
+            self._string(self.word_offsets, self.word_bytes, word_index)
+            for _, word_index in located_words
+        )
+
+    def get_url(self, url_id: int) -> str:
+        index = int(np.searchsorted(self.url_ids, url_id))
+        return self._string(self.url_offsets, self.url_bytes, index)
+
+    def is_page_rank_table_empty(self) -> bool:
+        return len(self.ranks) == 0
+
+    def get_max_page_rank(self) -> float:
+        return float(self.ranks.max())
+
+    def get_urls_with_page_ranks(self, url_ids: List[int]) -> List[ResultURL]:
+        indexes = np.searchsorted(self.rank_url_ids, url_ids)
+        return [
+            ResultURL(
+                url_id=url_id,
+                url_name=self.get_url(url_id),
+                page_rank_raw_metric=float(self.ranks[index]),
+            )
+            for url_id, index in zip(url_ids, indexes.tolist())
+            if index < len(self.rank_url_ids) and self.rank_url_ids[index] == url_id
+        ]
+
+    def iter_links(self) -> Iterator[Tuple[int, int]]:
+        # a chunk at a time, the columns may not fit in memory as lists
+        for start in range(0, len(self.link_from), LINKS_CHUNK_SIZE):
+            end = start + LINKS_CHUNK_SIZE
+            yield from zip(self.link_from[start:end].tolist(), self.link_to[start:end].tolist())
+
+    def get_urls_ids(self) -> List[int]:
+        return self.url_ids.tolist()
+
+
+def import_snapshot(directory: str = SNAPSHOT_DIRECTORY) -> None:
+    if DATABASE_FILENAME in os.listdir():
+        logger.error(f"{DATABASE_FILENAME} exists, remove it to import {directory}")
+        exit(1)
+    snapshot = Snapshot(directory)
+    logger.info(f"Importing {snapshot.meta} from {directory} ...")
+
+    urls_count, words_count = len(snapshot.url_ids), len(snapshot.word_ids)
+    urls = [
+        snapshot._string(snapshot.url_offsets, snapshot.url_bytes, index)
+        for index in range(urls_count)
+    ]
+    words = [
+        snapshot._string(snapshot.word_offsets, snapshot.word_bytes, index)
+        for index in range(words_count)
+    ]
+    url_ids = snapshot.url_ids.tolist()
+    word_ids = snapshot.word_ids.tolist()
+    url_by_id = dict(zip(url_ids, urls))
+
+    db = DbActor(deferred_indexes=True)
+    db.insert_url_rows(zip(url_ids, urls))
+    db.insert_word_rows(zip(word_ids, words))
+    db.insert_page_rank_rows(
+        zip(snapshot.rank_url_ids.tolist(), snapshot.ranks.tolist())
+    )
+    db.commit()
+
+    # postings and links regrouped by url, written through the indexing path
+    # so the configured index layout and shards are filled
+    posting_words = np.repeat(
+        np.arange(words_count), np.diff(snapshot.posting_offsets.astype(np.int64))
+    )
+    link_order = np.argsort(snapshot.link_from, kind="stable")
+    link_from = snapshot.link_from[link_order]
+    link_to = snapshot.link_to[link_order]
+    for imported_count, url_id in enumerate(url_ids, start=1):
+        elements = [
+            Element(word=words[word_index], location=location, word_id=word_ids[word_index])
+            for posting in snapshot._url_postings(url_id).tolist()
+            for word_index in (int(posting_words[posting]),)
+            for location in snapshot._positions(posting)
+        ]
+        start, end = np.searchsorted(link_from, [url_id, url_id + 1])
+        elements.extend(
+            Element(word="", href=url_by_id[to_url_id], link_id=to_url_id)
+            for to_url_id in link_to[start:end].tolist()
+        )
+        db.insert_links_between_by_elements(elements, url_id)
+        db.fill_words_locations_by_elements(elements, url_id)
+        if imported_count % 500 == 0:
+            db.commit()
+            logger.info(f"Imported {imported_count}/{urls_count} urls")
+    # the imported ranks were calculated from the imported links
+    db.delete_page_rank_changes(db.get_page_rank_changes())
+
+    logger.info("Creating indexes")
+    db.create_indexes()
+    db.save_to_db_to_disk()
+    db.close()
+    logger.success(f"Imported {directory} into {DATABASE_FILENAME}")
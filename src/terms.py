@@ -0,0 +1,39 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+
+class TermDictionary:
+    """In memory word -> wordId map mirroring word_list.
+
+    New words get ids from the dictionary itself, so resolving a token never
+    needs a query whatever the size of the vocabulary.
+    """
+
+    def __init__(self) -> None:
+        self._ids: Dict[str, int] = dict()
+        self.last_id = 0
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, word: str) -> bool:
+        return word in self._ids
+
+    def load(self, rows: Iterable[Tuple[int, str]]) -> None:
+        self._ids.clear()
+        self.last_id = 0
+        # rows come in id order, the first id of a duplicated word wins
+        for word_id, word in rows:
+            self._ids.setdefault(word, word_id)
+            self.last_id = max(self.last_id, word_id)
+
+    def get(self, word: str) -> Optional[int]:
+        return self._ids.get(word)
+
+    def add(self, word: str) -> Tuple[int, bool]:
+        """Returns the id of the word and whether it was added just now."""
+        word_id = self._ids.get(word)
+        if word_id is not None:
+            return word_id, False
+        self.last_id += 1
+        self._ids[word] = self.last_id
+        return self.last_id, True
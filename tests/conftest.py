@@ -0,0 +1,12 @@
+import pytest
+
+from src.database import DbActor
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # the db and its side files are created in the working directory
+    monkeypatch.chdir(tmp_path)
+    db = DbActor()
+    yield db
+    db.close()
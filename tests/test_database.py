@@ -0,0 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from src.database import DbActor
+from src.model import Element
+
+
+def add_page(db, url, links):
+    url_id = db.insert_url(url)
+    elements = [Element(word="", href=link) for link in links]
+    db.insert_links_from_elements(elements)
+    db.insert_links_between_by_elements(elements, url_id)
+    return url_id
+
+
+def test_linked_urls(db):
+    url_id = add_page(db, "http://a.com", ["http://a.com/1", "http://a.com/2"])
+    db.commit()
+    assert sorted(db.get_linked_urls(url_id)) == ["http://a.com/1", "http://a.com/2"]
+
+
+def test_linked_urls_of_alias_are_canonical_links(db):
+    canonical_url_id = add_page(db, "http://a.com", ["http://a.com/1", "http://a.com/2"])
+    alias_url_id = db.insert_url("http://mirror.com")
+    db.insert_url_alias(alias_url_id, canonical_url_id)
+    db.commit()
+    assert sorted(db.get_linked_urls(alias_url_id)) == ["http://a.com/1", "http://a.com/2"]
+
+    db.delete_url_index(alias_url_id)
+    db.commit()
+    assert db.get_linked_urls(alias_url_id) == []
+
+
+def test_concurrent_shard_reads(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    db = DbActor(shards_count=2)
+    pages = {}
+    for page in range(20):
+        url = f"http://a.com/{page}"
+        words = [f"word{page}", "common", f"word{page + 1}"]
+        elements = [Element(word=word, location=i) for i, word in enumerate(words)]
+        url_id = db.insert_url(url)
+        db.insert_words_from_elements(elements)
+        db.fill_words_locations_by_elements(elements, url_id)
+        pages[url_id] = tuple(words)
+    db.commit()
+    db.close()
+
+    first, second = (DbActor(read_only=True, shards_count=2) for _ in range(2))
+    # the engines are shared, the sessions are not
+    assert first.engine is second.engine
+    assert first._index_session(1) is not second._index_session(1)
+    first.close()
+    second.close()
+
+    # a reader per thread, like a searcher per request
+    def read_all(_):
+        reader = DbActor(read_only=True, shards_count=2)
+        try:
+            return all(reader.get_words_by_url(url_id) == words for url_id, words in pages.items())
+        finally:
+            reader.close()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert all(executor.map(read_all, range(32)))
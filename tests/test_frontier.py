@@ -0,0 +1,112 @@
+import os
+import threading
+
+import pytest
+
+from src.frontier import Frontier
+from src.model import LinkToGo
+
+
+def links_of(batch):
+    return [link.link for link in batch]
+
+
+def mixed_links(count: int):
+    """Links with repeating depths and priorities, in insertion order."""
+    return [LinkToGo(f"http://a.com/{i}", depth=i % 3, priority=i % 4) for i in range(count)]
+
+
+def queue_order(links):
+    # depth first, then higher priority, then insertion order
+    order = sorted(range(len(links)), key=lambda i: (links[i].depth, -links[i].priority, i))
+    return [links[i].link for i in order]
+
+
+def test_heap_order():
+    links = mixed_links(12)
+    frontier = Frontier(links, spill_filename=None)
+    assert len(frontier) == 12
+    assert links_of(frontier.pop_batch(100)) == queue_order(links)
+    assert frontier.pop() is None
+
+
+def test_popped_links_keep_depth_and_priority():
+    frontier = Frontier([LinkToGo("http://a.com", depth=2, priority=5)], spill_filename=None)
+    assert frontier.pop() == LinkToGo("http://a.com", depth=2, priority=5)
+
+
+def test_links_are_deduplicated():
+    frontier = Frontier(spill_filename=None)
+    assert frontier.push(LinkToGo("http://a.com"))
+    assert not frontier.push(LinkToGo("http://a.com", depth=1))
+    frontier.mark_seen("http://b.com")
+    assert frontier.push_many([LinkToGo("http://b.com"), LinkToGo("http://c.com")]) == 1
+    assert "http://b.com" in frontier
+    # popped links are still seen
+    frontier.pop_batch(10)
+    assert not frontier.push(LinkToGo("http://a.com"))
+    assert len(frontier) == 0
+
+
+def test_spill_and_reload_keep_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(Frontier, "SPILL_BATCH_SIZE", 3)
+    spill_filename = str(tmp_path / "frontier.db")
+    links = mixed_links(30)
+    frontier = Frontier(links[:20], max_in_memory=6, spill_filename=spill_filename)
+    assert os.path.exists(spill_filename)
+    assert len(frontier) == 20
+
+    popped = links_of(frontier.pop_batch(5))
+    # links pushed after the spill go before spilled links of a later place
+    frontier.push_many(links[20:])
+    popped += links_of(frontier.pop_batch(100))
+    assert len(frontier) == 0
+    expected_first = queue_order(links[:20])[:5]
+    assert popped[:5] == expected_first
+    rest = [link for link in links if link.link not in expected_first]
+    assert popped[5:] == queue_order(rest)
+
+    frontier.close()
+    assert not os.path.exists(spill_filename)
+
+
+def test_no_spill_without_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    frontier = Frontier(mixed_links(20), max_in_memory=4, spill_filename=None)
+    assert os.listdir(tmp_path) == []
+    assert len(frontier) == 20
+    frontier.close()
+
+
+def test_in_flight_links_are_not_exhausted():
+    frontier = Frontier([LinkToGo("http://a.com"), LinkToGo("http://b.com")], spill_filename=None)
+    assert not frontier.is_exhausted()
+    frontier.pop_batch(2)
+    assert not frontier.is_exhausted()
+    frontier.task_done()
+    assert not frontier.is_exhausted()
+    frontier.task_done()
+    assert frontier.is_exhausted()
+    with pytest.raises(ValueError):
+        frontier.task_done()
+
+
+def test_wait_for_work():
+    frontier = Frontier([LinkToGo("http://a.com")], spill_filename=None)
+    assert frontier.wait_for_work(timeout=0)
+    frontier.pop()
+    # the popped link may still discover links
+    assert not frontier.wait_for_work(timeout=0.01)
+
+    pusher = threading.Timer(0.01, frontier.push, [LinkToGo("http://b.com")])
+    pusher.start()
+    assert frontier.wait_for_work(timeout=5)
+    pusher.join()
+
+    frontier.pop()
+    finisher = threading.Timer(0.01, frontier.task_done, [2])
+    finisher.start()
+    # nothing queued and nothing in flight, the crawl is over
+    assert not frontier.wait_for_work(timeout=5)
+    finisher.join()
+    assert frontier.is_exhausted()
@@ -0,0 +1,76 @@
+from sqlalchemy.exc import OperationalError
+
+from src.dedup import FingerprintIndex
+from src.indexer import IndexWriter
+from src.model import Element, ParsedPage
+
+# fingerprints 64 bits apart
+FIRST_FINGERPRINT = 0x5555555555555555
+SECOND_FINGERPRINT = 0xAAAAAAAAAAAAAAAA
+
+
+def make_page(url, words, fingerprint):
+    elements = [Element(word=word, location=i) for i, word in enumerate(words)]
+    elements.append(Element(word="next", location=len(words), href=f"{url}/next"))
+    return ParsedPage(url=url, elements=elements, fingerprint=fingerprint)
+
+
+def count(db, table):
+    return db.db.execute(f"SELECT COUNT(*) FROM {table}").scalar()
+
+
+def test_near_duplicate_is_stored_as_alias(db):
+    fingerprints = FingerprintIndex()
+    writer = IndexWriter(db, dict(), fingerprints)
+    writer.add(make_page("http://a.com", ["alpha", "beta"], fingerprint=0b1111))
+    writer.add(make_page("http://b.com", ["alpha", "beta"], fingerprint=0b1110))
+    writer.flush()
+
+    assert count(db, "url_alias") == 1
+    assert count(db, "url_fingerprint") == 1
+    assert writer.failed_urls == []
+
+
+def test_failed_batch_is_written_page_by_page(db, monkeypatch):
+    fingerprints = FingerprintIndex()
+    writer = IndexWriter(db, dict(), fingerprints)
+    fill_link_words = db.fill_link_words_by_elements
+    calls = []
+
+    def fail_once(elements):
+        calls.append(elements)
+        if len(calls) == 2:
+            raise OperationalError("INSERT", {}, Exception("disk I/O error"))
+        fill_link_words(elements)
+
+    monkeypatch.setattr(db, "fill_link_words_by_elements", fail_once)
+    writer.add(make_page("http://a.com", ["alpha", "beta"], fingerprint=FIRST_FINGERPRINT))
+    writer.add(make_page("http://b.com", ["gamma", "delta"], fingerprint=SECOND_FINGERPRINT))
+    writer.flush()
+
+    # the fingerprints of the rolled back batch do not make the replayed
+    # pages near duplicates of themselves
+    assert count(db, "url_alias") == 0
+    assert count(db, "url_fingerprint") == 2
+    assert len(fingerprints) == 2
+    assert set(db.get_words_by_url(db.url_ids_dict["http://a.com"])) == {"alpha", "beta", "next"}
+    assert set(db.get_words_by_url(db.url_ids_dict["http://b.com"])) == {"gamma", "delta", "next"}
+    assert writer.failed_urls == []
+
+
+def test_failed_page_keeps_committed_fingerprints(db, monkeypatch):
+    fingerprints = FingerprintIndex()
+    writer = IndexWriter(db, dict(), fingerprints)
+    writer.add(make_page("http://a.com", ["alpha"], fingerprint=FIRST_FINGERPRINT))
+    writer.flush()
+
+    def fail(elements):
+        raise OperationalError("INSERT", {}, Exception("disk I/O error"))
+
+    monkeypatch.setattr(db, "fill_link_words_by_elements", fail)
+    writer.add(make_page("http://b.com", ["beta"], fingerprint=SECOND_FINGERPRINT))
+    writer.flush()
+
+    assert writer.failed_urls == ["http://b.com"]
+    assert fingerprints.find(FIRST_FINGERPRINT) == db.url_ids_dict["http://a.com"]
+    assert fingerprints.find(SECOND_FINGERPRINT) is None
@@ -0,0 +1,215 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from src.graph import LinkGraph, RankedGraph, spill_links
+from src.pagerank import (
+    build_pages,
+    build_transition,
+    loop_page_rank,
+    out_of_core_page_rank,
+    parallel_page_rank,
+    push_page_rank,
+    sparse_page_rank,
+)
+
+DAMPING = 0.85
+
+
+def small_graph() -> LinkGraph:
+    # 3 links to itself, 4 links to 3 twice, 5 and 6 have no outgoing
+    # links, 6 no links at all
+    links = [(1, 2), (1, 3), (2, 3), (3, 1), (3, 3), (4, 3), (4, 3), (2, 5)]
+    return graph_of(range(1, 7), links)
+
+
+def random_graph(seed: int) -> LinkGraph:
+    generator = np.random.default_rng(seed)
+    nodes_count = 40
+    from_ids = generator.integers(1, nodes_count * 3 // 4, 150)
+    to_ids = generator.integers(1, nodes_count + 1, 150)
+    return graph_of(range(1, nodes_count + 1), zip(from_ids.tolist(), to_ids.tolist()))
+
+
+def graph_of(url_ids, links) -> LinkGraph:
+    links = np.array(list(links), dtype=np.int64).reshape(-1, 2)
+    return LinkGraph.from_links(np.array(list(url_ids)), links[:, 0], links[:, 1])
+
+
+def links_of(graph: LinkGraph):
+    sources = graph.url_ids[graph.in_sources]
+    targets = graph.url_ids[graph.in_targets()]
+    return list(zip(sources.tolist(), targets.tolist()))
+
+
+def loop_ranks(graph: LinkGraph, iterations: int) -> np.ndarray:
+    pages = build_pages(graph)
+    loop_page_rank(pages, iterations, DAMPING)
+    return np.array([pages[url_id].rank for url_id in graph.url_ids.tolist()])
+
+
+def dense_ranks(graph: LinkGraph) -> np.ndarray:
+    """Ranks with the rank of pages without links spread over all pages,
+    solved as a linear system."""
+    nodes_count = graph.nodes_count
+    matrix = build_transition(graph).toarray()
+    matrix[:, graph.out_degrees == 0] += 1 / nodes_count
+    return np.linalg.solve(
+        np.eye(nodes_count) - DAMPING * matrix, np.full(nodes_count, 1 - DAMPING)
+    )
+
+
+GRAPHS = {"small": small_graph, "random": lambda: random_graph(0)}
+
+
+@pytest.fixture(params=GRAPHS.values(), ids=GRAPHS.keys())
+def graph(request) -> LinkGraph:
+    return request.param()
+
+
+def test_graph_degrees():
+    graph = small_graph()
+    assert graph.out_degrees.tolist() == [2, 2, 2, 2, 0, 0]
+    assert graph.links_count == 8
+
+
+def test_sparse_reproduces_loop(graph):
+    result = sparse_page_rank(
+        build_transition(graph),
+        graph.out_degrees,
+        DAMPING,
+        tolerance=0,
+        max_iterations=25,
+        redistribute_dangling=False,
+    )
+    assert result.iterations == 25
+    np.testing.assert_allclose(result.ranks, loop_ranks(graph, 25), rtol=1e-12)
+
+
+def test_sparse_converges(graph):
+    result = sparse_page_rank(
+        build_transition(graph), graph.out_degrees, DAMPING, tolerance=1e-12, max_iterations=500
+    )
+    assert result.residual <= 1e-12
+    np.testing.assert_allclose(result.ranks, dense_ranks(graph), rtol=1e-9)
+    assert result.ranks.sum() == pytest.approx(graph.nodes_count)
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 1 << 20])
+def test_out_of_core_matches_sparse(graph, tmp_path, block_size):
+    edge_file = spill_links(
+        graph.url_ids.tolist(), links_of(graph), str(tmp_path / "links.bin"), block_size
+    )
+    assert edge_file.links_count == graph.links_count
+    np.testing.assert_array_equal(edge_file.out_degrees, graph.out_degrees)
+    result = out_of_core_page_rank(
+        edge_file, DAMPING, tolerance=1e-12, max_iterations=500, block_size=block_size
+    )
+    np.testing.assert_allclose(result.ranks, dense_ranks(graph), rtol=1e-9)
+
+
+@pytest.mark.parametrize("processes", [1, 2, 3])
+def test_parallel_matches_sparse(graph, processes):
+    expected = sparse_page_rank(
+        build_transition(graph), graph.out_degrees, DAMPING, tolerance=1e-12, max_iterations=500
+    )
+    result = parallel_page_rank(
+        graph, DAMPING, tolerance=1e-12, max_iterations=500, processes=processes
+    )
+    assert result.iterations == expected.iterations
+    np.testing.assert_array_equal(result.ranks, expected.ranks)
+
+
+def test_parallel_with_spawned_workers(monkeypatch):
+    # the default start method on Windows and macOS
+    monkeypatch.setattr(multiprocessing, "Pool", multiprocessing.get_context("spawn").Pool)
+    graph = random_graph(1)
+    expected = sparse_page_rank(
+        build_transition(graph), graph.out_degrees, DAMPING, tolerance=1e-12, max_iterations=500
+    )
+    result = parallel_page_rank(graph, DAMPING, tolerance=1e-12, max_iterations=500, processes=2)
+    np.testing.assert_array_equal(result.ranks, expected.ranks)
+
+
+def stored_ranks(graph: LinkGraph) -> np.ndarray:
+    return sparse_page_rank(
+        build_transition(graph), graph.out_degrees, DAMPING, tolerance=1e-12, max_iterations=500
+    ).ranks
+
+
+def test_ranked_graph_queries():
+    graph = small_graph()
+    ranked = RankedGraph(graph, stored_ranks(graph))
+    assert ranked.get_links_from(np.array([1, 4, 6])).tolist() == [[1, 2], [1, 3], [4, 3], [4, 3]]
+    assert sorted(ranked.get_links_to(np.array([3])).tolist()) == [
+        [1, 3], [2, 3], [3, 3], [4, 3], [4, 3]
+    ]
+    assert ranked.get_out_degrees(np.array([2, 5])).tolist() == [2, 0]
+    assert ranked.last_url_id == 6
+
+
+def test_push_matches_loop_after_change(graph):
+    stored = stored_ranks(graph)
+    # links of the second page dropped, two new links and a new page
+    # linking to the first one
+    new_url_id = int(graph.url_ids.max()) + 1
+    first, second, last = (int(url_id) for url_id in graph.url_ids[[0, 1, -1]])
+    new_links = [(last, first), (first, last), (new_url_id, first)]
+    links = [link for link in links_of(graph) if link[0] != second] + new_links
+    changed = graph_of(graph.url_ids.tolist() + [new_url_id], links)
+    # the log holds the pages whose links changed with their old links
+    changed_url_ids = np.array([first, second, last, new_url_id])
+    changed_links = RankedGraph(graph, stored).get_links_from(changed_url_ids[:3])
+
+    result = push_page_rank(
+        RankedGraph(changed, np.append(stored, np.nan)),
+        changed_url_ids,
+        changed_links,
+        DAMPING,
+        1e-10,
+        changed.links_count * 1000,
+    )
+    assert new_url_id in result.url_ids
+    ranks = np.append(stored, np.nan)
+    ranks[np.searchsorted(changed.url_ids, result.url_ids)] = result.ranks
+    # the loop engine run to convergence, ranks of the push engine are a
+    # multiple of it on the scale of the stored ranks
+    ratios = ranks / loop_ranks(changed, 300)
+    np.testing.assert_allclose(ratios, ratios[0], rtol=1e-6)
+
+
+def test_push_without_changes_keeps_ranks(graph):
+    stored = stored_ranks(graph)
+    ranked = RankedGraph(graph, stored)
+    # first urls logged as changed, their links are the same
+    changed_url_ids = graph.url_ids[:3]
+    result = push_page_rank(
+        ranked,
+        changed_url_ids,
+        ranked.get_links_from(changed_url_ids),
+        DAMPING,
+        1e-6,
+        graph.links_count * 1000,
+    )
+    assert result.pushes == 0
+
+
+def test_push_gives_up(graph):
+    no_links = np.empty((0, 2), dtype=np.int64)
+    unranked = RankedGraph(graph, np.full(graph.nodes_count, np.nan))
+    # nothing keeps the scale
+    assert (
+        push_page_rank(unranked, graph.url_ids[:1], no_links, DAMPING, 1e-6, graph.links_count)
+        is None
+    )
+    ranked = RankedGraph(graph, stored_ranks(graph))
+    most_linking = graph.url_ids[np.argmax(graph.out_degrees)]
+    assert push_page_rank(ranked, np.array([most_linking]), no_links, DAMPING, 1e-6, 0) is None
+
+
+def test_empty_graph():
+    graph = graph_of([], [])
+    result = sparse_page_rank(build_transition(graph), graph.out_degrees, DAMPING, 0, 10)
+    assert len(result.ranks) == 0
+    assert len(parallel_page_rank(graph, DAMPING, 0, 10, processes=2).ranks) == 0
@@ -0,0 +1,56 @@
+import pytest
+
+from src.parser import Parser
+
+PAGES = {
+    "cdata": "<div><![CDATA[cdata text]]>after</div>",
+    "declaration": "<div><!ELEMENT note (to)>after</div><p>para</p>",
+    "processing_instruction": "<div><?php echo 1 ?>after pi</div>",
+    "doctype": "<!DOCTYPE html><html><body><p>doc</p></body></html>",
+    "comment": "<p><!-- hidden words -->visible text</p>",
+    "comment_first": "<div><!--x-->a<b>bold</b></div>",
+    "script": "<div><script>var x = 'no';</script>shown <span>span</span></div>",
+    "style": "<style>p {color: red}</style><p>styled</p>",
+    "template": "<template><p>tpl</p></template><p>out</p>",
+    "meta": "<head><meta content='x'><title>Title here</title></head>",
+    "unclosed_tags": "<div><p>one<p>two<span>three</div>four",
+    "stray_end_tags": "<div>a</span>b</div></p>c",
+    "unterminated_attribute": '<a href="http://x.com/a>link text</a><p>after',
+    "links": (
+        "<a href='http://a.com/'>first <b>bold</b></a><a href='mailto:x@y'>mail</a>"
+        "<a>no href</a><a href='http://a.com/p.pdf'>pdf</a>"
+    ),
+    "entities": "<p>caf&eacute; &amp; bar &#1087;&#1088;&#1080;</p>",
+    "void_tags": "<p>a<br>b<img src=x>c</p>",
+    "self_closing": "<div/><p>x</p><span/>y",
+    "uppercase": "<DIV>Upper <A HREF='http://u.com'>Link</A></DIV>",
+    "textarea": "<textarea><b>not tag</b></textarea>",
+    "deep": "<div>" * 50 + "deep" + "</div>" * 50,
+    "text_only": "just text",
+    "empty": "",
+}
+
+
+@pytest.mark.parametrize("html", PAGES.values(), ids=PAGES.keys())
+def test_engines_agree(html):
+    assert Parser("stream").parse_text_elements(html) == Parser(
+        "soup"
+    ).parse_text_elements(html)
+
+
+@pytest.mark.parametrize("engine", Parser.ENGINES)
+def test_cdata_text_is_read(engine):
+    words = [element.word for element in Parser(engine).parse_text_elements(PAGES["cdata"])]
+    assert words == ["cdata", "text"]
+
+
+@pytest.mark.parametrize("engine", Parser.ENGINES)
+def test_skipped_text(engine):
+    html = PAGES["script"] + PAGES["comment"] + PAGES["style"]
+    words = [element.word for element in Parser(engine).parse_text_elements(html)]
+    assert words == ["shown", "span", "visible", "text", "styled"]
+
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        Parser("regex")
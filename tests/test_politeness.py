@@ -0,0 +1,251 @@
+import asyncio
+
+import aiohttp
+import pytest
+from aiohttp import hdrs, web
+from aiohttp.test_utils import TestServer
+
+from src.fetcher import Fetcher
+from src.model import LinkToGo, UrlState
+from src.politeness import HostScheduler, RobotsCache, TokenBucket
+
+
+class FakeResponse:
+    def __init__(self, status: int, text: str) -> None:
+        self.status = status
+        self._text = text
+
+    async def __aenter__(self) -> "FakeResponse":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        pass
+
+    async def text(self, errors: str = "strict") -> str:
+        return self._text
+
+
+class FakeSession:
+    """Answers every robots.txt request with the same response or error."""
+
+    def __init__(self, status: int = 200, text: str = "", error: Exception = None) -> None:
+        self.status = status
+        self.text = text
+        self.error = error
+        self.requested = []
+
+    def get(self, url: str, timeout=None) -> FakeResponse:
+        self.requested.append(url)
+        if self.error is not None:
+            raise self.error
+        return FakeResponse(self.status, self.text)
+
+
+def can_fetch(robots: RobotsCache, session: FakeSession, url: str) -> bool:
+    return asyncio.run(robots.can_fetch(session, url))
+
+
+def test_bucket_starts_full():
+    bucket = TokenBucket(rate=1.0, capacity=2)
+    now = bucket.updated_at
+    assert bucket.try_acquire(now)
+    assert bucket.try_acquire(now)
+    assert not bucket.try_acquire(now)
+
+
+def test_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=2.0, capacity=2)
+    now = bucket.updated_at
+    bucket.try_acquire(now)
+    bucket.try_acquire(now)
+    assert bucket.wait_time(now) == pytest.approx(0.5)
+    assert not bucket.try_acquire(now + 0.25)
+    assert bucket.try_acquire(now + 0.5)
+
+
+def test_bucket_ignores_earlier_time():
+    # pop_ready reads the clock before a new host gets its bucket
+    bucket = TokenBucket(rate=1.0, capacity=1)
+    assert bucket.try_acquire(bucket.updated_at - 0.001)
+
+
+def test_bucket_refill_is_capped():
+    bucket = TokenBucket(rate=10.0, capacity=2)
+    now = bucket.updated_at + 100
+    assert bucket.wait_time(now) == 0.0
+    assert bucket.tokens == 2
+
+
+def test_robots_rules():
+    session = FakeSession(text="User-agent: *\nDisallow: /private\n")
+    robots = RobotsCache()
+    assert can_fetch(robots, session, "http://a.com/page")
+    assert not can_fetch(robots, session, "http://a.com/private/page")
+    assert session.requested == ["http://a.com/robots.txt"]
+    assert robots.is_loaded("a.com")
+    assert not robots.is_loaded("b.com")
+
+
+def test_robots_fetch_failure_allows_all():
+    session = FakeSession(error=aiohttp.ClientConnectionError("refused"))
+    robots = RobotsCache()
+    assert can_fetch(robots, session, "http://a.com/private/page")
+    assert robots.is_loaded("a.com")
+    assert robots.crawl_delay("a.com") is None
+
+
+@pytest.mark.parametrize("status, allowed", [(401, False), (403, False), (404, True)])
+def test_robots_error_status(status, allowed):
+    robots = RobotsCache()
+    assert can_fetch(robots, FakeSession(status=status), "http://a.com/page") == allowed
+
+
+def test_robots_is_fetched_once_per_host():
+    session = FakeSession()
+    robots = RobotsCache()
+
+    async def fetch_all():
+        return await asyncio.gather(
+            *(robots.can_fetch(session, f"http://a.com/{i}") for i in range(5))
+        )
+
+    assert all(asyncio.run(fetch_all()))
+    assert session.requested == ["http://a.com/robots.txt"]
+
+
+def test_round_robin_between_hosts():
+    scheduler = HostScheduler(RobotsCache(), rate=1.0, burst=10)
+    for i in range(3):
+        scheduler.push(LinkToGo(f"http://a.com/{i}"))
+    scheduler.push(LinkToGo("http://b.com/0"))
+    scheduler.push(LinkToGo("http://c.com/0"))
+    assert len(scheduler) == 5
+
+    ready = scheduler.pop_ready(limit=3)
+    assert [link.link for link in ready] == ["http://a.com/0", "http://b.com/0", "http://c.com/0"]
+    # one link per host and call
+    assert [link.link for link in scheduler.pop_ready(limit=3)] == ["http://a.com/1"]
+    assert [link.link for link in scheduler.pop_ready(limit=3)] == ["http://a.com/2"]
+    assert len(scheduler) == 0
+    assert scheduler.next_ready_in() is None
+
+
+def test_host_rate_is_limited():
+    scheduler = HostScheduler(RobotsCache(), rate=1.0, burst=2)
+    for i in range(5):
+        scheduler.push(LinkToGo(f"http://a.com/{i}"))
+    scheduler.push(LinkToGo("http://b.com/0"))
+
+    assert len(scheduler.pop_ready(limit=10)) == 2
+    assert len(scheduler.pop_ready(limit=10)) == 1
+    assert len(scheduler.pop_ready(limit=10)) == 0
+    assert 0 < scheduler.next_ready_in() <= 1.0
+    assert len(scheduler) == 3
+    assert [link.link for link in scheduler.drain()] == [f"http://a.com/{i}" for i in (2, 3, 4)]
+    assert len(scheduler) == 0
+
+
+def test_crawl_delay_caps_host_rate():
+    robots = RobotsCache()
+    can_fetch(robots, FakeSession(text="User-agent: *\nCrawl-delay: 10\n"), "http://a.com/")
+    assert robots.crawl_delay("a.com") == 10.0
+
+    scheduler = HostScheduler(robots, rate=2.0, burst=5)
+    for i in range(3):
+        scheduler.push(LinkToGo(f"http://a.com/{i}"))
+    assert len(scheduler.pop_ready(limit=10)) == 1
+    assert scheduler.pop_ready(limit=10) == []
+    assert scheduler.next_ready_in() == pytest.approx(10.0, rel=0.01)
+
+
+def test_crawl_delay_does_not_raise_host_rate():
+    robots = RobotsCache()
+    can_fetch(robots, FakeSession(text="User-agent: *\nCrawl-delay: 0.1\n"), "http://a.com/")
+    scheduler = HostScheduler(robots, rate=2.0, burst=5)
+    scheduler.push(LinkToGo("http://a.com/0"))
+    scheduler.pop_ready(limit=1)
+    assert scheduler._buckets["a.com"].rate == 2.0
+
+
+class LocalSite:
+    """Pages of a stand-in host served by aiohttp on localhost."""
+
+    ROBOTS = "User-agent: *\nDisallow: /private\n"
+    ETAG = '"v1"'
+
+    def __init__(self) -> None:
+        self.requested = []
+        self.active = 0
+        self.max_active = 0
+        self.app = web.Application()
+        self.app.router.add_get("/robots.txt", self.robots)
+        self.app.router.add_get("/old", self.redirect)
+        self.app.router.add_get("/{path:.*}", self.page)
+
+    async def robots(self, request: web.Request) -> web.Response:
+        self.requested.append(request.path)
+        return web.Response(text=self.ROBOTS)
+
+    async def redirect(self, request: web.Request) -> web.Response:
+        self.requested.append(request.path)
+        raise web.HTTPMovedPermanently("/page")
+
+    async def page(self, request: web.Request) -> web.Response:
+        self.requested.append(request.path)
+        if request.headers.get(hdrs.IF_NONE_MATCH) == self.ETAG:
+            return web.Response(status=304)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(0.02)
+        self.active -= 1
+        return web.Response(
+            text=f"<p>{request.path}</p>",
+            content_type="text/html",
+            headers={hdrs.ETAG: self.ETAG},
+        )
+
+
+def fetch_from_site(site: LocalSite, paths, fetcher: Fetcher):
+    async def fetch_all():
+        async with TestServer(site.app) as server, fetcher:
+            links = [LinkToGo(str(server.make_url(path))) for path in paths]
+            return await asyncio.gather(*(fetcher.fetch(link) for link in links))
+
+    return asyncio.run(fetch_all())
+
+
+def test_local_server_robots_disallow():
+    site = LocalSite()
+    page, private = fetch_from_site(site, ["/page", "/private/page"], Fetcher(RobotsCache()))
+    assert page.text == "<p>/page</p>"
+    assert page.etag == LocalSite.ETAG
+    assert private.text == ""
+    # robots.txt is read once and the disallowed page is never requested
+    assert sorted(site.requested) == ["/page", "/robots.txt"]
+
+
+def test_local_server_redirect_and_not_modified():
+    site = LocalSite()
+    [moved] = fetch_from_site(site, ["/old"], Fetcher())
+    assert moved.text == "<p>/page</p>"
+
+    site = LocalSite()
+
+    async def fetch_known_page():
+        async with TestServer(site.app) as server:
+            url = str(server.make_url("/page"))
+            states = {url: UrlState(url_id=1, etag=LocalSite.ETAG)}
+            async with Fetcher(url_states=states) as fetcher:
+                return await fetcher.fetch(LinkToGo(url))
+
+    unchanged = asyncio.run(fetch_known_page())
+    assert unchanged.not_modified
+    assert unchanged.text == ""
+
+
+def test_local_server_connections_per_host_limit(monkeypatch):
+    monkeypatch.setattr(Fetcher, "CONNECTIONS_PER_HOST_LIMIT", 3)
+    site = LocalSite()
+    results = fetch_from_site(site, [f"/{i}" for i in range(12)], Fetcher())
+    assert all(result.text for result in results)
+    assert site.max_active == 3
@@ -0,0 +1,143 @@
+import numpy as np
+import pytest
+from sqlalchemy import event
+
+from src.model import Element
+from src.rankerer import PageRankerer
+
+
+def write_links(db, url, links):
+    url_id = db.insert_url(url)
+    elements = [Element(word="", href=link) for link in links]
+    db.insert_links_from_elements(elements)
+    db.insert_links_between_by_elements(elements, url_id)
+
+
+def recrawl(db, url, links):
+    db.delete_url_index(db.url_ids_dict[url])
+    write_links(db, url, links)
+
+
+def stored_ranks(db):
+    db.rollback()
+    return dict(map(tuple, db.iter_page_ranks()))
+
+
+URLS = [f"http://a.com/{i}" for i in range(30)]
+
+
+def first_links():
+    generator = np.random.default_rng(0)
+    # the last pages are linked to but not crawled
+    return {
+        url: [URLS[i] for i in generator.choice(len(URLS), 4, replace=False)]
+        for url in URLS[:25]
+    }
+
+
+@pytest.fixture
+def ranked_db(db):
+    for url, links in first_links().items():
+        write_links(db, url, links)
+    db.commit()
+    calculate(tolerance=1e-12)
+    assert db.get_page_rank_changes() == []
+
+    # the recrawl finds a page that is not crawled yet
+    recrawl(db, URLS[0], URLS[1:3] + ["http://a.com/uncrawled"])
+    write_links(db, "http://a.com/new", [URLS[0], URLS[5]])
+    write_links(db, URLS[7], ["http://a.com/new"])
+    db.commit()
+    return db
+
+
+def calculate(engine="sparse", **settings):
+    rankerer = PageRankerer(use_snapshot=False, engine=engine)
+    for name, value in settings.items():
+        setattr(rankerer, name, value)
+    rankerer.calculate_ranks()
+    rankerer.close()
+
+
+def update(engine="sparse", **settings):
+    rankerer = PageRankerer(use_snapshot=False, engine=engine)
+    for name, value in settings.items():
+        setattr(rankerer, name, value)
+    rankerer.update_ranks()
+    rankerer.close()
+
+
+def test_changes_are_logged(ranked_db):
+    url_ids = ranked_db.url_ids_dict
+    changed = [
+        url_ids[url] for url in (URLS[0], URLS[7], "http://a.com/new", "http://a.com/uncrawled")
+    ]
+    assert ranked_db.get_page_rank_changes() == sorted(changed)
+    # links the ranks were calculated with, not the recrawled or new ones
+    old_links = ranked_db.get_page_rank_change_links(np.array(changed))
+    assert sorted(map(tuple, old_links.tolist())) == sorted(
+        (url_ids[url], url_ids[link]) for url in URLS[:8:7] for link in first_links()[url]
+    )
+
+
+def test_update_matches_full_calculation(ranked_db):
+    update(push_tolerance=1e-12, push_max_links_share=1000)
+    assert ranked_db.get_page_rank_changes() == []
+    updated = stored_ranks(ranked_db)
+
+    calculate(tolerance=1e-12)
+    full = stored_ranks(ranked_db)
+    assert updated.keys() == full.keys()
+    # the update keeps the scale of the stored ranks
+    ratios = np.array([updated[url_id] / full[url_id] for url_id in full])
+    np.testing.assert_allclose(ratios, ratios[0], rtol=1e-8)
+
+
+def test_update_falls_back_to_full_calculation(ranked_db):
+    update(tolerance=1e-12, push_max_links_share=0)
+    assert ranked_db.get_page_rank_changes() == []
+    updated = stored_ranks(ranked_db)
+
+    calculate(tolerance=1e-12)
+    full = stored_ranks(ranked_db)
+    assert updated == pytest.approx(full, rel=1e-12)
+
+
+def test_update_without_changes(ranked_db):
+    update(push_max_links_share=1000)
+    before = stored_ranks(ranked_db)
+    update(push_max_links_share=1000)
+    assert stored_ranks(ranked_db) == before
+
+
+def test_update_falls_back_to_configured_engine(ranked_db, monkeypatch):
+    def sparse_page_rank(*args, **kwargs):
+        raise AssertionError("sparse engine used")
+
+    with monkeypatch.context() as patch:
+        patch.setattr("src.rankerer.sparse_page_rank", sparse_page_rank)
+        update(engine="out_of_core", tolerance=1e-12, push_max_links_share=0)
+    updated = stored_ranks(ranked_db)
+
+    calculate(tolerance=1e-12)
+    assert updated == pytest.approx(stored_ranks(ranked_db), rel=1e-9)
+
+
+def test_new_pages_do_not_read_links(db):
+    # links of a url are only logged when it is crawled again after the
+    # ranks were calculated, during a bulk load link_between_url has no index
+    statements = []
+    event.listen(
+        db.db.get_bind(),
+        "before_cursor_execute",
+        lambda connection, cursor, statement, *args: statements.append(statement),
+    )
+    for url, links in first_links().items():
+        write_links(db, url, links)
+    recrawl(db, URLS[0], URLS[1:3])
+    db.commit()
+    assert not [
+        statement
+        for statement in statements
+        if "SELECT" in statement and "FROM link_between_url" in statement
+    ]
@@ -0,0 +1,61 @@
+from src.postings import decode_positions
+from src.segments import SegmentBuilder, SegmentIndex, SegmentReader, SegmentStore
+
+
+def add_page(builder, url_id, words):
+    builder.add_document(url_id)
+    builder.add_postings(url_id, [(word, location) for location, word in enumerate(words)])
+
+
+def test_forward_section(tmp_path):
+    builder = SegmentBuilder()
+    add_page(builder, 3, ["b", "a", "b", "ц"])
+    add_page(builder, 1, ["a"])
+    builder.add_document(2)
+    path = str(tmp_path / "segment.seg")
+    builder.write(path)
+
+    reader = SegmentReader(path)
+    try:
+        forward = {word: decode_positions(positions) for word, positions in reader.forward(3)}
+        assert forward == {"a": [1], "b": [0, 2], "ц": [3]}
+        assert [word for word, _ in reader.forward(1)] == ["a"]
+        assert list(reader.forward(2)) == []
+        assert list(reader.forward(4)) == []
+        # the forward section holds the same postings as the terms
+        assert {
+            (word, url_id, positions)
+            for word, url_postings in reader.terms()
+            for url_id, positions in url_postings.items()
+        } == {
+            (word, url_id, positions)
+            for url_id in (1, 2, 3)
+            for word, positions in reader.forward(url_id)
+        }
+    finally:
+        reader.close()
+
+
+def test_words_by_url_reads_newest_segment(tmp_path):
+    directory = str(tmp_path)
+    store = SegmentStore(directory, merge_factor=2)
+    builder = SegmentBuilder()
+    add_page(builder, 1, ["old", "words"])
+    add_page(builder, 2, ["kept", "page"])
+    store.add(builder)
+    builder = SegmentBuilder()
+    add_page(builder, 1, ["new", "words", "here"])
+    store.add(builder)
+
+    index = SegmentIndex(directory)
+    index.refresh()
+    assert index.words_by_url(1) == ("new", "words", "here")
+    assert index.words_by_url(2) == ("kept", "page")
+    assert index.words_by_url(3) == tuple()
+
+    assert store.merge_once()
+    index.refresh()
+    assert len(index.readers) == 1
+    assert index.words_by_url(1) == ("new", "words", "here")
+    assert index.words_by_url(2) == ("kept", "page")
+    index.close()
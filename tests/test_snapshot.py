@@ -0,0 +1,37 @@
+import numpy as np
+
+from src.model import Element
+from src.snapshot import Snapshot, export_snapshot
+
+PAGES = {
+    "http://a.com": ["first", "page", "words", "page"],
+    "http://b.com": ["second", "page"],
+    "http://c.com": [],
+}
+
+
+def fill(db):
+    for url, words in PAGES.items():
+        url_id = db.insert_url(url)
+        elements = [Element(word=word, location=i) for i, word in enumerate(words)]
+        db.insert_words_from_elements(elements)
+        db.fill_words_locations_by_elements(elements, url_id)
+    db.commit()
+
+
+def test_words_by_url(db, tmp_path):
+    fill(db)
+    export_snapshot(str(tmp_path / "snapshot"))
+    snapshot = Snapshot(str(tmp_path / "snapshot"))
+
+    for url, words in PAGES.items():
+        assert snapshot.get_words_by_url(db.url_ids_dict[url]) == tuple(words)
+    assert snapshot.get_words_by_url(max(db.url_ids_dict.values()) + 1) == tuple()
+
+    # every posting is listed once under its url
+    urls_of_postings = np.repeat(
+        snapshot.url_ids, np.diff(snapshot.url_posting_offsets.astype(np.int64))
+    )
+    url_postings = snapshot.url_postings.astype(np.int64)
+    assert sorted(url_postings.tolist()) == list(range(len(snapshot.posting_url_ids)))
+    np.testing.assert_array_equal(snapshot.posting_url_ids[url_postings], urls_of_postings)